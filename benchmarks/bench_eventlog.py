@@ -0,0 +1,106 @@
+"""Compare the storage used by the event log with the sampled data logs.
+
+Usage:
+    python benchmarks/bench_eventlog.py [--days N] [--resolution SECONDS]
+
+Simulates the status over a number of days, changing every few seconds as
+the sensors are read, with the fan cycling and the lights switching on and
+off. The status is written to:
+
+    text        the text data log at the default 5 minute interval, which
+                misses anything shorter.
+    text, fast  the text data log sampled at the event resolution.
+    binary      the binary data log sampled at the event resolution.
+    event       the event log, with the deadbands from config_example.yaml.
+
+Then reports the bytes per day of each, and the time taken to read back
+and resample a day of the event log.
+"""
+import os
+import sys
+import argparse
+import tempfile
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pisces.binlog import BinaryLogWriter
+from pisces.eventlog import EventLogWriter
+from pisces.utils import get_log_dtype, log_names, read_log
+
+log_interval = 300  # Seconds
+deadband = {'water_temp': 0.01, 'air_temp': 0.05, 'water_level': 0.05}
+
+
+def simulate(days, resolution):
+    """Returns a simulated status every resolution seconds, as a data log structured array."""
+    rng = np.random.default_rng(42)
+    n_samples = int(days * 86400 // resolution)
+    status = np.zeros(n_samples, dtype=get_log_dtype())
+    status['log_time'] = np.datetime64('2019-05-01T00:00:00') + np.arange(n_samples) * int(resolution)
+    hours = np.arange(n_samples) * resolution / 3600
+    # DS18B20 readings are in steps of 1/16 deg C.
+    status['water_temp'] = np.round((25.5 + 0.5 * np.sin(2 * np.pi * (hours - 9) / 24) +
+                                     rng.normal(0, 0.03, n_samples)) * 16) / 16
+    status['air_temp'] = np.round((24.5 + np.sin(2 * np.pi * (hours - 9) / 24) +
+                                   rng.normal(0, 0.03, n_samples)) * 16) / 16
+    status['water_level'] = np.round(10 + rng.normal(0, 0.01, n_samples), 2)
+    status['water_temp_status'] = np.where(status['water_temp'] > 26, 'HIGH', 'OK')
+    status['water_level_status'] = 'OK'
+    status['lights_auto'] = status['fan_auto'] = status['pump_auto'] = True
+    status['lights_enabled'] = (hours % 24 >= 7.5) & (hours % 24 < 19.5)
+    # Fan runs for a couple of minutes at a time while the water is warm.
+    status['fan_enabled'] = (status['water_temp'] > 25.9) & (hours % 0.25 < 0.04)
+    return status
+
+
+def write_text(filename, status):
+    with open(filename, 'w') as log_file:
+        for record in status:
+            values = tuple(record[name] for name in log_names[1:])
+            log_file.write("{}+1000 {:2.3f} {:<4} {:2.3f} {:2.1f} {:<4} {:<5} {:<5} {:<5} {:<5} {:<5} {:<5} {:<5}\n".format(
+                record['log_time'], *values))
+
+
+def directory_size(directory, prefix):
+    return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)
+               if name.startswith(prefix))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--days', type=int, default=7, help="days of data to simulate")
+    parser.add_argument('--resolution', type=float, default=10, help="seconds between status changes")
+    args = parser.parse_args()
+
+    status = simulate(args.days, args.resolution)
+    with tempfile.TemporaryDirectory() as data_dir:
+        write_text(os.path.join(data_dir, 'slow.dat'), status[::int(log_interval // args.resolution)])
+        write_text(os.path.join(data_dir, 'fast.dat'), status)
+        binary_log = BinaryLogWriter(os.path.join(data_dir, 'pisces.bin'))
+        for record in status:
+            binary_log.append(record)
+        event_log = EventLogWriter(os.path.join(data_dir, 'pisces.evt'), deadband=deadband)
+        n_events = sum(1 for record in status if event_log.append(record['log_time'], record))
+        event_log.close()
+
+        print("{:<12} {:>12} {:>14}".format('log', 'resolution/s', 'kB per day'))
+        for label, prefix, resolution in (('text', 'slow.dat', log_interval),
+                                          ('text, fast', 'fast.dat', args.resolution),
+                                          ('binary', 'pisces.bin', args.resolution),
+                                          ('event', 'pisces.evt', args.resolution)):
+            print("{:<12} {:>12g} {:>14.1f}".format(label, resolution,
+                                                    directory_size(data_dir, prefix) / args.days / 1000))
+        print("{} event log records for {} samples".format(n_events, len(status)))
+
+        event_root = os.path.join(data_dir, 'pisces.evt')
+        read_time = min(timeit.repeat(lambda: read_log(event_root, start='2019-05-02', end='2019-05-03',
+                                                       interval=log_interval),
+                                      number=1, repeat=5))
+        print("Read and resample 1 day of event log: {:.1f} ms".format(read_time * 1000))
+
+
+if __name__ == '__main__':
+    main()
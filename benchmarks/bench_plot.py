@@ -0,0 +1,110 @@
+"""Compare rendering the data log plot with a reused figure against building a new one each time.
+
+Usage:
+    python benchmarks/bench_plot.py [--frames N]
+
+Renders a series of frames of synthetic data covering 24 hours and 7 days at
+the default 5 minute logging interval, moving the window on by one sample
+each frame as the data logger does. Times the old approach of creating a
+whole new figure per frame against plot_log, which updates a persistent
+LogPlot.
+"""
+import os
+import sys
+import argparse
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
+from matplotlib.figure import Figure
+
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pisces.utils import plot_log, get_log_dtype
+
+durations = (('24 hours', 24), ('7 days', 24 * 7))
+log_interval = 300  # Seconds
+temp_limits = [18, 30]
+target_limits = [25, 26]
+
+
+def make_log_data(n_records):
+    """Returns synthetic data log records at log_interval."""
+    rng = np.random.default_rng(42)
+    log_data = np.zeros(n_records, dtype=get_log_dtype())
+    log_data['log_time'] = np.datetime64('2019-05-01T00:00:00') + np.arange(n_records) * log_interval
+    log_data['water_temp'] = 25 + rng.random(n_records)
+    log_data['air_temp'] = 24 + rng.random(n_records)
+    log_data['fan_enabled'] = np.arange(n_records) % 3 == 0
+    log_data['lights_enabled'] = (np.arange(n_records) // 144) % 2 == 0
+    return log_data
+
+
+def plot_log_new_figure(log_data, filename, duration):
+    """The plot rendering used before the figure was reused."""
+    fig = Figure()
+    FigureCanvas(fig)
+    fig.set_size_inches(12, 8)
+    ax = fig.add_subplot(1, 1, 1)
+    ax.fill_between(log_data['log_time'], target_limits[0], target_limits[1], color='g', alpha=0.1)
+    ax.plot(log_data['log_time'], log_data['water_temp'], 'b-', label='Water temperature')
+    ax.plot(log_data['log_time'], log_data['air_temp'], 'c-', label='Air temperature')
+    fan_on_times = log_data['log_time'][log_data['fan_enabled'] == True]
+    ax.plot(fan_on_times, temp_limits[1] * np.ones(fan_on_times.shape),
+            'yo', label='Cooling fan on')
+    lights_on_times = log_data['log_time'][log_data['lights_enabled'] == True]
+    ax.plot(lights_on_times, temp_limits[0] * np.ones(lights_on_times.shape),
+            'go', label='Lights on')
+    ax.legend(loc=0)
+    ax.set_xlim(log_data['log_time'].min(), log_data['log_time'].max())
+    ax.set_xlabel("Local datetime")
+    ax.set_ylabel(r'Temperature / $\degree$C')
+    ax.set_ylim(*temp_limits)
+    ax.set_title("Temperatures over {} hours up to {}".format(duration, log_data[-1]['log_time']))
+    fig.tight_layout()
+    fig.savefig(filename, transparent=False)
+    fig.clf()
+    del fig
+
+
+def time_frames(render, log_data, n_records, n_frames):
+    """Returns the mean seconds per frame for n_frames successive windows of log_data."""
+    start = time.perf_counter()
+    for frame in range(n_frames):
+        render(log_data[frame:frame + n_records])
+    return (time.perf_counter() - start) / n_frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--frames', type=int, default=10, help="frames to render per measurement")
+    args = parser.parse_args()
+
+    print("{:<9} {:>7} {:>14} {:>14} {:>8}".format('span', 'records', 'new fig/ms', 'reused/ms', 'speedup'))
+    with tempfile.TemporaryDirectory() as plot_dir:
+        filename_root = os.path.join(plot_dir, 'temperature')
+        for label, duration in durations:
+            n_records = duration * 3600 // log_interval
+            log_data = make_log_data(n_records + args.frames)
+
+            def render_new_figure(data):
+                plot_log_new_figure(data, "{}_old.png".format(filename_root), duration)
+
+            def render_reused(data):
+                plot_log(filename_root=filename_root, temp_limits=temp_limits, target_limits=target_limits,
+                         duration=duration, log_data=data)
+
+            # Build the persistent figure first, so only the per frame cost is timed.
+            render_reused(log_data[:n_records])
+            old_time = time_frames(render_new_figure, log_data, n_records, args.frames)
+            new_time = time_frames(render_reused, log_data, n_records, args.frames)
+            print("{:<9} {:>7} {:>14.1f} {:>14.1f} {:>7.1f}x".format(label, n_records,
+                                                                    old_time * 1000,
+                                                                    new_time * 1000,
+                                                                    old_time / new_time))
+
+
+if __name__ == '__main__':
+    main()
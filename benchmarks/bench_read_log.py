@@ -0,0 +1,137 @@
+"""Compare the vectorised data log parser with the old genfromtxt parser.
+
+Usage:
+    python benchmarks/bench_read_log.py [--repeats N]
+
+Writes synthetic data logs covering 1 day, 1 week and 1 month at the default
+5 minute logging interval to a temporary directory, then times read_log
+against the genfromtxt with per field converters approach it replaced.
+
+Then splits a year of data into daily rotated logs and compares the size of
+the rotated logs and the time to read from them, uncompressed and block
+compressed (see pisces.compressedlog).
+"""
+import os
+import sys
+import argparse
+import shutil
+import tempfile
+import timeit
+from datetime import datetime, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pisces.compressedlog import compress_log
+from pisces.utils import get_last_n_lines, read_log, log_names, log_dtypes
+
+durations = (('1 day', 1), ('1 week', 7), ('1 month', 30))
+log_interval = 300  # Seconds
+
+
+def write_log(filename, n_lines):
+    """Writes a synthetic text data log in the DataLogger format."""
+    rng = np.random.default_rng(42)
+    start = datetime(2019, 5, 1)
+    with open(filename, 'w') as log_file:
+        for i in range(n_lines):
+            log_time = start + timedelta(seconds=i * log_interval)
+            values = (25 + rng.random(), 'OK', 24 + rng.random(), 10.5, 'OK',
+                      False, True, bool(i % 2), True, bool(i % 3), True, False)
+            log_file.write("{} {:2.3f} {:<4} {:2.3f} {:2.1f} {:<4} {:<5} {:<5} {:<5} {:<5} {:<5} {:<5} {:<5}\n".format(
+                log_time.strftime("%Y-%m-%dT%H:%M:%S+1000"), *values))
+
+
+def read_log_genfromtxt(filename, n_lines=1, max_line_size=120):
+    """The data log parser used before the vectorised one."""
+    time_converter = lambda t: np.datetime64(t[:19], 's')
+    bool_converter = lambda b: bool(int(b))
+    log_lines = get_last_n_lines(filename, n_lines, max_line_size)
+    return np.genfromtxt(log_lines,
+                         names=log_names,
+                         dtype=log_dtypes,
+                         converters={'log_time': time_converter,
+                                     'overflow': bool_converter,
+                                     'lights_auto': bool_converter,
+                                     'lights_enabled': bool_converter,
+                                     'fan_auto': bool_converter,
+                                     'fan_enabled': bool_converter,
+                                     'pump_auto': bool_converter,
+                                     'pump_enabled': bool_converter},
+                         filling_values=np.nan)
+
+
+def write_rotated_logs(data_dir, days):
+    """Writes a synthetic data log as daily rotated logs plus the current log, returns its path."""
+    filename = os.path.join(data_dir, 'pisces.dat')
+    write_log(filename, days * 86400 // log_interval)
+    with open(filename) as log_file:
+        lines = log_file.readlines()
+    lines_per_day = 86400 // log_interval
+    for first in range(0, len(lines) - lines_per_day, lines_per_day):
+        with open("{}.{}".format(filename, lines[first][:10]), 'w') as rotated_log:
+            rotated_log.writelines(lines[first:first + lines_per_day])
+    with open(filename, 'w') as log_file:
+        log_file.writelines(lines[-lines_per_day:])
+    return filename
+
+
+def rotated_size(data_dir):
+    return sum(os.path.getsize(os.path.join(data_dir, name)) for name in os.listdir(data_dir)
+               if name.startswith('pisces.dat.') and not name.endswith('.idx'))
+
+
+def bench_compressed(repeats, days=365):
+    reads = (('last 1 week', dict(n_lines=7 * 86400 // log_interval)),
+             ('1 day, 6 months ago', dict(start='2019-11-01T00:00:00', end='2019-11-02T00:00:00')))
+    print("\n{:<20} {:>14} {:>14}".format('rotated logs', 'plain', 'compressed'))
+    with tempfile.TemporaryDirectory() as plain_dir, tempfile.TemporaryDirectory() as compressed_dir:
+        plain_log = write_rotated_logs(plain_dir, days)
+        for name in os.listdir(plain_dir):
+            shutil.copy(os.path.join(plain_dir, name), compressed_dir)
+        compressed_log = os.path.join(compressed_dir, 'pisces.dat')
+        for name in os.listdir(compressed_dir):
+            if name.startswith('pisces.dat.'):
+                compress_log(os.path.join(compressed_dir, name))
+        print("{:<20} {:>11.0f} kB {:>11.0f} kB".format("{} days".format(days),
+                                                         rotated_size(plain_dir) / 1000,
+                                                         rotated_size(compressed_dir) / 1000))
+        for label, kwargs in reads:
+            assert np.array_equal(read_log(plain_log, **kwargs), read_log(compressed_log, **kwargs))
+            times = [min(timeit.repeat(lambda: read_log(log, **kwargs), number=1, repeat=repeats))
+                     for log in (plain_log, compressed_log)]
+            print("{:<20} {:>11.1f} ms {:>11.1f} ms".format(label, *(time * 1000 for time in times)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeats', type=int, default=5, help="timing repeats, best is reported")
+    args = parser.parse_args()
+
+    print("{:<8} {:>7} {:>14} {:>14} {:>8}".format('span', 'lines', 'genfromtxt/ms', 'vectorised/ms', 'speedup'))
+    with tempfile.TemporaryDirectory() as data_dir:
+        for label, days in durations:
+            n_lines = days * 86400 // log_interval
+            filename = os.path.join(data_dir, 'pisces.dat')
+            write_log(filename, n_lines)
+
+            old = read_log_genfromtxt(filename, n_lines)
+            new = read_log(filename, n_lines)
+            assert old.dtype.names == new.dtype.names
+            assert all(np.array_equal(old[name], new[name]) for name in log_names)
+
+            old_time = min(timeit.repeat(lambda: read_log_genfromtxt(filename, n_lines),
+                                         number=1, repeat=args.repeats))
+            new_time = min(timeit.repeat(lambda: read_log(filename, n_lines),
+                                         number=1, repeat=args.repeats))
+            print("{:<8} {:>7} {:>14.1f} {:>14.1f} {:>7.1f}x".format(label, n_lines,
+                                                                   old_time * 1000,
+                                                                   new_time * 1000,
+                                                                   old_time / new_time))
+
+    bench_compressed(args.repeats)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""Measure how long Pisces takes to start up.
+
+Usage:
+    python benchmarks/bench_startup.py [--repeats N]
+
+Each measurement runs in a fresh Python process, so nothing is already
+imported or cached. Two things are timed:
+
+    import    time to import pisces.core.
+    control   time from the start of the process until the first control
+              update of a Pisces() core, i.e. until the first output has been
+              put into its correct state.
+
+Pisces runs with simulated hardware (see pisces.simulation) so this can be
+run anywhere, and the web app isn't started. The heavy modules that were
+loaded by the time of each measurement are reported too, so an import
+creeping back onto the start up path shows up.
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+import tempfile
+import time
+from threading import Thread, Event
+
+package_root = os.path.normpath(os.path.join(os.path.dirname(__file__), '..'))
+heavy_modules = ('numpy', 'matplotlib', 'PIL', 'flask')
+
+
+def loaded_heavy_modules():
+    return [name for name in heavy_modules if name in sys.modules]
+
+
+def time_import():
+    start = time.perf_counter()
+    import pisces.core  # noqa: F401
+    return {'time': time.perf_counter() - start, 'modules': loaded_heavy_modules()}
+
+
+def time_first_control(config_path):
+    start = time.perf_counter()
+    from pisces.core import Pisces
+    from pisces.tank import Tank
+
+    first_update = Event()
+    result = {}
+    update_status = Tank.update_status
+
+    def timed_update_status(self, update):
+        update_status(self, update)
+        if not first_update.is_set():
+            result['time'] = time.perf_counter() - start
+            result['modules'] = loaded_heavy_modules()
+            first_update.set()
+
+    Tank.update_status = timed_update_status
+    Pisces.start_webapp = lambda self: None
+    Pisces.stop_webapp = lambda self: None
+
+    # Pisces() doesn't return until it has started logging, several seconds later.
+    Thread(target=Pisces, kwargs={'config_path': config_path}, daemon=True).start()
+    if not first_update.wait(timeout=60):
+        raise RuntimeError("No control update within 60 seconds")
+    return result
+
+
+def run_child(measurement, config_path):
+    """Runs one measurement in a fresh process and returns its result."""
+    args = [sys.executable, __file__, '--child', measurement, '--config', config_path]
+    env = dict(os.environ, PYTHONPATH=package_root)
+    output = subprocess.run(args, env=env, stdout=subprocess.PIPE, check=True).stdout
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeats', type=int, default=5, help="Number of fresh processes per measurement.")
+    parser.add_argument('--child', choices=('import', 'control'), help=argparse.SUPPRESS)
+    parser.add_argument('--config', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        if args.child == 'import':
+            result = time_import()
+        else:
+            result = time_first_control(args.config)
+        print(json.dumps(result), flush=True)
+        # Don't wait for the half started Pisces core to shut down.
+        os._exit(0)
+
+    # Imported here so the child processes don't import yaml before timing the import of pisces.core.
+    sys.path.insert(0, os.path.dirname(__file__))
+    from simulated import write_simulated_config
+
+    with tempfile.TemporaryDirectory() as directory:
+        config_path = write_simulated_config(directory)
+        print("{:<10} {:>10} {:>10}   {}".format('', 'median/s', 'min/s', 'heavy modules loaded'))
+        for measurement in ('import', 'control'):
+            results = [run_child(measurement, config_path) for _ in range(args.repeats)]
+            times = [result['time'] for result in results]
+            print("{:<10} {:>10.3f} {:>10.3f}   {}".format(measurement,
+                                                          statistics.median(times),
+                                                          min(times),
+                                                          ', '.join(results[-1]['modules']) or '-'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""Benchmark a running Pisces system with simulated hardware.
+
+Usage:
+    python benchmarks/bench_system.py [--iterations N] [--duration SECONDS] [--clients N]
+
+Starts a Pisces core with simulated hardware (see pisces.simulation), then
+measures:
+
+    control loop     time for one update of each control, i.e. reading its
+                     sensors and setting its output. This is how long each
+                     one holds up the scheduler thread.
+    update_status    cost of a status update that changes nothing, and of one
+                     that changes a value, which includes publishing it to
+                     shared memory and requesting a display refresh.
+    data logging     data log records written per second, text and binary
+                     logs, rollups and handing the plot over to the plot
+                     worker, or with client side charts (data_logger
+                     'plots: client') without the plot.
+    plot render      time to render the temperature plot in process, with
+                     synthetic data covering the configured plot duration.
+    webapp           requests per second to the web app status page, from
+                     several concurrent clients.
+"""
+import os
+import sys
+import argparse
+import logging
+import statistics
+import tempfile
+import time
+import urllib.request
+from threading import Thread
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(__file__), '..')))
+
+from simulated import write_simulated_config
+from bench_plot import make_log_data
+
+
+def time_calls(function, iterations):
+    """Returns a list of the times for iterations calls of function, in seconds."""
+    times = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def report(name, times):
+    times = sorted(times)
+    print("{:<28} {:>10.3f} {:>10.3f} {:>10.3f}".format(name,
+                                                       statistics.median(times) * 1000,
+                                                       times[int(0.95 * (len(times) - 1))] * 1000,
+                                                       times[-1] * 1000))
+
+
+def bench_webapp(config, duration, n_clients):
+    """Returns the requests per second served by the web app's status page."""
+    from werkzeug.serving import make_server
+    from pisces.webapp import app
+
+    app.config['pisces_config'] = config
+    app.config['version'] = 'benchmark'
+    # Don't log every request.
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:{}/'.format(server.server_port)
+
+    counts = [0] * n_clients
+
+    def client(number, end_time):
+        while time.monotonic() < end_time:
+            with urllib.request.urlopen(url) as response:
+                response.read()
+            counts[number] += 1
+
+    end_time = time.monotonic() + duration
+    clients = [Thread(target=client, args=(number, end_time)) for number in range(n_clients)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    server.shutdown()
+    return sum(counts) / duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=200, help="iterations of each timed operation")
+    parser.add_argument('--duration', type=float, default=5, help="seconds to run the webapp benchmark for")
+    parser.add_argument('--clients', type=int, default=4, help="concurrent webapp clients")
+    args = parser.parse_args()
+
+    from pisces.core import Pisces
+    from pisces.utils import plot_log
+
+    # The benchmark is the only client of the web app, so don't start the usual one.
+    Pisces.start_webapp = lambda self: None
+    Pisces.stop_webapp = lambda self: None
+
+    with tempfile.TemporaryDirectory() as directory:
+        config_path = write_simulated_config(directory, shared_status=True)
+        print("Starting Pisces with simulated hardware...")
+        pisces = Pisces(config_path=config_path)
+        try:
+            tank = next(iter(pisces.tanks.values()))
+            print("{:<28} {:>10} {:>10} {:>10}".format('', 'median/ms', '95%/ms', 'max/ms'))
+            # Read the sensors every time rather than using cached readings.
+            tank._temperature_control._sensors._max_age = 0
+            report('control loop: temperature', time_calls(tank._temperature_control._update, args.iterations))
+            report('control loop: water', time_calls(tank._water_control._update, args.iterations))
+            report('control loop: lights', time_calls(tank._lights_control._update, args.iterations))
+            report('update_status, unchanged', time_calls(lambda: pisces.update_status({'overflow': False}),
+                                                          args.iterations))
+            water_temps = iter(range(args.iterations))
+            report('update_status, changed', time_calls(lambda: pisces.update_status({'water_temp': next(water_temps)}),
+                                                        args.iterations))
+
+            log_times = time_calls(tank._datalogger._update, args.iterations)
+            report('data logging', log_times)
+            print("{:<28} {:>10.0f} records/s".format('data logging throughput',
+                                                      len(log_times) / sum(log_times)))
+            # With client side charts the plot worker isn't used at all.
+            tank._datalogger.config['data_logger']['plots'] = 'client'
+            report('data logging, client plots', time_calls(tank._datalogger._update, args.iterations))
+            tank._datalogger.config['data_logger']['plots'] = 'server'
+
+            plotting = pisces.config['data_logger']['plotting']
+            log_data = make_log_data(int(plotting['duration'] * 3600 / tank._datalogger._loop_interval))
+            report('plot render', time_calls(lambda: plot_log(log_data=log_data, **plotting),
+                                             max(args.iterations // 20, 3)))
+
+            requests_per_second = bench_webapp(pisces.config, args.duration, args.clients)
+            print("{:<28} {:>10.0f} requests/s with {} clients".format('webapp', requests_per_second,
+                                                                       args.clients))
+        finally:
+            # Stops everything and removes the shared memory.
+            pisces.__del__()
+            # Subcomponents still log when they're garbage collected, after the log directory has gone.
+            logging.disable(logging.CRITICAL)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""Measure how the CPU and memory used by Pisces grow with the number of tanks.
+
+Usage:
+    python benchmarks/bench_tanks.py [--tanks N [N ...]] [--duration SECONDS] [--interval SECONDS]
+
+Runs Pisces with simulated hardware and 1, 2, 4 and 6 tanks (6 is all the
+GPIO pins there are for them), each in a fresh process, and once it has
+started measures for a while:
+
+    RSS         resident memory of the Pisces process.
+    threads     threads in the Pisces process.
+    CPU         CPU time used, as a percentage of one core.
+
+All the controls and the data logger run every --interval seconds, much
+more often than usual so there's some load to measure, with client side
+charts so the plot worker isn't included. For comparison the 'separate'
+columns are for running each tank in its own Pisces process, i.e. the
+single tank figures multiplied by the number of tanks.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+import subprocess
+
+import yaml
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from simulated import package_root, write_simulated_config, max_tanks
+
+polled_sections = ('lights_control', 'temperature_control', 'water_control', 'data_logger')
+
+
+def read_proc_status():
+    """Returns the RSS in MB and the number of threads of this process, from /proc."""
+    values = {}
+    with open('/proc/self/status') as status_file:
+        for line in status_file:
+            key, _, value = line.partition(':')
+            values[key] = value.split()
+    return int(values['VmRSS'][0]) / 1024, int(values['Threads'][0])
+
+
+def measure(n_tanks, duration, interval):
+    """Runs Pisces with n_tanks tanks and returns its resource use. Run in a fresh process."""
+    from pisces.core import Pisces
+
+    Pisces.start_webapp = lambda self: None
+    Pisces.stop_webapp = lambda self: None
+
+    with tempfile.TemporaryDirectory() as directory:
+        config_path = write_simulated_config(directory, shared_status=True, n_tanks=n_tanks)
+        with open(config_path) as config_file:
+            config = yaml.safe_load(config_file)
+        for section in polled_sections:
+            config[section]['loop_interval'] = interval
+        config['data_logger']['plots'] = 'client'
+        with open(config_path, 'w') as config_file:
+            yaml.safe_dump(config, config_file)
+
+        pisces = Pisces(config_path=config_path)
+        try:
+            start_times = os.times()
+            start = time.perf_counter()
+            time.sleep(duration)
+            end_times = os.times()
+            cpu = (end_times.user + end_times.system) - (start_times.user + start_times.system)
+            rss, threads = read_proc_status()
+            return {'rss': rss, 'threads': threads, 'cpu': 100 * cpu / (time.perf_counter() - start)}
+        finally:
+            pisces.__del__()
+            # Subcomponents still log when they're garbage collected, after the log directory has gone.
+            logging.disable(logging.CRITICAL)
+
+
+def run_child(n_tanks, duration, interval):
+    """Runs one measurement in a fresh process and returns its result."""
+    args = [sys.executable, os.path.abspath(__file__), '--child', str(n_tanks),
+            '--duration', str(duration), '--interval', str(interval)]
+    env = dict(os.environ, PYTHONPATH=package_root)
+    output = subprocess.run(args, env=env, stdout=subprocess.PIPE, check=True).stdout
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tanks', type=int, nargs='+', default=[1, 2, 4, max_tanks],
+                        help="numbers of tanks to measure")
+    parser.add_argument('--duration', type=float, default=20, help="seconds to measure for")
+    parser.add_argument('--interval', type=int, default=1, help="seconds between control and logging updates")
+    parser.add_argument('--child', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        print(json.dumps(measure(args.child, args.duration, args.interval)))
+        return
+
+    print("{:<6} {:>8} {:>8} {:>8} {:>14} {:>14}".format('tanks', 'RSS/MB', 'threads', 'CPU/%',
+                                                         'separate RSS', 'separate CPU'))
+    single = None
+    for n_tanks in args.tanks:
+        result = run_child(n_tanks, args.duration, args.interval)
+        if n_tanks == 1:
+            single = result
+        separate = ("{:>14.1f} {:>14.2f}".format(single['rss'] * n_tanks, single['cpu'] * n_tanks)
+                    if single else '')
+        print("{:<6} {:>8.1f} {:>8} {:>8.2f} {}".format(n_tanks, result['rss'], result['threads'],
+                                                        result['cpu'], separate), flush=True)
+
+
+if __name__ == '__main__':
+    main()
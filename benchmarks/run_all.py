@@ -0,0 +1,36 @@
+"""Run all the Pisces benchmarks.
+
+Usage:
+    python benchmarks/run_all.py
+
+None of the benchmarks need a Raspberry Pi, anything that needs hardware
+uses the simulated hardware backends. Each benchmark runs in its own
+process with its default settings, run them individually for more options.
+"""
+import os
+import sys
+import subprocess
+
+benchmarks = ('bench_startup.py',
+              'bench_read_log.py',
+              'bench_eventlog.py',
+              'bench_plot.py',
+              'bench_system.py',
+              'bench_tanks.py')
+
+
+def main():
+    benchmark_dir = os.path.dirname(os.path.abspath(__file__))
+    failed = []
+    for benchmark in benchmarks:
+        print("\n=== {} ===".format(benchmark), flush=True)
+        result = subprocess.run([sys.executable, os.path.join(benchmark_dir, benchmark)])
+        if result.returncode != 0:
+            failed.append(benchmark)
+    if failed:
+        print("\nFailed: {}".format(', '.join(failed)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""Helpers for benchmarks that run Pisces with simulated hardware."""
+import os
+
+import yaml
+
+package_root = os.path.normpath(os.path.join(os.path.dirname(__file__), '..'))
+
+# GPIO pins free for tanks, i.e. not the I2C pins.
+tank_pins = tuple(range(4, 28))
+# Output and input pins each tank needs, buttons are left out so more tanks fit.
+tank_pin_keys = (('lights_control', 'lights'),
+                 ('temperature_control', 'fan'),
+                 ('water_control', 'pump'),
+                 ('water_control', 'overflow'))
+max_tanks = len(tank_pins) // len(tank_pin_keys)
+
+
+def write_simulated_config(directory, shared_status=False, n_tanks=None):
+    """Writes a config based on config_example.yaml using simulated hardware, with all files in directory.
+
+    Args:
+        directory (str): directory for the config, logs, data and simulated sensor files.
+        shared_status (bool, optional): publish the status to shared memory, default False.
+        n_tanks (int, optional): number of tanks, each with its own pins, default a
+            config without a 'tanks' section.
+
+    Returns:
+        str: path of the config file.
+    """
+    with open(os.path.join(package_root, 'config_example.yaml')) as example:
+        config = yaml.safe_load(example)
+
+    config['hardware'] = 'simulated'
+    config['simulation']['w1_dir'] = os.path.join(directory, 'w1')
+    config['data_logger']['binary_log'] = os.path.join(directory, 'pisces.bin')
+    config['data_logger']['rollup_log'] = os.path.join(directory, 'pisces_rollup')
+    config['data_logger']['event_log'] = os.path.join(directory, 'pisces.evt')
+    config['data_logger']['plotting']['filename_root'] = os.path.join(directory, 'temperature_plot')
+    config['metrics']['filename'] = os.path.join(directory, 'metrics.prom')
+    config['logging']['handlers']['file']['filename'] = os.path.join(directory, 'pisces.log')
+    config['logging']['handlers']['data']['filename'] = os.path.join(directory, 'pisces.dat')
+    config['logging']['handlers']['console']['level'] = 'WARNING'
+    if shared_status:
+        config['webapp']['shared_status'] = 'pisces_bench_{}'.format(os.getpid())
+    else:
+        config['webapp'].pop('shared_status', None)
+    if n_tanks:
+        if n_tanks > max_tanks:
+            raise ValueError("Not enough GPIO pins for more than {} tanks".format(max_tanks))
+        pins = iter(tank_pins)
+        config['tanks'] = {}
+        for tank in range(n_tanks):
+            tank_config = {section: {'button': None} for section, _ in tank_pin_keys}
+            for section, key in tank_pin_keys:
+                tank_config[section][key] = next(pins)
+            config['tanks']['tank{}'.format(tank + 1)] = tank_config
+
+    config_path = os.path.join(directory, 'config.yaml')
+    with open(config_path, 'w') as config_file:
+        yaml.safe_dump(config, config_file)
+    return config_path
@@ -1,24 +1,99 @@
 import os
+import copy
 import logging
 import logging.config
+from threading import Lock
+from weakref import WeakSet
 
 from pisces import __version__, pisces_root
-from pisces.utils import load_config
+from pisces.utils import load_config, resolve_config_path, changed_keys, get_tank_config, get_logging_config
+
+# Logging config most recently applied, so logging is only reconfigured when it changes.
+_logging_config = None
+_logging_lock = Lock()
+# Objects using each config, keyed by resolved config path, to be told about config changes.
+_config_users = {}
+
+
+def configure_logging(config):
+    """Applies the logging section of a config, unless it is already in effect."""
+    global _logging_config
+    logging_config = get_logging_config(config)
+    with _logging_lock:
+        if logging_config is not None and logging_config != _logging_config:
+            # dictConfig can modify what it's given, so give it a copy.
+            logging.config.dictConfig(copy.deepcopy(logging_config))
+            _logging_config = copy.deepcopy(logging_config)
+
+
+def reload_config(config_path='config.yaml'):
+    """Reloads a config file if it has changed and tells everything using it.
+
+    Every PiscesBase object created with this config has its config_changed
+    method called with the new config and the set of keys that changed. Objects
+    belonging to a tank get that tank's config, and only its changes.
+
+    Returns:
+        set: dotted paths of the keys that changed, for any tank, empty if none did.
+    """
+    config_path = resolve_config_path(config_path, pisces_root)
+    users = list(_config_users.get(config_path, ()))
+    if not users:
+        return set()
+
+    new_config = load_config(config_path)
+    all_changed = set()
+    changes = []
+    for user in users:
+        user_config = get_tank_config(new_config, user.tank)
+        if user_config is user.config:
+            continue
+        changed = changed_keys(user.config, user_config)
+        all_changed |= changed
+        changes.append((user, user_config, changed))
+
+    if all_changed:
+        configure_logging(new_config)
+    for user, user_config, changed in changes:
+        user.config_changed(user_config, changed)
+    return all_changed
 
 
 class PiscesBase():
     """Base class for all classes in the Pisces package.
 
     The purpose of this class is to load the config and configure logging.
-    """ 
+    The config file is only parsed, and logging only configured, once no
+    matter how many objects are created. Objects created with a tank name
+    get that tank's config, see pisces.utils.get_tank_config.
+    """
     def __init__(self, **kwargs):
         self.__version__ = __version__
         config_path = kwargs.get('config_path', 'config.yaml')
-        self.config = load_config(config_path=config_path,
-                                  path_root=pisces_root)
+        self._tank = kwargs.get('tank')
+        config = load_config(config_path=config_path,
+                             path_root=pisces_root)
 
-        # Configure logging.
-        logging_config = self.config.get('logging')
-        if logging_config is not None:
-            logging.config.dictConfig(logging_config)    
+        # Configure logging, from the whole config so every tank's data log is set up.
+        configure_logging(config)
+        self.config = get_tank_config(config, self._tank)
         self.logger = logging.getLogger('pisces_system')
+
+        # Register for notification of config changes.
+        resolved_path = resolve_config_path(config_path, pisces_root)
+        _config_users.setdefault(resolved_path, WeakSet()).add(self)
+
+    @property
+    def tank(self):
+        """Name of the tank this belongs to, None if the config doesn't have any tanks."""
+        return self._tank
+
+    def config_changed(self, config, changed):
+        """Called when the config file has been reloaded.
+
+        Args:
+            config (dict): the new config.
+            changed (set): dotted paths of the keys that changed, e.g.
+                'lights_control.time_on'.
+        """
+        self.config = config
@@ -0,0 +1,187 @@
+"""Binary data log with fixed size records.
+
+Each file starts with a header describing the record fields, followed by
+the records themselves. Because every record is the same size a file can be
+opened with `numpy.memmap` and sliced directly, with no parsing.
+
+Header layout:
+    8 bytes     magic, b'PISCESDB'
+    4 bytes     total header length in bytes, little endian uint32
+    remainder   JSON description of the record dtype, padded with spaces
+"""
+import os
+import json
+import struct
+from glob import glob
+
+import numpy as np
+
+magic = b'PISCESDB'
+header_alignment = 64
+
+
+def write_header(binary_file, dtype):
+    """Writes a binary log header for records of the given dtype."""
+    dtype = np.dtype(dtype)
+    description = json.dumps({'version': 1,
+                              'descr': [(name, dtype.fields[name][0].str) for name in dtype.names],
+                              'record_size': dtype.itemsize}).encode()
+    header_length = len(magic) + 4 + len(description)
+    padding = -header_length % header_alignment
+    header_length += padding
+    binary_file.write(magic)
+    binary_file.write(struct.pack('<I', header_length))
+    binary_file.write(description + b' ' * padding)
+
+
+def read_header(filename):
+    """Reads the header of a binary log file.
+
+    Args:
+        filename (str): path to the binary log file
+
+    Returns:
+        tuple: (numpy.dtype, int) record dtype and offset of the first record.
+
+    Raises:
+        ValueError: filename is not a Pisces binary log.
+    """
+    with open(filename, 'rb') as binary_file:
+        if binary_file.read(len(magic)) != magic:
+            msg = "{} is not a Pisces binary log".format(filename)
+            raise ValueError(msg)
+        header_length = struct.unpack('<I', binary_file.read(4))[0]
+        description = json.loads(binary_file.read(header_length - len(magic) - 4).decode())
+    dtype = np.dtype([tuple(field) for field in description['descr']])
+    return dtype, header_length
+
+
+def open_memmap(filename):
+    """Opens a binary log file as a read only, memory mapped structured array.
+
+    Any incomplete record at the end of the file, e.g. from a write that was
+    interrupted, is ignored.
+    """
+    dtype, offset = read_header(filename)
+    n_records = (os.path.getsize(filename) - offset) // dtype.itemsize
+    if n_records < 1:
+        # Can't memory map zero bytes.
+        return np.empty(0, dtype=dtype)
+    return np.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=(n_records,))
+
+
+def append_records(filename, records):
+    """Appends records to a binary log file, creating it if necessary."""
+    records = np.asarray(records).reshape(-1)
+    new_file = not os.path.exists(filename) or os.path.getsize(filename) == 0
+    with open(filename, 'ab') as binary_file:
+        if new_file:
+            write_header(binary_file, records.dtype)
+        binary_file.write(records.tobytes())
+
+
+def get_binary_log_files(log_root):
+    """Returns the daily binary log files for log_root, oldest first."""
+    return sorted(glob("{}.20*".format(log_root)))
+
+
+def read_binary_log(log_root, n_records=1, start=None, end=None, log_files=None):
+    """Gets records from a set of daily binary log files.
+
+    Either the last n records or, if start and/or end are given, all the
+    records between start and end (inclusive).
+
+    Args:
+        log_root (str): path of the binary log, without the date suffix.
+        n_records (int, optional): number of records to return, default 1.
+            Ignored if start or end are given.
+        start (optional): earliest log time to include, as a datetime,
+            datetime64 or ISO 8601 string. Default no limit.
+        end (optional): latest log time to include. Default no limit.
+        log_files (list, optional): daily files, from get_binary_log_files().
+            Default look for them.
+
+    Returns:
+        numpy.ndarray: structured array of records, oldest first.
+    """
+    if log_files is None:
+        log_files = get_binary_log_files(log_root)
+    if not log_files:
+        msg = "No binary log files found for {}".format(log_root)
+        raise OSError(msg)
+
+    if start is not None or end is not None:
+        return _read_binary_log_between(log_root, log_files, start, end)
+
+    n_records = int(n_records)
+    if n_records < 1:
+        msg = "n_records must be a positive integer, got {}".format(n_records)
+        raise ValueError(msg)
+
+    chunks = []
+    n_found = 0
+    # Newest first, until we have enough records.
+    for log_file in reversed(log_files):
+        records = open_memmap(log_file)
+        chunks.insert(0, records[-(n_records - n_found):])
+        n_found += len(chunks[0])
+        if n_found >= n_records:
+            break
+
+    return np.concatenate(chunks)
+
+
+def _read_binary_log_between(log_root, log_files, start, end, time_field='log_time'):
+    if start is not None:
+        start = np.datetime64(start, 's')
+    if end is not None:
+        end = np.datetime64(end, 's')
+
+    chunks = []
+    for log_file in log_files:
+        # Daily files are named after the date of the records they contain.
+        log_date = log_file[len(log_root) + 1:]
+        if start is not None and log_date < np.datetime_as_string(start, unit='D'):
+            continue
+        if end is not None and log_date > np.datetime_as_string(end, unit='D'):
+            continue
+        records = open_memmap(log_file)
+        if len(records) == 0:
+            continue
+        first = 0 if start is None else np.searchsorted(records[time_field], start, side='left')
+        last = len(records) if end is None else np.searchsorted(records[time_field], end, side='right')
+        chunks.append(records[first:last])
+
+    if not chunks:
+        dtype, _ = read_header(log_files[-1])
+        return np.empty(0, dtype=dtype)
+    return np.concatenate(chunks)
+
+
+class BinaryLogWriter():
+    """Writes records to one binary log file per day.
+
+    Args:
+        log_root (str): path of the binary log. The date of the records is
+            appended to get the name of each daily file, e.g.
+            'data/pisces.bin.2019-05-01'.
+        time_field (str, optional): name of the datetime64 field used to pick
+            the daily file, default 'log_time'.
+    """
+    def __init__(self, log_root, time_field='log_time'):
+        self._log_root = log_root
+        self._time_field = time_field
+        log_dir = os.path.dirname(log_root)
+        if log_dir:
+            os.makedirs(log_dir, exist_ok=True)
+
+    @property
+    def log_root(self):
+        return self._log_root
+
+    def filename(self, log_time):
+        """Returns the name of the daily file for the given datetime64."""
+        return "{}.{}".format(self._log_root, np.datetime_as_string(log_time, unit='D'))
+
+    def append(self, record):
+        append_records(self.filename(record[self._time_field]), record)
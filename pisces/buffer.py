@@ -0,0 +1,74 @@
+from threading import Lock
+
+import numpy as np
+
+
+class RingBuffer():
+    """Fixed size, NumPy backed ring buffer of structured records.
+
+    Once the buffer is full each new record overwrites the oldest one, so
+    appending is O(1) and memory use is fixed regardless of how long the
+    buffer has been running.
+
+    Args:
+        capacity (int): maximum number of records to hold.
+        dtype (numpy.dtype): dtype of the records, usually structured.
+    """
+    def __init__(self, capacity, dtype):
+        if int(capacity) < 1:
+            msg = "capacity must be a positive integer, got {}".format(capacity)
+            raise ValueError(msg)
+
+        self._capacity = int(capacity)
+        self._data = np.zeros(self._capacity, dtype=dtype)
+        self._next = 0
+        self._count = 0
+        self._lock = Lock()
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def dtype(self):
+        return self._data.dtype
+
+    def append(self, record):
+        """Adds a single record, overwriting the oldest if the buffer is full."""
+        with self._lock:
+            self._data[self._next] = record
+            self._next = (self._next + 1) % self._capacity
+            self._count = min(self._count + 1, self._capacity)
+
+    def extend(self, records):
+        """Adds an array of records, oldest first."""
+        records = np.asarray(records, dtype=self._data.dtype).reshape(-1)
+        if len(records) > self._capacity:
+            records = records[-self._capacity:]
+        n_records = len(records)
+        with self._lock:
+            indices = (self._next + np.arange(n_records)) % self._capacity
+            self._data[indices] = records
+            self._next = (self._next + n_records) % self._capacity
+            self._count = min(self._count + n_records, self._capacity)
+
+    def get(self, n_records=None):
+        """Returns a copy of the most recent records in chronological order.
+
+        Args:
+            n_records (int, optional): maximum number of records to return,
+                default all of them.
+        """
+        with self._lock:
+            if n_records is None or n_records > self._count:
+                n_records = self._count
+            indices = (self._next - n_records + np.arange(n_records)) % self._capacity
+            return self._data[indices]
+
+    def clear(self):
+        with self._lock:
+            self._next = 0
+            self._count = 0
@@ -0,0 +1,280 @@
+"""Block compressed rotated logs.
+
+Rotated logs never change, so they can be compressed once and read many
+times. Each one is compressed to '<rotated log>.gz' as a series of gzip
+members, or blocks, each holding whole lines and about block_size bytes of
+them uncompressed. The result is an ordinary gzip file that zcat and
+friends can read, but a reader that knows where the blocks are can
+decompress just the ones it needs.
+
+The block positions go in a JSON sidecar index, '<rotated log>.gz.idx',
+holding the size of the compressed file, its first and last log times and
+a [first log time, offset, length, number of lines] entry for each block.
+If the index is missing or out of date it is rebuilt by scanning the file.
+
+CompressingTimedRotatingFileHandler is a TimedRotatingFileHandler that
+compresses each log as it is rotated, in a background thread, so it can be
+used in place of TimedRotatingFileHandler in the logging config. Only the
+standard library is used, so configuring logging doesn't import NumPy.
+"""
+import os
+import sys
+import gzip
+import json
+import zlib
+import fcntl
+import bisect
+import tempfile
+import logging
+import traceback
+from glob import glob, escape
+from logging.handlers import TimedRotatingFileHandler
+from threading import Thread, Lock
+
+compressed_suffix = '.gz'
+# Uncompressed bytes per block, big enough to compress well, small enough to decompress quickly.
+default_block_size = 64 * 1024
+
+# Only compress one file at a time, even with several handlers.
+_compress_lock = Lock()
+
+
+def is_compressed(log_filename):
+    return log_filename.endswith(compressed_suffix)
+
+
+def _block_entry(lines, offset, length):
+    from pisces.logindex import time_length
+    return [lines[0][:time_length].decode(errors='replace'), offset, length, len(lines)]
+
+
+def _line_times(lines, first, last):
+    from pisces.logindex import time_length
+    for line in lines:
+        if line.strip():
+            log_time = line[:time_length].decode(errors='replace')
+            if first is None:
+                first = log_time
+            last = log_time
+    return first, last
+
+
+def compress_log(log_filename, block_size=default_block_size):
+    """Compresses a rotated log into blocks, writes its index and removes the original.
+
+    Safe to call from several processes at once, e.g. the core and the web app
+    catching up at start up. The original is locked while it is compressed, and
+    whoever gets the lock second finds it gone.
+
+    Args:
+        log_filename (str): path of the rotated log.
+        block_size (int, optional): uncompressed bytes per block, default 64 KiB.
+
+    Returns:
+        str: path of the compressed log.
+
+    Raises:
+        FileNotFoundError: the log doesn't exist, e.g. it has already been compressed.
+    """
+    from pisces.logindex import index_filename
+
+    compressed = log_filename + compressed_suffix
+    with _compress_lock, open(log_filename, 'rb') as log_file:
+        # Only works between processes, hence _compress_lock too.
+        fcntl.flock(log_file, fcntl.LOCK_EX)
+        if not os.path.exists(log_filename):
+            msg = "{} has already been compressed".format(log_filename)
+            raise FileNotFoundError(msg)
+        # Anything left by a compression that was killed part way through. Writing one needs the lock.
+        for leftover in glob(escape(compressed) + '.*.tmp'):
+            os.unlink(leftover)
+
+        # Unique to this call, so nothing else can truncate or rename it while it's being written.
+        handle, temporary = tempfile.mkstemp(prefix=os.path.basename(compressed) + '.', suffix='.tmp',
+                                             dir=os.path.dirname(compressed) or '.')
+        try:
+            blocks = []
+            first = last = None
+            offset = 0
+            with os.fdopen(handle, 'wb') as compressed_file:
+                lines = []
+                n_bytes = 0
+                for line in log_file:
+                    lines.append(line)
+                    n_bytes += len(line)
+                    if n_bytes >= block_size:
+                        data = gzip.compress(b''.join(lines), compresslevel=9, mtime=0)
+                        compressed_file.write(data)
+                        blocks.append(_block_entry(lines, offset, len(data)))
+                        first, last = _line_times(lines, first, last)
+                        offset += len(data)
+                        lines = []
+                        n_bytes = 0
+                if lines:
+                    data = gzip.compress(b''.join(lines), compresslevel=9, mtime=0)
+                    compressed_file.write(data)
+                    blocks.append(_block_entry(lines, offset, len(data)))
+                    first, last = _line_times(lines, first, last)
+                    offset += len(data)
+                compressed_file.flush()
+                os.fsync(compressed_file.fileno())
+            # mkstemp makes it private, give it the same permissions as the original.
+            os.chmod(temporary, os.fstat(log_file.fileno()).st_mode & 0o777)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+        index = {'size': offset, 'first': first, 'last': last, 'blocks': blocks}
+        try:
+            with open(index_filename(compressed), 'w') as index_file:
+                json.dump(index, index_file)
+        except OSError:
+            # Rebuilt when needed.
+            pass
+        # Compressed log replaces any previous one in one go, readers never see a partial file,
+        # and it is complete before the original is removed.
+        os.replace(temporary, compressed)
+        for old_file in (log_filename, index_filename(log_filename)):
+            try:
+                os.unlink(old_file)
+            except FileNotFoundError:
+                pass
+    return compressed
+
+
+def build_block_index(log_filename):
+    """Scans a block compressed log and returns its index."""
+    with open(log_filename, 'rb') as log_file:
+        data = log_file.read()
+    blocks = []
+    first = last = None
+    offset = 0
+    while offset < len(data):
+        decompressor = zlib.decompressobj(wbits=31)
+        lines = decompressor.decompress(data[offset:]).splitlines(keepends=True)
+        length = len(data) - offset - len(decompressor.unused_data)
+        if not decompressor.eof:
+            msg = "{} ends with an incomplete block".format(log_filename)
+            raise ValueError(msg)
+        if lines:
+            blocks.append(_block_entry(lines, offset, length))
+            first, last = _line_times(lines, first, last)
+        offset += length
+    return {'size': offset, 'first': first, 'last': last, 'blocks': blocks}
+
+
+def load_block_index(log_filename):
+    """Returns the index for a block compressed log, building it if necessary."""
+    from pisces.logindex import index_filename
+
+    sidecar = index_filename(log_filename)
+    try:
+        with open(sidecar) as index_file:
+            index = json.load(index_file)
+    except (OSError, ValueError):
+        index = None
+
+    if index is None or index.get('size') != os.path.getsize(log_filename):
+        index = build_block_index(log_filename)
+        try:
+            with open(sidecar, 'w') as index_file:
+                json.dump(index, index_file)
+        except OSError:
+            pass
+    return index
+
+
+def _read_block(log_file, block):
+    _, offset, length, _ = block
+    log_file.seek(offset)
+    return gzip.decompress(log_file.read(length)).decode().splitlines(keepends=True)
+
+
+def read_compressed_lines(log_filename, start=None, end=None):
+    """Gets the lines of a block compressed log between two log time strings (inclusive).
+
+    Only the blocks that can contain lines in the time range are decompressed.
+    """
+    from pisces.logindex import time_length
+
+    index = load_block_index(log_filename)
+    if index['first'] is None:
+        return []
+    if (start is not None and index['last'] < start) or (end is not None and index['first'] > end):
+        return []
+
+    blocks = index['blocks']
+    first_block = 0
+    if start is not None:
+        # Last block starting before start, the lines at start may be at its end.
+        first_block = max(bisect.bisect_left([block[0] for block in blocks], start) - 1, 0)
+
+    lines = []
+    with open(log_filename, 'rb') as log_file:
+        for block in blocks[first_block:]:
+            if end is not None and block[0] > end:
+                break
+            for line in _read_block(log_file, block):
+                log_time = line[:time_length]
+                if end is not None and log_time > end:
+                    return lines
+                if start is None or log_time >= start:
+                    lines.append(line)
+    return lines
+
+
+def get_last_compressed_lines(log_filename, n_lines=1):
+    """Gets the last n lines of a block compressed log, decompressing only the blocks needed."""
+    index = load_block_index(log_filename)
+    lines = []
+    with open(log_filename, 'rb') as log_file:
+        for block in reversed(index['blocks']):
+            if len(lines) >= n_lines:
+                break
+            lines = _read_block(log_file, block) + lines
+    return lines[-n_lines:] if n_lines > 0 else []
+
+
+class CompressingTimedRotatingFileHandler(TimedRotatingFileHandler):
+    """TimedRotatingFileHandler that block compresses logs in the background as they are rotated.
+
+    Takes the same arguments as TimedRotatingFileHandler, plus:
+
+    Args:
+        block_size (int, optional): uncompressed bytes per block, default 64 KiB.
+    """
+    def __init__(self, *args, block_size=default_block_size, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._block_size = int(block_size)
+        self.rotator = self._rotate
+        # Catch up with anything rotated but not compressed, e.g. before a crash or an upgrade.
+        self._compress_in_background(self._uncompressed_logs())
+
+    def _uncompressed_logs(self):
+        prefix = self.baseFilename + '.'
+        # Rotated logs have just the date suffix, compressed logs and indices have more after it.
+        return sorted(log_filename for log_filename in glob(escape(prefix) + '*')
+                      if self.extMatch.match(log_filename[len(prefix):]) and
+                      '.' not in log_filename[len(prefix):])
+
+    def _rotate(self, source, dest):
+        if os.path.exists(source):
+            os.rename(source, dest)
+        self._compress_in_background([dest])
+
+    def _compress_in_background(self, log_filenames):
+        if log_filenames:
+            Thread(target=self._compress, args=(log_filenames,), name='pisces_log_compression', daemon=True).start()
+
+    def _compress(self, log_filenames):
+        for log_filename in log_filenames:
+            try:
+                compress_log(log_filename, self._block_size)
+            except FileNotFoundError:
+                # Already compressed by another handler, maybe in another process.
+                pass
+            except Exception:
+                # Can't log it, this is the logging system. Report it the way logging does.
+                if logging.raiseExceptions:
+                    traceback.print_exc(file=sys.stderr)
+
@@ -1,9 +1,7 @@
-import time
-from threading import Thread, Event
-
 from gpiozero import DigitalOutputDevice, Button
 
 from pisces.base import PiscesBase
+from pisces.simulation import is_simulated, use_mock_pins
 
 
 class SubcomponentBase(PiscesBase):
@@ -21,7 +19,9 @@ class ControlBase(SubcomponentBase):
     def __init__(self, pisces_core, **kwargs):
         super().__init__(pisces_core, **kwargs)
         self._output_name = kwargs['output_name']
-        
+
+        if is_simulated(self.config):
+            use_mock_pins()
         self._output = DigitalOutputDevice(int(self.config[self._name][self._output_name]),
                                            initial_value=None)
         self._status = {'{}_auto'.format(self._output_name): False,
@@ -105,53 +105,78 @@ class PollingBase(SubcomponentBase):
             msg = "Temperature control 'loop_interval' must be integer > 0."
             self.logger.critical(msg)
             raise ValueError(msg)
+        # Scheduler tasks need unique names, and every tank has its own of each subcomponent.
+        self._task_name = self._name if self.tank is None else '{}.{}'.format(self.tank, self._name)
+
+    @property
+    def is_monitoring(self):
+        return self._core.scheduler.is_scheduled(self._task_name)
 
-        self._stop_event = Event()
-        self._stop_event.set()
-        
     def start_monitoring(self):
-        if not self._stop_event.is_set():
-            self.logger.warning("{} already running.".format(self._name))
+        if self.is_monitoring:
+            self.logger.warning("{} already running.".format(self._task_name))
         else:
-            self._stop_event.clear()
-            self._controller = Thread(target=self._monitor, daemon=True)
-            self._controller.start()
+            # Polling is done by the Pisces core's scheduler, shared by all subcomponents.
+            self._core.scheduler.add(self._task_name, self._update, self._loop_interval)
+            self.logger.info("{} starting.".format(self._task_name))
 
     def stop_monitoring(self):
-        if self._stop_event.is_set():
-            self.logger.warning("{} not running.".format(self._name))
+        if not self.is_monitoring:
+            self.logger.warning("{} not running.".format(self._task_name))
         else:
-            self._stop_event.set()
-            self._controller.join(timeout=5)
-
-    def _monitor(self):
-        self.logger.info("{} starting.".format(self._name))
-        while not self._stop_event.is_set():
-            self._update()
-            for i in range(self._loop_interval):
-                if self._stop_event.is_set():
-                    break
-                time.sleep(1)
-        self.logger.info("{} stopped.".format(self._name))
+            self._core.scheduler.remove(self._task_name)
+            self.logger.info("{} stopped.".format(self._task_name))
+
+    def config_changed(self, config, changed):
+        super().config_changed(config, changed)
+        if '{}.loop_interval'.format(self._name) in changed:
+            loop_interval = int(self.config[self._name]['loop_interval'])
+            if loop_interval < 1:
+                self.logger.error("{} 'loop_interval' must be integer > 0, keeping {}.".format(self._name,
+                                                                                             self._loop_interval))
+                return
+            self._loop_interval = loop_interval
+            if self.is_monitoring:
+                # Reschedule with the new interval.
+                self._core.scheduler.remove(self._task_name)
+                self._core.scheduler.add(self._task_name, self._update, self._loop_interval)
+            self.logger.info("{} loop interval now {}s.".format(self._task_name, self._loop_interval))
 
 
 class ClosedLoopBase(ControlBase, PollingBase):
     def __init__(self, pisces_core, **kwargs):
         super().__init__(pisces_core, **kwargs)
-
-        self._target_max = float(self.config[self._name]['target_max'])
-        self._target_min = float(self.config[self._name]['target_min'])
-        if self._target_max <= self._target_min:
+        self._set_targets()
+
+    def config_changed(self, config, changed):
+        super().config_changed(config, changed)
+        target_keys = {'{}.{}'.format(self._name, key) for key in ('target_max', 'target_min', 'hysteresis')}
+        if changed & target_keys:
+            try:
+                self._set_targets()
+            except ValueError:
+                self.logger.error("{} keeping previous targets.".format(self._name))
+            else:
+                self.logger.info("{} targets updated.".format(self._name))
+
+    def _set_targets(self):
+        target_max = float(self.config[self._name]['target_max'])
+        target_min = float(self.config[self._name]['target_min'])
+        if target_max <= target_min:
             msg = "{} 'target_min' must be <= 'target_max'.".format(self._name)
             self.logger.critical(msg)
             raise ValueError(msg)
 
-        self._hysteresis = float(self.config[self._name]['hysteresis'])
-        if self._hysteresis < 0:
-            msg = "{} 'hysteresis' must be > 0.".format(self.name)
+        hysteresis = float(self.config[self._name]['hysteresis'])
+        if hysteresis < 0:
+            msg = "{} 'hysteresis' must be > 0.".format(self._name)
             self.logger.critical(msg)
             raise ValueError(msg)
-        elif self._hysteresis > (self._target_max - self._target_min):
+        elif hysteresis > (target_max - target_min):
             msg = "{} 'hysteresis' must be < ('target_max' - 'target_min').".format(self._name)
             self.logger.critical(msg)
             raise ValueError(msg)
+
+        self._target_max = target_max
+        self._target_min = target_min
+        self._hysteresis = hysteresis
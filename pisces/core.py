@@ -1,60 +1,115 @@
 import subprocess
 import time
 
-from pisces.base import PiscesBase
+from pisces import metrics
+from pisces.base import PiscesBase, reload_config
 from pisces.display import Display
-from pisces.lights import LightsControl
-from pisces.temperature import TemperatureControl
-from pisces.water import WaterControl
-from pisces.datalogger import DataLogger
-from pisces.utils import end_process
+from pisces.plotting import PlotWorker
+from pisces.scheduler import Scheduler
+from pisces.tank import Tank
+from pisces.utils import end_process, get_tank_names, get_tank_config, uses_server_plots
 
 class Pisces(PiscesBase):
     """Main class for the aquarium control system.
 
-    Stuff.
+    Runs a Tank for each tank in the config, which all share one scheduler,
+    plot worker and sensor bus, and a web app for each tank. The display and
+    the status properties are for the first tank.
     """
     def __init__(self, **kwargs):
         super().__init__(**kwargs) # Load config and configure logging
         self.logger.info("Pisces v{}".format(self.__version__))
+        self._config_path = kwargs.get('config_path', 'config.yaml')
 
-        self._status = {'water_temp': 99.9,
-                        'water_temp_status': 'OK',
-                        'air_temp': 99.9,
-                        'water_level': 99.9,
-                        'water_level_status': 'OK',
-                        'overflow': False,
-                        'lights_auto': True,
-                        'lights_enabled': False,
-                        'fan_auto': True,
-                        'fan_enabled': False,
-                        'pump_auto': True,
-                        'pump_enabled': False}
+        # Single scheduler thread that runs all the polling subcomponents' updates, for all the tanks.
+        self._scheduler = Scheduler()
+        self._scheduler.start()
+
+        # Plots are rendered in a separate process, started when the first one is submitted.
+        self._plot_worker = PlotWorker()
+
+        # Each tank has its own controls, data logger and status.
+        self._tanks = {}
+        for name in get_tank_names(self.config):
+            self._tanks[name] = Tank(self, tank=name, **kwargs)
+        self._default_tank = next(iter(self._tanks.values()))
 
         self._display = Display(self, **kwargs)
-        self._lights_control = LightsControl(self, **kwargs)
-        self._temperature_control = TemperatureControl(self, **kwargs)
-        self._water_control = WaterControl(self, **kwargs)
-        self._datalogger = DataLogger(self, **kwargs)
-        self._webapp_process = None
+        self._webapp_processes = {}
+
+        # Optionally write metrics to a file every so often, for the web app to serve.
+        metrics_config = self.config.get('metrics', {})
+        if metrics_config.get('filename'):
+            self._scheduler.add('metrics', self.write_metrics, float(metrics_config.get('interval', 15)))
+
+        # Optionally check the config file for changes every so often.
+        config_reload_interval = self.config.get('core', {}).get('config_reload_interval')
+        if config_reload_interval:
+            self._scheduler.add('config_reload', self.reload_config, float(config_reload_interval),
+                                delay=float(config_reload_interval))
 
         self.start_all()
 
     def __del__(self):
         self.stop_all()
+        self._scheduler.stop()
+        self._display.stop()
+        for tank in self._tanks.values():
+            tank.close()
+
+    @property
+    def tanks(self):
+        """The tanks, keyed by name, in config order."""
+        return dict(self._tanks)
 
     @property
     def status(self):
-        return self._status
+        """Current status of the first tank, as a read only StatusSnapshot."""
+        return self._default_tank.status
+
+    @property
+    def status_store(self):
+        """StatusStore of the first tank, for subscribing to changes."""
+        return self._default_tank.status_store
+
+    @property
+    def scheduler(self):
+        return self._scheduler
+
+    @property
+    def plot_worker(self):
+        return self._plot_worker
 
     def update_status(self, update):
-        self._status.update(update)
-        self._display.update()
+        """Updates the status of the first tank."""
+        self._default_tank.update_status(update)
+
+    def config_changed(self, config, changed):
+        super().config_changed(config, changed)
+        if self._plot_worker.is_running and not any(uses_server_plots(get_tank_config(config, name))
+                                                    for name in self._tanks):
+            # Charts are drawn by the browser, plots are only rendered on demand by the web app.
+            self._plot_worker.stop()
+
+    def write_metrics(self):
+        """Writes the current metrics to the metrics file, in Prometheus text format."""
+        try:
+            metrics.registry.write(self.config['metrics']['filename'])
+        except OSError as err:
+            self.logger.error("Error writing metrics: {}".format(err))
+
+    def reload_config(self):
+        """Reloads the config file if it has changed, passing the changes on to all subcomponents."""
+        changed = reload_config(self._config_path)
+        if changed:
+            self.logger.info("Config reloaded, changed: {}".format(', '.join(sorted(changed))))
+        return changed
 
     def start_all(self):
         self.lights_auto()
         self.fan_auto()
 #        self.pump_auto()
+        self.start_status_publisher()
         time.sleep(5)  # Give sensors time to get valid readings before logging.
         self.start_logging()
         self.start_webapp()
@@ -68,41 +123,58 @@ class Pisces(PiscesBase):
         self._display.clear()
 
     def lights_auto(self):
-        self._lights_control.auto_on()
+        for tank in self._tanks.values():
+            tank.lights_auto()
 
     def lights_manual(self):
-        self._lights_control.auto_off()
+        for tank in self._tanks.values():
+            tank.lights_manual()
 
     def fan_auto(self):
-        self._temperature_control.auto_on()
+        for tank in self._tanks.values():
+            tank.fan_auto()
 
     def fan_manual(self):
-        self._temperature_control.auto_off()
+        for tank in self._tanks.values():
+            tank.fan_manual()
 
     def pump_auto(self):
-        self._water_control.auto_on()
+        for tank in self._tanks.values():
+            tank.pump_auto()
 
     def pump_manual(self):
-        self._water_control.auto_off()
+        for tank in self._tanks.values():
+            tank.pump_manual()
+
+    def start_status_publisher(self):
+        for tank in self._tanks.values():
+            tank.start_status_publisher()
 
     def start_logging(self):
-        self._datalogger.start_monitoring()
+        for tank in self._tanks.values():
+            tank.start_logging()
 
     def stop_logging(self):
-        self._datalogger.stop_monitoring()
+        for tank in self._tanks.values():
+            tank.stop_logging()
+        if self._plot_worker.is_running:
+            self._plot_worker.stop()
 
     def start_webapp(self):
-        if self._webapp_process is None:
-            webapp_cmds = ('python', 'pisces/webapp.py')
-            self._webapp_process = subprocess.Popen(webapp_cmds)
+        if not self._webapp_processes:
+            # One web app per tank, each on its own port, see get_tank_config.
+            for name in self._tanks:
+                webapp_cmds = ('python', 'pisces/webapp.py') + ((name,) if name is not None else ())
+                self._webapp_processes[name] = subprocess.Popen(webapp_cmds)
             self.logger.info("Web app started.")
         else:
             self.logger.warning("Web app already running.")
 
     def stop_webapp(self):
-        if self._webapp_process is not None:
-            exit_code = end_process(self._webapp_process)
+        if self._webapp_processes:
+            for webapp_process in self._webapp_processes.values():
+                exit_code = end_process(webapp_process)
             self.logger.info("Web app stopped ()".format(exit_code))
-            self._webapp_process = None
+            self._webapp_processes = {}
         else:
             self.logger.warning("Web app not running.")
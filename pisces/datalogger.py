@@ -1,26 +1,157 @@
 import logging
+from collections import deque
+from datetime import datetime
 
 from pisces.control import PollingBase
-from pisces.utils import plot_log
+from pisces.utils import read_log, get_data_filename, get_log_dtype, log_names, uses_server_plots
+
+# Seconds between writes of queued status changes to the event log.
+event_write_interval = 1
 
 class DataLogger(PollingBase):
     def __init__(self, pisces_core, **kwargs):
         kwargs.update({'name': 'data_logger'})
         super().__init__(pisces_core, **kwargs)
 
-        self._data_logger = logging.getLogger('pisces_data')
+        # Each tank logs to its own data log, see pisces.utils.get_logging_config.
+        self._data_logger = logging.getLogger('pisces_data' if self.tank is None else 'pisces_data.' + self.tank)
         self._log_file = self.config['logging']['handlers']['data']['filename']
 
+        self._data_file = get_data_filename(self.config)
+
+        # The binary log writer and the recent samples buffer both need NumPy, which is slow
+        # to import. They are created when logging starts so they don't hold up the controls.
+        self._binary_log = None
+        self._buffer = None
+        self._rollups = None
+        self._event_log = None
+        # Status changes waiting to be written to the event log, as (log time, snapshot).
+        self._events = deque()
+        self._events_task_name = self._task_name + '.events'
+        # Plots are rendered in a separate process so they can't hold up logging or control.
+        # It's the core's, shared by all the tanks.
+        self._plot_worker = self._core.plot_worker
+
         self.logger.info("Data logger initialised.")
 
+    @property
+    def recent_data(self):
+        """Recent samples, oldest first, as a structured array."""
+        if self._buffer is None:
+            self._create_buffer()
+        return self._buffer.get()
+
+    def start_monitoring(self):
+        if self._buffer is None:
+            self._create_buffer()
+        # Optional binary copy of the data log, used by readers in preference to the text one.
+        binary_log = self.config['data_logger'].get('binary_log')
+        if binary_log and self._binary_log is None:
+            from pisces.binlog import BinaryLogWriter
+            self._binary_log = BinaryLogWriter(binary_log)
+        # Optional rollups of the data at coarser resolutions, for long duration history.
+        rollup_log = self.config['data_logger'].get('rollup_log')
+        if rollup_log and self._rollups is None:
+            from pisces.rollup import Rollups
+            self._rollups = Rollups(rollup_log)
+            # Catch up with anything logged since the rollups were last updated.
+            try:
+                self._rollups.extend(self.recent_data)
+            except OSError as err:
+                self.logger.error("Error writing data rollups: {}".format(err))
+        # Optional event log, with every status change as it happens rather than samples.
+        event_log = self.config['data_logger'].get('event_log')
+        if event_log and self._event_log is None:
+            from pisces.eventlog import EventLogWriter
+            self._event_log = EventLogWriter(event_log,
+                                             keyframe_interval=self.config['data_logger'].get('keyframe_interval',
+                                                                                               3600),
+                                             deadband=self.config['data_logger'].get('event_deadband'))
+            self._queue_event(self._core.status)
+            self._core.status_store.subscribe(self._queue_event)
+            # Status store subscribers shouldn't do I/O, the changes are written from the scheduler thread.
+            self._core.scheduler.add(self._events_task_name, self._write_events, event_write_interval)
+        if uses_server_plots(self.config) and not self._plot_worker.is_running:
+            self._plot_worker.start()
+        super().start_monitoring()
+
+    def stop_monitoring(self):
+        super().stop_monitoring()
+        if self._event_log:
+            self._core.status_store.unsubscribe(self._queue_event)
+            if self._core.scheduler.is_scheduled(self._events_task_name):
+                self._core.scheduler.remove(self._events_task_name)
+            self._write_events()
+            self._event_log.close()
+            self._event_log = None
+
+    def _create_buffer(self):
+        from pisces.buffer import RingBuffer
+        # Keep enough recent samples in memory to cover the plot duration.
+        duration = self.config['data_logger']['plotting']['duration']
+        self._buffer = RingBuffer(capacity=int(duration * 3600 / self._loop_interval),
+                                  dtype=get_log_dtype())
+        self._seed_buffer()
+
+    def _seed_buffer(self):
+        # Only time the data log is read from disk, after this samples are added as they are logged.
+        # Fall back to the text log if a newly configured binary log doesn't have any data yet.
+        for data_file in dict.fromkeys((self._data_file, self._log_file)):
+            try:
+                self._buffer.extend(read_log(data_file, n_lines=self._buffer.capacity))
+            except Exception as err:
+                self.logger.warning("Could not read previous data from {}: {}".format(data_file, err))
+            else:
+                break
+
+    def _queue_event(self, snapshot, changed=None):
+        # Called by the status store, in the thread that changed the status, so just queues it.
+        if self._event_log is not None:
+            self._events.append((datetime.now(), snapshot))
+
+    def _write_events(self):
+        event_log = self._event_log
+        if event_log is None:
+            return
+        try:
+            while self._events:
+                log_time, snapshot = self._events.popleft()
+                event_log.append(log_time, snapshot)
+            event_log.flush()
+        except OSError as err:
+            self.logger.error("Error writing event log: {}".format(err))
+
     def _update(self):
+        import numpy as np
+
         data = self._core.status
         data_string = "{:2.3f} {:<4} {:2.3f} {:2.1f} {:<4} {:<5} {:<5} {:<5} {:<5} {:<5} {:<5} {:<5}".format(*data.values())
         self._data_logger.info(data_string)
+        log_time = np.datetime64(datetime.now(), 's')
+        record = np.array((log_time, *(data[name] for name in log_names[1:])), dtype=get_log_dtype())
+        self._buffer.append(record)
+        if self._binary_log:
+            try:
+                self._binary_log.append(record)
+            except OSError as err:
+                self.logger.error("Error writing binary data log: {}".format(err))
+        if self._rollups:
+            try:
+                self._rollups.add(record)
+            except OSError as err:
+                self.logger.error("Error writing data rollups: {}".format(err))
+        if self._event_log:
+            # Nothing is written unless a keyframe is due, changes are queued as they happen.
+            self._queue_event(data)
+            self._write_events()
+        if not uses_server_plots(self.config):
+            # Charts are drawn by the browser, plots are only rendered on demand by the web app.
+            return
         try:
-            plot_log(log_filename=self._log_file,
-                     log_interval=self._loop_interval,
-                     **self.config['data_logger']['plotting'])
+            self._plot_worker.submit(log_filename=self._data_file,
+                                     log_interval=self._loop_interval,
+                                     log_data=self.recent_data,
+                                     **self.config['data_logger']['plotting'])
         except Exception as err:
             # Don't want any plotting issues to stop data logging. Log the error, then carry on regardless.
             self.logger.error("Error updating temperature plot: {}".format(err))
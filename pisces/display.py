@@ -1,11 +1,23 @@
 import datetime
+from threading import Thread, Event, Lock
 
 from PIL import Image, ImageDraw, ImageFont
-from board import SCL, SDA
-import busio
-import adafruit_ssd1306
 
 from pisces.base import PiscesBase
+from pisces.metrics import histogram, counter
+from pisces.simulation import is_simulated, SimulatedSSD1306
+
+# SSD1306 commands.
+SET_COL_ADDR = 0x21
+SET_PAGE_ADDR = 0x22
+
+display_update_duration = histogram('pisces_display_update_seconds',
+                                    "Time taken to render and send a display frame.")
+display_write_duration = histogram('pisces_display_write_seconds',
+                                   "Time spent sending a display frame over the I2C bus.")
+display_frames = counter('pisces_display_frames_total',
+                         "Display frames rendered, by whether they were sent or skipped as unchanged.",
+                         labels=('result',))
 
 class Display(PiscesBase):
     """Class to control the Adafruit PiOLED status display."""
@@ -18,20 +30,44 @@ class Display(PiscesBase):
         self._top_padding = int(self.config['display']['top_padding'])
         self._left_padding = int(self.config['display']['left_padding'])
         self._spacing = int(self.config['display']['spacing'])
+        self._max_refresh_rate = float(self.config['display'].get('max_refresh_rate', 2))
+        if self._max_refresh_rate <= 0:
+            msg = "Display 'max_refresh_rate' must be > 0."
+            self.logger.critical(msg)
+            raise ValueError(msg)
 
         self._image_buffer = Image.new('1', (self._width, self._height))
         self._image_draw = ImageDraw.Draw(self._image_buffer)
         self._font = ImageFont.load_default()
-        
+        # Last frame sent to the display, for skipping or minimising updates.
+        self._last_frame = None
+        self._last_buffer = None
+
+        # Serialises access to the display, the renderer thread and clear() may both use it.
+        self._lock = Lock()
+        self._update_requested = Event()
+        self._stop_event = Event()
+
         self._initialise()
         self.clear()
 
+        self._renderer = Thread(target=self._render_loop, daemon=True)
+        self._renderer.start()
+
+        # Only redraw when something that's displayed has changed.
+        self._core.status_store.subscribe(self._status_changed)
+        # Show the status so far, it may have been set before subscribing.
+        self.request_update()
+
     def _initialise(self):
         try:
-            # Create the I2C interface.
-            i2c = busio.I2C(SCL, SDA)
-            # Create the SSD1306 OLED display object.
-            self._display = adafruit_ssd1306.SSD1306_I2C(self._width, self._height, i2c)
+            if is_simulated(self.config):
+                self._display = SimulatedSSD1306(self._width, self._height)
+            else:
+                import adafruit_ssd1306
+                from pisces.sensors import get_sensor_bus
+                # Create the SSD1306 OLED display object, on the I2C bus shared with the sensors.
+                self._display = adafruit_ssd1306.SSD1306_I2C(self._width, self._height, get_sensor_bus().i2c)
         except Exception as err:
             self.logger.error("Error initialising PiOLED display: {}".format(err))
             self._initialised = False
@@ -40,6 +76,7 @@ class Display(PiscesBase):
             self._initialised = True
 
     def __del__(self):
+        self.stop()
         self.clear()
 
     @property
@@ -50,17 +87,66 @@ class Display(PiscesBase):
     def clear(self, white=False):
         """Clears the display."""
         if self.is_initialised:
-            if white:
-                self._display.fill(255)
-            else:
-                self._display.fill(0)
-            self._display.show()
+            with self._lock:
+                if white:
+                    self._display.fill(255)
+                else:
+                    self._display.fill(0)
+                self._display.show()
+                self._last_frame = None
+                self._last_buffer = bytes(self._display.buffer)
         else:
             self.logger.warning("Attempt to clear display but display not initialised.")
 
+    def request_update(self):
+        """Asks the renderer thread to update the display, without waiting for it.
+
+        Requests made while the renderer is busy or rate limited are merged into
+        a single update.
+        """
+        self._update_requested.set()
+
+    def _status_changed(self, snapshot, changed):
+        self.request_update()
+
+    def stop(self):
+        """Stops the renderer thread."""
+        if self._renderer.is_alive():
+            self._stop_event.set()
+            self._update_requested.set()  # Wake the renderer so it sees the stop.
+            self._renderer.join(timeout=5)
+
     def update(self):
-        """Updates the status display with the Pisces core status info."""
+        """Updates the status display with the Pisces core status info.
+
+        This renders and sends the frame in the calling thread, use request_update()
+        to have the renderer thread do it instead.
+        """
+        with self._lock, display_update_duration.time():
+            self._render()
+
+    def _render_loop(self):
+        min_interval = 1 / self._max_refresh_rate
+        while True:
+            # Updates are only requested when the status changes, the clock needs one every minute too.
+            self._update_requested.wait(60 - datetime.datetime.now().second)
+            if self._stop_event.is_set():
+                break
+            self._update_requested.clear()
+            try:
+                self.update()
+            except Exception as err:
+                self.logger.error("Error updating display: {}".format(err))
+            # Enforce the maximum refresh rate. Requests arriving in the meantime
+            # all get merged into the next frame.
+            if self._stop_event.wait(min_interval):
+                break
+
+    def _render(self):
         if self.is_initialised:
+            # Consistent copy of the status for the whole frame.
+            status = self._core.status
+
             # Format current time
             now = datetime.datetime.now()
             time_string = now.strftime("%H:%M")
@@ -74,7 +160,7 @@ class Display(PiscesBase):
                                                           time_string),
                                   font=self._font, fill=255)
 
-            if self._core.status['water_temp_status'] == 'OK':
+            if status['water_temp_status'] == 'OK':
                 rectangle_colour = 0
                 text_colour = 255
             else:
@@ -87,14 +173,14 @@ class Display(PiscesBase):
                                         self._left_padding + 47,
                                         2 * self._spacing - 1), outline=rectangle_colour, fill=rectangle_colour)
             self._image_draw.text((self._left_padding, self._top_padding + self._spacing),
-                                  "WT:{:2.1f}C".format(self._core.status['water_temp']),
+                                  "WT:{:2.1f}C".format(status['water_temp']),
                                   font=self._font, fill=text_colour)
                 
             self._image_draw.text((self._left_padding, self._top_padding + self._spacing),
-                                  "            AT:{:2.1f}C".format(self._core.status['air_temp']),
+                                  "            AT:{:2.1f}C".format(status['air_temp']),
                                   font=self._font, fill=255)
             
-            if self._core.status['water_level_status'] == 'OK':
+            if status['water_level_status'] == 'OK':
                 rectangle_colour = 0
                 text_colour = 255
             else:
@@ -108,10 +194,10 @@ class Display(PiscesBase):
                                         self._left_padding + 53,
                                         3 * self._spacing - 1), outline=rectangle_colour, fill=rectangle_colour)
             self._image_draw.text((self._left_padding, self._top_padding + 2 * self._spacing),
-                                  "WL:{:2.1f}cm".format(self._core.status['water_level']),
+                                  "WL:{:2.1f}cm".format(status['water_level']),
                                   font=self._font, fill=text_colour)        
 
-            if self._core.status['overflow']:
+            if status['overflow']:
                 # Water overflow sensor triggered.
                 self._image_draw.rectangle((self._left_padding + 70,
                                             self._top_padding + 2 * self._spacing + 2,
@@ -122,26 +208,26 @@ class Display(PiscesBase):
                                        self._top_padding + 2 * self._spacing),
                                       "OVERFLOW", font=self._font, fill=0)
 
-            if self._core.status['lights_auto']:
+            if status['lights_auto']:
                 lights = 'Auto'
             else:
-                if self._core.status['lights_enabled']:
+                if status['lights_enabled']:
                     lights = 'On'
                 else:
                     lights = 'Off'
 
-            if self._core.status['fan_auto']:
+            if status['fan_auto']:
                 fan = 'Auto'
             else:
-                if self._core.status['fan_enabled']:
+                if status['fan_enabled']:
                     fan = 'On'
                 else:
                     fan = 'Off'
 
-            if self._core.status['pump_auto']:
+            if status['pump_auto']:
                 pump = 'Auto'
             else:
-                if self._core.status['pump_enabled']:
+                if status['pump_enabled']:
                     pump = 'On'
                 else:
                     pump = 'Off'
@@ -150,8 +236,65 @@ class Display(PiscesBase):
                                   "L:{:<4} F:{:<4} P:{:<4}".format(lights, fan, pump),
                                   font=self._font, fill=255)
             
-            # Display updated image
-            self._display.image(self._image_buffer)
-            self._display.show()
+            # Display updated image, if it has changed.
+            frame = self._image_buffer.tobytes()
+            if frame != self._last_frame:
+                with display_write_duration.time():
+                    self._display.image(self._image_buffer)
+                    self._show_changes()
+                self._last_frame = frame
+                display_frames.inc(result='sent')
+            else:
+                display_frames.inc(result='unchanged')
         else:
             self.logger.warning("Attempt to update display but display not initialised.")
+
+    def _show_changes(self):
+        """Sends only the parts of the display buffer that have changed since the last update.
+
+        The SSD1306 buffer is arranged as pages of 8 pixel high columns, one byte per
+        column. For each page with changes only the span from the first to the last
+        changed column is written.
+        """
+        buffer = self._display.buffer
+        if self._last_buffer is None or len(self._last_buffer) != len(buffer):
+            self._display.show()
+            self._last_buffer = bytes(buffer)
+            return
+
+        n_pages = self._height // 8
+        dirty = []
+        for page in range(n_pages):
+            # First byte of the buffer is the I2C control byte.
+            start = 1 + page * self._width
+            new = buffer[start:start + self._width]
+            old = self._last_buffer[start:start + self._width]
+            if new != old:
+                changed = [column for column in range(self._width) if new[column] != old[column]]
+                dirty.append((page, changed[0], changed[-1]))
+
+        if len(dirty) == n_pages:
+            # Everything has changed, quicker to send the whole frame in one go.
+            self._display.show()
+        else:
+            for page, first_column, last_column in dirty:
+                self._write_page(page, first_column, last_column)
+        self._last_buffer = bytes(buffer)
+
+    def _write_page(self, page, first_column, last_column):
+        """Writes columns first_column to last_column (inclusive) of one page to the display."""
+        column_offset = 0
+        if self._width != 128:
+            # Narrow displays use centered columns.
+            column_offset = (128 - self._width) // 2
+        self._display.write_cmd(SET_COL_ADDR)
+        self._display.write_cmd(first_column + column_offset)
+        self._display.write_cmd(last_column + column_offset)
+        self._display.write_cmd(SET_PAGE_ADDR)
+        self._display.write_cmd(page)
+        self._display.write_cmd(page)
+        start = 1 + page * self._width
+        data = bytearray(self._display.buffer[0:1])  # I2C control byte
+        data += self._display.buffer[start + first_column:start + last_column + 1]
+        with self._display.i2c_device:
+            self._display.i2c_device.write(data)
@@ -0,0 +1,474 @@
+"""Event data log, with a delta encoded record of every status change.
+
+The regular data log samples the status every loop_interval, so anything
+shorter, like a fan cycling or a brief overflow, can be missed. The event
+log writes a record whenever the status changes instead, with only the
+fields that changed in it, plus a keyframe with all the fields every so
+often and at the start of each file.
+
+Like the binary data log there is one file per day, e.g.
+'data/pisces.evt.2019-05-01'. Each file starts with a header, in the same
+layout as the binary data log header:
+
+    8 bytes     magic, b'PISCESEV'
+    4 bytes     total header length in bytes, little endian uint32
+    remainder   JSON description of the fields, padded with spaces
+
+followed by variable length records:
+
+    varint      (field mask << 1) | keyframe flag, bit i of the mask set
+                if field i is in the record. Keyframes have every field.
+    varint      log time. Seconds since 1970-01-01T00:00:00 local time in
+                keyframes, otherwise seconds since the previous record.
+    values      one per field in the record, in field order:
+                float   varint, 0 for NaN, otherwise the zigzag encoded
+                        difference from the previous number in units of
+                        1 / scale, plus 1. Differences are from 0 in
+                        keyframes.
+                str     varint length, then UTF-8 bytes.
+                bool    byte 0 or 1 in keyframes. Nothing in other records,
+                        the field being there means the value toggled.
+
+Varints are unsigned LEB128. A typical change record is 3 to 5 bytes.
+
+read_log() reads event logs, as the state after each record or resampled
+at regular intervals.
+"""
+import os
+import json
+import struct
+from threading import Lock
+
+import numpy as np
+
+from pisces.binlog import get_binary_log_files
+from pisces.utils import get_log_dtype, log_names
+
+magic = b'PISCESEV'
+header_alignment = 64
+# Floats are stored as whole numbers of 1 / scale, i.e. to 0.001 deg C or cm.
+default_scale = 1000
+default_keyframe_interval = 3600  # Seconds
+
+
+def _field_kinds():
+    dtype = get_log_dtype()
+    return tuple((name, dtype[name].kind) for name in log_names[1:])
+
+
+def _write_varint(buffer, value):
+    while value > 0x7f:
+        buffer.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def _read_varint(data, offset):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def _zigzag(value):
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def _unzigzag(value):
+    return value // 2 if not value & 1 else -(value + 1) // 2
+
+
+def write_header(event_file, fields, scale):
+    """Writes an event log header for the given (name, kind) fields."""
+    description = json.dumps({'version': 1, 'fields': fields, 'scale': scale}).encode()
+    header_length = len(magic) + 4 + len(description)
+    padding = -header_length % header_alignment
+    header_length += padding
+    event_file.write(magic)
+    event_file.write(struct.pack('<I', header_length))
+    event_file.write(description + b' ' * padding)
+
+
+def read_header(data, filename=''):
+    """Reads the header from the contents of an event log file.
+
+    Returns:
+        tuple: (list, int, int) (name, kind) fields, scale and offset of the first record.
+
+    Raises:
+        ValueError: data is not a Pisces event log.
+    """
+    if data[:len(magic)] != magic:
+        msg = "{} is not a Pisces event log".format(filename)
+        raise ValueError(msg)
+    header_length = struct.unpack('<I', data[len(magic):len(magic) + 4])[0]
+    description = json.loads(bytes(data[len(magic) + 4:header_length]).decode())
+    return [tuple(field) for field in description['fields']], description['scale'], header_length
+
+
+class EventLogWriter():
+    """Writes status changes to one event log file per day.
+
+    The current day's file is kept open, and records are buffered until
+    flush() is called or the file changes, so call flush() after each batch
+    of records and close() when done. An existing file is appended to, e.g.
+    after a restart, once any incomplete record at its end is removed.
+
+    Args:
+        log_root (str): path of the event log. The date of the records is
+            appended to get the name of each daily file, e.g.
+            'data/pisces.evt.2019-05-01'.
+        keyframe_interval (float, optional): seconds between keyframes,
+            default 3600.
+        deadband (dict, optional): smallest change in each float field that
+            is logged, keyed by field name. Smaller changes are ignored until
+            they add up to this. Default log any change of 1 / scale or more.
+        scale (int, optional): floats are stored as whole numbers of 1 / scale,
+            default 1000.
+    """
+    def __init__(self, log_root, keyframe_interval=default_keyframe_interval, deadband=None, scale=default_scale):
+        self._log_root = log_root
+        self._keyframe_interval = float(keyframe_interval)
+        self._scale = int(scale)
+        self._fields = _field_kinds()
+        deadband = deadband or {}
+        self._deadband = {name: max(int(round(float(deadband.get(name, 0)) * self._scale)), 1)
+                          for name, kind in self._fields if kind == 'f'}
+        self._lock = Lock()
+        self._filename = None
+        self._file = None
+        self._last_time = None
+        self._last_keyframe = None
+        # Values as last logged, with floats as whole numbers of 1 / scale or None for NaN.
+        self._values = None
+        # Last logged number for each float field, differences are from this.
+        self._numbers = None
+        log_dir = os.path.dirname(log_root)
+        if log_dir:
+            os.makedirs(log_dir, exist_ok=True)
+
+    @property
+    def log_root(self):
+        return self._log_root
+
+    def flush(self):
+        """Writes any buffered records to the file."""
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self):
+        """Writes any buffered records and closes the file. Appending again reopens it."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def filename(self, log_time):
+        """Returns the name of the daily file for the given datetime64."""
+        return "{}.{}".format(self._log_root, np.datetime_as_string(log_time, unit='D'))
+
+    def append(self, log_time, status):
+        """Logs the status if it has changed, or if a keyframe is due.
+
+        Args:
+            log_time: local time, as a datetime or datetime64.
+            status: mapping of status values, e.g. a StatusSnapshot.
+
+        Returns:
+            int: length of the record in bytes, 0 if nothing was logged.
+        """
+        log_time = np.datetime64(log_time, 's')
+        seconds = int(log_time.astype(np.int64))
+        values = {}
+        for name, kind in self._fields:
+            value = status[name]
+            if kind == 'f':
+                value = None if np.isnan(value) else int(round(float(value) * self._scale))
+            elif kind == 'b':
+                value = bool(value)
+            else:
+                value = str(value)
+            values[name] = value
+
+        with self._lock:
+            filename = self.filename(log_time)
+            keyframe = (filename != self._filename or
+                        seconds < self._last_time or
+                        seconds - self._last_keyframe >= self._keyframe_interval)
+            if keyframe:
+                changed = [name for name, _ in self._fields]
+            else:
+                changed = [name for name, _ in self._fields if self._is_change(name, values[name])]
+                if not changed:
+                    return 0
+
+            record = bytearray()
+            mask = 0
+            for i, (name, _) in enumerate(self._fields):
+                if name in changed:
+                    mask |= 1 << i
+            _write_varint(record, mask << 1 | keyframe)
+            _write_varint(record, seconds if keyframe else seconds - self._last_time)
+            numbers = dict.fromkeys(self._deadband, 0) if keyframe else dict(self._numbers)
+            for name, kind in self._fields:
+                if name not in changed:
+                    continue
+                value = values[name]
+                if kind == 'f':
+                    if value is None:
+                        _write_varint(record, 0)
+                    else:
+                        _write_varint(record, _zigzag(value - numbers[name]) + 1)
+                        numbers[name] = value
+                elif kind == 'b':
+                    if keyframe:
+                        record.append(value)
+                else:
+                    encoded = value.encode()
+                    _write_varint(record, len(encoded))
+                    record.extend(encoded)
+
+            if self._file is None or filename != self._file.name:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                self._file = self._open(filename)
+            self._file.write(record)
+
+            self._filename = filename
+            self._last_time = seconds
+            if keyframe:
+                self._last_keyframe = seconds
+                self._values = values
+            else:
+                self._values = dict(self._values, **{name: values[name] for name in changed})
+            self._numbers = numbers
+            return len(record)
+
+    def _open(self, filename):
+        event_file = open(filename, 'ab')
+        if event_file.tell() == 0:
+            write_header(event_file, self._fields, self._scale)
+            return event_file
+        # Appending to an existing file, e.g. after a restart. Drop any incomplete record at the
+        # end first, or the decoder would read it together with the start of the new keyframe.
+        try:
+            with open(filename, 'rb') as existing_file:
+                data = existing_file.read()
+            _, length = decode_records(data, filename)
+            if length < len(data):
+                event_file.truncate(length)
+        except Exception:
+            event_file.close()
+            raise
+        return event_file
+
+    def _is_change(self, name, value):
+        old_value = self._values[name]
+        if name not in self._deadband or value is None or old_value is None:
+            return value != old_value
+        return abs(value - old_value) >= self._deadband[name]
+
+
+def decode_records(data, filename=''):
+    """Decodes the records in the contents of an event log file.
+
+    Decoding stops at the first record that is incomplete or can't be
+    decoded, e.g. from a write that was interrupted. Records before the
+    first keyframe are skipped.
+
+    Returns:
+        tuple: (list, int) tuples of the log time and values after each
+            record, and the length of the data up to the end of the last
+            complete record.
+
+    Raises:
+        ValueError: data is not a Pisces event log with the data log fields.
+    """
+    fields, scale, offset = read_header(data, filename)
+    log_fields = dict(_field_kinds())
+    if any(log_fields.get(name) != kind for name, kind in fields):
+        msg = "{} has different fields to the data log".format(filename)
+        raise ValueError(msg)
+
+    rows = []
+    seconds = None
+    values = None
+    numbers = {name: 0 for name, kind in fields if kind == 'f'}
+    while offset < len(data):
+        try:
+            header, position = _read_varint(data, offset)
+            keyframe = header & 1
+            mask = header >> 1
+            time_value, position = _read_varint(data, position)
+            # Can't decode changes without a keyframe to start from, they're read only to skip them.
+            skipping = not keyframe and values is None
+            new_values = {} if keyframe or skipping else dict(values)
+            new_numbers = dict.fromkeys(numbers, 0) if keyframe else dict(numbers)
+            for i, (name, kind) in enumerate(fields):
+                if not mask & (1 << i):
+                    continue
+                if kind == 'f':
+                    encoded, position = _read_varint(data, position)
+                    if encoded == 0:
+                        new_values[name] = np.nan
+                    else:
+                        new_numbers[name] += _unzigzag(encoded - 1)
+                        new_values[name] = new_numbers[name] / scale
+                elif kind == 'b':
+                    if keyframe:
+                        new_values[name] = bool(data[position])
+                        position += 1
+                    elif not skipping:
+                        new_values[name] = not new_values[name]
+                else:
+                    length, position = _read_varint(data, position)
+                    if position + length > len(data):
+                        raise IndexError
+                    new_values[name] = data[position:position + length].decode()
+                    position += length
+            if keyframe and len(new_values) != len(fields):
+                msg = "Keyframe without all the fields in {}".format(filename)
+                raise ValueError(msg)
+        except (IndexError, ValueError):
+            # Ran off the end of the data or into garbage, incomplete record.
+            break
+        offset = position
+        if skipping:
+            continue
+        seconds = time_value if keyframe else seconds + time_value
+        values = new_values
+        numbers = new_numbers
+        rows.append((np.datetime64(seconds, 's'),) + tuple(values[name] for name in log_names[1:]))
+    return rows, offset
+
+
+def decode_event_file(filename):
+    """Decodes an event log file into the status after each record.
+
+    Any incomplete record at the end of the file, e.g. from a write that was
+    interrupted, is ignored, as are any records before the first keyframe.
+
+    Returns:
+        numpy.ndarray: structured array with the data log dtype, oldest first.
+    """
+    with open(filename, 'rb') as event_file:
+        data = event_file.read()
+    rows, _ = decode_records(data, filename)
+    return np.array(rows, dtype=get_log_dtype())
+
+
+def resample(events, interval, start=None, end=None):
+    """Samples the status from event log records at regular intervals.
+
+    Each sample has the values from the most recent record at or before its
+    time. There are no samples before the first record.
+
+    Args:
+        events (numpy.ndarray): status after each event log record, oldest first.
+        interval (float): seconds between samples.
+        start (optional): time of the first sample. Default the time of the
+            first record.
+        end (optional): latest time to sample. Default the time of the last record.
+
+    Returns:
+        numpy.ndarray: structured array with the data log dtype, oldest first.
+    """
+    interval = np.timedelta64(int(interval), 's')
+    if interval < np.timedelta64(1, 's'):
+        msg = "interval must be at least 1 second, got {}".format(interval)
+        raise ValueError(msg)
+    if len(events) == 0:
+        return events[:0]
+    start = events['log_time'][0] if start is None else np.datetime64(start, 's')
+    end = events['log_time'][-1] if end is None else np.datetime64(end, 's')
+    if end < start:
+        return events[:0]
+    sample_times = np.arange(start, end + np.timedelta64(1, 's'), interval)
+    indices = np.searchsorted(events['log_time'], sample_times, side='right') - 1
+    valid = indices >= 0
+    samples = events[indices[valid]]
+    samples['log_time'] = sample_times[valid]
+    return samples
+
+
+def read_event_log(log_root, n_records=1, start=None, end=None, interval=None, log_files=None):
+    """Gets the status from a set of daily event log files.
+
+    Without an interval this is the status after each record, either for the
+    last n records or, if start and/or end are given, for all the records
+    between start and end (inclusive). With an interval the status is
+    resampled, giving either the last n samples up to the last record or all
+    the samples from start to end.
+
+    Args:
+        log_root (str): path of the event log, without the date suffix.
+        n_records (int, optional): number of records or samples to return,
+            default 1. Ignored if start or end are given.
+        start (optional): earliest log time to include, as a datetime,
+            datetime64 or ISO 8601 string. Default no limit.
+        end (optional): latest log time to include. Default no limit.
+        interval (float, optional): seconds between samples, default no resampling.
+        log_files (list, optional): daily files, from get_binary_log_files().
+            Default look for them.
+
+    Returns:
+        numpy.ndarray: structured array with the data log dtype, oldest first.
+    """
+    if log_files is None:
+        log_files = get_binary_log_files(log_root)
+    if not log_files:
+        msg = "No event log files found for {}".format(log_root)
+        raise OSError(msg)
+
+    if start is None and end is None:
+        n_records = int(n_records)
+        if n_records < 1:
+            msg = "n_records must be a positive integer, got {}".format(n_records)
+            raise ValueError(msg)
+        chunks = []
+        n_found = 0
+        # Newest first, until there are enough records to cover the samples.
+        for log_file in reversed(log_files):
+            chunks.insert(0, decode_event_file(log_file))
+            events = np.concatenate(chunks)
+            if len(events) == 0:
+                continue
+            if interval is None:
+                n_found = len(events)
+            else:
+                n_found = int((events['log_time'][-1] - events['log_time'][0]).astype(np.int64) // interval) + 1
+            if n_found >= n_records:
+                break
+        events = np.concatenate(chunks)
+        if interval is not None and len(events):
+            last = events['log_time'][-1]
+            events = resample(events, interval,
+                              start=last - np.timedelta64(int(interval) * (n_records - 1), 's'), end=last)
+        return events[-n_records:]
+
+    start = None if start is None else np.datetime64(start, 's')
+    end = None if end is None else np.datetime64(end, 's')
+    # The status at start can come from the day before.
+    first_date = None if start is None else np.datetime_as_string(start - np.timedelta64(1, 'D'), unit='D')
+    last_date = None if end is None else np.datetime_as_string(end, unit='D')
+    chunks = []
+    for log_file in log_files:
+        # Daily files are named after the date of the records they contain.
+        log_date = log_file[len(log_root) + 1:]
+        if (first_date is not None and log_date < first_date) or (last_date is not None and log_date > last_date):
+            continue
+        chunks.append(decode_event_file(log_file))
+    events = np.concatenate(chunks) if chunks else np.empty(0, dtype=get_log_dtype())
+
+    if interval is not None:
+        return resample(events, interval, start, end)
+    first = 0 if start is None else np.searchsorted(events['log_time'], start, side='left')
+    last = len(events) if end is None else np.searchsorted(events['log_time'], end, side='right')
+    return events[first:last]
@@ -45,6 +45,13 @@ class LightsControl(ControlBase, PollingBase):
         self._time_off = off_time
         self._update_timer()
 
+    def config_changed(self, config, changed):
+        super().config_changed(config, changed)
+        if 'lights_control.time_on' in changed:
+            self.time_on = self.config['lights_control']['time_on']
+        if 'lights_control.time_off' in changed:
+            self.time_off = self.config['lights_control']['time_off']
+
     def _update_timer(self):
         self._timer = TimeOfDay(self.time_on, self.time_off, utc=False)  # Work in local time
         self.logger.info("Light timer set - On: {}, Off: {}.".format(self.time_on.strftime("%H:%M"),   
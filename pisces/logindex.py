@@ -0,0 +1,190 @@
+"""Time index for text data logs.
+
+Rotated data logs never change, so each one gets a small JSON sidecar index
+holding its first and last log times and the byte offset of every
+`stride`-th line. Compressed rotated logs have their own block index, see
+pisces.compressedlog. Time range queries use the file names and the indices to
+pick the files they need, then seek straight to the right part of each one.
+
+Log lines start with an ISO 8601 local time, so times can be compared as
+strings without being parsed.
+"""
+import os
+import json
+import bisect
+from glob import glob
+from datetime import date
+
+import numpy as np
+
+index_suffix = '.idx'
+default_stride = 64
+# Length of the local time part of a log time, i.e. without UTC offset.
+time_length = len('YYYY-mm-ddTHH:MM:SS')
+
+
+def index_filename(log_filename):
+    """Returns the path of the sidecar index for a data log file."""
+    return log_filename + index_suffix
+
+
+def get_rotated_logs(log_filename):
+    """Returns the rotated versions of a data log, oldest first.
+
+    Compressed rotated logs are included, in place of the uncompressed log if
+    both exist while it is being compressed.
+    """
+    from pisces.compressedlog import compressed_suffix
+
+    rotated_logs = {old_log for old_log in glob("{}.20*".format(log_filename))
+                    if not old_log.endswith((index_suffix, '.tmp'))}
+    return sorted(old_log for old_log in rotated_logs if old_log + compressed_suffix not in rotated_logs)
+
+
+def to_time_string(log_time):
+    """Converts a datetime, datetime64 or ISO 8601 string to a log time string."""
+    if log_time is None:
+        return None
+    return str(np.datetime64(log_time, 's'))
+
+
+def build_index(log_filename, stride=default_stride):
+    """Scans a data log file and returns its index.
+
+    Args:
+        log_filename (str): path to the data log file.
+        stride (int, optional): number of lines between indexed offsets.
+
+    Returns:
+        dict: index with the size of the file, first and last log times and
+            a list of [log time, byte offset] pairs.
+    """
+    offsets = []
+    first = last = None
+    offset = 0
+    with open(log_filename, 'rb') as log_file:
+        for i, line in enumerate(log_file):
+            log_time = line[:time_length].decode()
+            if first is None:
+                first = log_time
+            if i % stride == 0:
+                offsets.append([log_time, offset])
+            if line.strip():
+                last = log_time
+            offset += len(line)
+
+    return {'size': offset,
+            'stride': stride,
+            'first': first,
+            'last': last,
+            'offsets': offsets}
+
+
+def load_index(log_filename, stride=default_stride):
+    """Returns the index for a data log file, building it if necessary.
+
+    The index is rebuilt if the data log has changed size since the index was
+    written. Failure to write the sidecar, e.g. for read only storage, is not
+    an error, the index is just rebuilt next time.
+    """
+    sidecar = index_filename(log_filename)
+    try:
+        with open(sidecar) as index_file:
+            index = json.load(index_file)
+    except (OSError, ValueError):
+        index = None
+
+    if index is None or index['size'] != os.path.getsize(log_filename):
+        index = build_index(log_filename, stride)
+        try:
+            with open(sidecar, 'w') as index_file:
+                json.dump(index, index_file)
+        except OSError:
+            pass
+
+    return index
+
+
+def _lines_from_offset(log_filename, offset, start, end):
+    lines = []
+    with open(log_filename) as log_file:
+        log_file.seek(offset)
+        for line in log_file:
+            log_time = line[:time_length]
+            if end is not None and log_time > end:
+                break
+            if start is None or log_time >= start:
+                lines.append(line)
+    return lines
+
+
+def read_indexed_lines(log_filename, start=None, end=None, stride=default_stride):
+    """Gets the lines of a rotated data log between two log times (inclusive)."""
+    from pisces.compressedlog import is_compressed, read_compressed_lines
+
+    if is_compressed(log_filename):
+        return read_compressed_lines(log_filename, start, end)
+    index = load_index(log_filename, stride)
+    if index['first'] is None:
+        return []
+    if (start is not None and index['last'] < start) or (end is not None and index['first'] > end):
+        return []
+
+    offset = 0
+    if start is not None:
+        # Last indexed line before start, or start of file.
+        position = bisect.bisect_left([log_time for log_time, _ in index['offsets']], start)
+        if position > 0:
+            offset = index['offsets'][position - 1][1]
+
+    return _lines_from_offset(log_filename, offset, start, end)
+
+
+def _log_date(rotated_log, log_filename):
+    # Rotated data logs are named after the date of the data they contain.
+    try:
+        return date.fromisoformat(rotated_log[len(log_filename) + 1:][:10])
+    except ValueError:
+        return None
+
+
+def read_lines_between(log_filename, start=None, end=None, stride=default_stride, rotated_logs=None):
+    """Gets the lines of a data log, including rotated logs, between two times.
+
+    Args:
+        log_filename (str): path to the current data log file.
+        start (optional): earliest log time to include, as a datetime,
+            datetime64 or ISO 8601 string. Default no limit.
+        end (optional): latest log time to include. Default no limit.
+        stride (int, optional): number of lines between indexed offsets.
+        rotated_logs (list, optional): rotated logs, from get_rotated_logs().
+            Default look for them.
+
+    Returns:
+        list: log lines in chronological order.
+    """
+    start = to_time_string(start)
+    end = to_time_string(end)
+    if rotated_logs is None:
+        rotated_logs = get_rotated_logs(log_filename)
+
+    lines = []
+    for rotated_log in rotated_logs:
+        # Use the file name to skip most files without touching them, allowing a
+        # day's margin for lines logged around midnight.
+        log_date = _log_date(rotated_log, log_filename)
+        if log_date is not None:
+            if end is not None and log_date.isoformat() > end[:10]:
+                continue
+            if start is not None and log_date.toordinal() < date.fromisoformat(start[:10]).toordinal() - 1:
+                continue
+        lines.extend(read_indexed_lines(rotated_log, start, end, stride))
+
+    # The current data log is still being written to so isn't indexed.
+    if os.path.exists(log_filename):
+        with open(log_filename) as log_file:
+            first_time = log_file.readline()[:time_length]
+        if first_time and (end is None or first_time <= end):
+            lines.extend(_lines_from_offset(log_filename, 0, start, end))
+
+    return lines
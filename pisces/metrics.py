@@ -0,0 +1,209 @@
+"""Timing histograms and counters, exported in the Prometheus text format.
+
+Metrics are kept in memory by the process that updates them, normally the
+Pisces core. The core writes them all to a text file every so often, see the
+config 'metrics' section, and the webapp serves that file on its /metrics
+route. Keeping the file in /dev/shm means this never touches the SD card.
+
+Updating a metric takes a lock and a few arithmetic operations, cheap enough
+to use on every control update, sensor read and display update.
+
+Example:
+    read_seconds = histogram('pisces_sensor_read_seconds', "Time taken to read a sensor.", labels=('sensor',))
+
+    with read_seconds.time(sensor='water_temp'):
+        read_the_sensor()
+"""
+import os
+import bisect
+import time
+from threading import Lock
+
+# Bucket upper bounds in seconds, from 100 us to 10 s.
+default_buckets = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names, values, extra=''):
+    labels = ['{}="{}"'.format(name, str(value).replace('\\', r'\\').replace('"', r'\"'))
+              for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    if not labels:
+        return ''
+    return '{' + ','.join(labels) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Timer():
+    """Context manager that observes the time spent inside it."""
+    __slots__ = ('_metric', '_labels', '_start')
+
+    def __init__(self, metric, labels):
+        self._metric = metric
+        self._labels = labels
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self._metric.observe(time.perf_counter() - self._start, **self._labels)
+
+
+class MetricBase():
+    """Base class for metrics, with optional labels.
+
+    Args:
+        name (str): metric name, e.g. 'pisces_task_duration_seconds'.
+        documentation (str): one line description.
+        labels (sequence of str, optional): label names, default none.
+    """
+    metric_type = None
+
+    def __init__(self, name, documentation, labels=()):
+        self._name = name
+        self._documentation = documentation
+        self._label_names = tuple(labels)
+        self._values = {}
+        self._lock = Lock()
+
+    @property
+    def name(self):
+        return self._name
+
+    def _key(self, labels):
+        try:
+            return tuple(labels[name] for name in self._label_names)
+        except KeyError as err:
+            msg = "Missing label {} for metric {}".format(err, self._name)
+            raise ValueError(msg)
+
+    def render(self):
+        """Returns the metric in the Prometheus text format."""
+        lines = ["# HELP {} {}".format(self._name, self._documentation),
+                 "# TYPE {} {}".format(self._name, self.metric_type)]
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(line for key, value in items for line in self._render_value(key, value))
+        return '\n'.join(lines) + '\n'
+
+    def _render_value(self, key, value):
+        raise NotImplementedError
+
+
+class Counter(MetricBase):
+    """Count of events, only ever goes up."""
+    metric_type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _render_value(self, key, value):
+        yield "{}{} {}".format(self._name, _format_labels(self._label_names, key), _format_value(value))
+
+
+class Histogram(MetricBase):
+    """Distribution of observed values, e.g. durations, in fixed buckets.
+
+    Args:
+        name (str): metric name, e.g. 'pisces_task_duration_seconds'.
+        documentation (str): one line description.
+        labels (sequence of str, optional): label names, default none.
+        buckets (sequence of float, optional): bucket upper bounds, in
+            increasing order, default default_buckets.
+    """
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=default_buckets):
+        super().__init__(name, documentation, labels)
+        self._buckets = tuple(float(bucket) for bucket in buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        # Index of the first bucket the value fits in, counts are made cumulative when rendered.
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            values = self._values.get(key)
+            if values is None:
+                # Counts per bucket plus +Inf, then the sum of the values.
+                values = self._values[key] = [0] * (len(self._buckets) + 1) + [0.0]
+            values[index] += 1
+            values[-1] += value
+
+    def time(self, **labels):
+        """Returns a context manager that observes the time spent inside it, in seconds."""
+        return _Timer(self, labels)
+
+    def get_count(self, **labels):
+        with self._lock:
+            values = self._values.get(self._key(labels))
+            return sum(values[:-1]) if values else 0
+
+    def _render_value(self, key, values):
+        total = 0
+        for upper_bound, count in zip(self._buckets + (float('inf'),), values[:-1]):
+            total += count
+            le = 'le="{}"'.format(_format_value(upper_bound))
+            yield "{}_bucket{} {}".format(self._name, _format_labels(self._label_names, key, le), total)
+        labels = _format_labels(self._label_names, key)
+        yield "{}_sum{} {}".format(self._name, labels, _format_value(values[-1]))
+        yield "{}_count{} {}".format(self._name, labels, total)
+
+
+class Registry():
+    """Collection of metrics, rendered together."""
+    def __init__(self):
+        self._metrics = {}
+        self._lock = Lock()
+
+    def _register(self, metric_class, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = metric_class(name, *args, **kwargs)
+            elif not isinstance(metric, metric_class):
+                msg = "Metric {} already registered as a {}".format(name, metric.metric_type)
+                raise ValueError(msg)
+            return metric
+
+    def counter(self, name, documentation, labels=()):
+        """Returns the Counter called name, creating it if necessary."""
+        return self._register(Counter, name, documentation, labels)
+
+    def histogram(self, name, documentation, labels=(), buckets=default_buckets):
+        """Returns the Histogram called name, creating it if necessary."""
+        return self._register(Histogram, name, documentation, labels, buckets)
+
+    def render(self):
+        """Returns all the metrics in the Prometheus text format."""
+        with self._lock:
+            metrics = [self._metrics[name] for name in sorted(self._metrics)]
+        return ''.join(metric.render() for metric in metrics)
+
+    def write(self, filename):
+        """Writes all the metrics to a file in the Prometheus text format.
+
+        The file is replaced in one go, so readers never see a partly written file.
+        """
+        temporary = "{}.{}.tmp".format(filename, os.getpid())
+        with open(temporary, 'w') as metrics_file:
+            metrics_file.write(self.render())
+        os.replace(temporary, filename)
+
+
+# Default registry, used by all of Pisces.
+registry = Registry()
+counter = registry.counter
+histogram = registry.histogram
@@ -0,0 +1,194 @@
+"""Data log plots rendered in a separate worker process.
+
+Rendering a plot with matplotlib takes long enough on a Raspberry Pi to
+delay the next data sample, and while it runs it holds the GIL away from the
+control threads. A PlotWorker hands render jobs over to a child process
+instead, so submitting one returns straight away.
+
+Only the most recent job for each plot matters, each plot replaces the
+previous one, so jobs that are still waiting when a newer one for the same
+plot arrives are dropped rather than rendered. With several tanks one
+worker renders all their plots.
+
+Building a matplotlib figure from scratch costs more than drawing it, so a
+LogPlot keeps its figure, axes and artists between renders and only updates
+the data, limits and title.
+"""
+import os
+import logging
+import multiprocessing
+import queue
+import traceback
+from functools import lru_cache
+from threading import Lock
+
+
+class LogPlot():
+    """Plot of water and air temperatures, cooling fan and lights from the data log.
+
+    The figure is built once, each render just updates it with the new data.
+
+    Args:
+        temp_limits (sequence of float, optional): temperature axis limits, default (23, 28).
+        target_limits (sequence of float, optional): target temperature range
+            to highlight, default (25, 26).
+        duration (float, optional): hours covered by the plot, for the title, default 24.
+    """
+    def __init__(self, temp_limits=(23, 28), target_limits=(25, 26), duration=24):
+        from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
+        from matplotlib.figure import Figure
+
+        self._temp_limits = tuple(temp_limits)
+        self._duration = duration
+        self._lock = Lock()
+
+        self._figure = Figure()
+        FigureCanvas(self._figure)
+        self._figure.set_size_inches(12, 8)
+        self._axes = self._figure.add_subplot(1, 1, 1)
+        self._axes.xaxis_date()
+        self._axes.axhspan(target_limits[0], target_limits[1], color='g', alpha=0.1)
+        self._water_line, = self._axes.plot([], [], 'b-', label='Water temperature')
+        self._air_line, = self._axes.plot([], [], 'c-', label='Air temperature')
+        self._fan_markers, = self._axes.plot([], [], 'yo', label='Cooling fan on')
+        self._lights_markers, = self._axes.plot([], [], 'go', label='Lights on')
+        self._axes.legend(loc=0)
+        self._axes.set_xlabel("Local datetime")
+        self._axes.set_ylabel(r'Temperature / $\degree$C')
+        self._axes.set_ylim(*self._temp_limits)
+        self._title = self._axes.set_title("Temperatures over {} hours".format(duration))
+        self._figure.tight_layout()
+
+    def render(self, log_data, filename):
+        """Updates the plot with log_data and saves it as a PNG.
+
+        Args:
+            log_data (numpy.ndarray): structured array of data log records.
+            filename (str or file-like): filename or binary file to save the plot to.
+        """
+        import numpy as np
+
+        log_time = log_data['log_time']
+        fan_on_times = log_time[log_data['fan_enabled']]
+        lights_on_times = log_time[log_data['lights_enabled']]
+        with self._lock:
+            self._water_line.set_data(log_time, log_data['water_temp'])
+            self._air_line.set_data(log_time, log_data['air_temp'])
+            self._fan_markers.set_data(fan_on_times, np.full(fan_on_times.shape, self._temp_limits[1]))
+            self._lights_markers.set_data(lights_on_times, np.full(lights_on_times.shape, self._temp_limits[0]))
+            if log_time.max() > log_time.min():
+                self._axes.set_xlim(log_time.min(), log_time.max())
+            self._title.set_text("Temperatures over {} hours up to {}".format(self._duration, log_time[-1]))
+            self._figure.savefig(filename, format='png', transparent=False)
+
+
+@lru_cache(maxsize=4)
+def get_log_plot(temp_limits, target_limits, duration):
+    """Returns a LogPlot with the given settings, reusing an existing one if possible.
+
+    Args need to be hashable, e.g. tuples rather than lists.
+    """
+    return LogPlot(temp_limits, target_limits, duration)
+
+
+def _render_plots(jobs, errors, niceness):
+    """Main loop of the worker process."""
+    from pisces.utils import plot_log
+
+    if niceness:
+        # Plots can wait, the control system can't.
+        os.nice(niceness)
+    try:
+        while True:
+            # Skip straight to the most recent job for each plot.
+            waiting = {}
+            job = jobs.get()
+            while job is not None:
+                waiting[job.get('filename_root')] = job
+                try:
+                    job = jobs.get_nowait()
+                except queue.Empty:
+                    break
+            if job is None:
+                break
+            for plot_job in waiting.values():
+                try:
+                    plot_log(**plot_job)
+                except Exception:
+                    errors.put(traceback.format_exc())
+    except KeyboardInterrupt:
+        # The controlling process deals with Ctrl-C.
+        pass
+
+
+class PlotWorker():
+    """Renders data log plots in a separate process.
+
+    Args:
+        niceness (int, optional): amount to lower the priority of the worker
+            process by, default 10.
+    """
+    def __init__(self, niceness=10):
+        self.logger = logging.getLogger('pisces_system')
+        self._niceness = niceness
+        # Fork isn't safe with all the threads in the Pisces core, and spawn means the
+        # worker only imports what it needs.
+        self._context = multiprocessing.get_context('spawn')
+        self._jobs = None
+        self._errors = None
+        self._process = None
+
+    @property
+    def is_running(self):
+        return self._process is not None and self._process.is_alive()
+
+    def start(self):
+        if self.is_running:
+            self.logger.warning("Plot worker already running.")
+            return
+        self._jobs = self._context.Queue()
+        self._errors = self._context.Queue()
+        self._process = self._context.Process(target=_render_plots,
+                                              args=(self._jobs, self._errors, self._niceness),
+                                              name='pisces_plotting',
+                                              daemon=True)
+        self._process.start()
+        self.logger.info("Plot worker started.")
+
+    def stop(self, timeout=10):
+        if not self.is_running:
+            self.logger.warning("Plot worker not running.")
+            return
+        self._jobs.put(None)
+        self._process.join(timeout)
+        if self._process.is_alive():
+            self._process.terminate()
+            self._process.join()
+        self._report_errors()
+        self._process = None
+        self.logger.info("Plot worker stopped.")
+
+    def submit(self, **kwargs):
+        """Queues a plot to be rendered, superseding any still waiting for the same file. Doesn't block.
+
+        Args are passed on to pisces.utils.plot_log.
+        """
+        self._report_errors()
+        if not self.is_running:
+            if self._process is not None:
+                self.logger.error("Plot worker died with exit code {}, restarting.".format(self._process.exitcode))
+                self._process = None
+            self.start()
+        # The queue is unbounded so this never blocks, the worker discards any stale jobs.
+        self._jobs.put(kwargs)
+
+    def _report_errors(self):
+        # Errors are sent back because logging isn't configured in the worker process.
+        if self._errors is None:
+            return
+        while True:
+            try:
+                error = self._errors.get_nowait()
+            except queue.Empty:
+                break
+            self.logger.error("Error updating temperature plot: {}".format(error))
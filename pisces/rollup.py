@@ -0,0 +1,333 @@
+"""Data log rollups at multiple time resolutions.
+
+Reading months of raw samples to draw a plot a few hundred pixels wide means
+parsing hundreds of thousands of records only to throw most of them away.
+Instead the data logger keeps rollups, i.e. summaries of the samples in each
+fixed time bin, at a few increasing bin sizes. Each rollup record has the
+minimum, mean and maximum of the water temperature, air temperature and water
+level, and the fraction of samples with the lights, fan and pump on.
+
+Rollups are updated as each sample arrives. A bin is written to its binary
+log file, one file per resolution, once a sample from a later bin arrives, so
+the rollup files only ever contain complete bins.
+
+Bins are aligned to the local time of the data log, so daily bins run from
+midnight to midnight.
+"""
+import os
+import math
+from functools import lru_cache
+
+from pisces.utils import read_log, get_log_files
+
+# (name, bin size in seconds), finest first.
+default_resolutions = (('5min', 300),
+                       ('1h', 3600),
+                       ('1d', 86400))
+# Data log fields summarised by min, mean and max.
+stat_fields = ('water_temp', 'air_temp', 'water_level')
+# Data log fields summarised by the fraction of samples they were True.
+on_fields = ('lights_enabled', 'fan_enabled', 'pump_enabled')
+# Seconds of raw data log read at a time by read_history().
+raw_chunk_size = 86400
+
+
+def on_field_name(name):
+    """Rollup field name for a data log on/off field, e.g. 'fan_enabled' -> 'fan_on'."""
+    return name.replace('_enabled', '_on')
+
+
+def rollup_filename(rollup_root, resolution_name):
+    """Filename of the rollup at one resolution, e.g. 'data/pisces_rollup.1h'."""
+    return "{}.{}".format(rollup_root, resolution_name)
+
+
+@lru_cache(maxsize=None)
+def get_rollup_dtype():
+    """Returns the NumPy structured dtype of rollup records."""
+    import numpy as np
+
+    fields = [('log_time', 'datetime64[s]'), ('n_samples', '<u4')]
+    for name in stat_fields:
+        fields.extend([(name + '_min', '<f8'), (name + '_mean', '<f8'), (name + '_max', '<f8')])
+    for name in on_fields:
+        fields.append((on_field_name(name), '<f8'))
+    return np.dtype(fields)
+
+
+def to_rollup(log_data):
+    """Converts raw data log records to rollup records of one sample each."""
+    import numpy as np
+
+    rollup = np.zeros(len(log_data), dtype=get_rollup_dtype())
+    rollup['log_time'] = log_data['log_time']
+    rollup['n_samples'] = 1
+    for name in stat_fields:
+        for statistic in ('_min', '_mean', '_max'):
+            rollup[name + statistic] = log_data[name]
+    for name in on_fields:
+        rollup[on_field_name(name)] = log_data[name]
+    return rollup
+
+
+def _combine(rollup, starts):
+    # Combines the runs of records beginning at each index in starts into one record each.
+    import numpy as np
+
+    n_samples = rollup['n_samples'].astype(float)
+    combined = np.zeros(len(starts), dtype=rollup.dtype)
+    combined['log_time'] = rollup['log_time'][starts]
+    combined['n_samples'] = np.add.reduceat(rollup['n_samples'], starts)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for name in stat_fields:
+            combined[name + '_min'] = np.fmin.reduceat(rollup[name + '_min'], starts)
+            combined[name + '_max'] = np.fmax.reduceat(rollup[name + '_max'], starts)
+            means = rollup[name + '_mean']
+            weights = np.where(np.isnan(means), 0, n_samples)
+            combined[name + '_mean'] = (np.add.reduceat(np.where(weights > 0, means, 0) * weights, starts) /
+                                        np.add.reduceat(weights, starts))
+        for name in on_fields:
+            on_name = on_field_name(name)
+            combined[on_name] = np.add.reduceat(rollup[on_name] * n_samples, starts) / combined['n_samples']
+    return combined
+
+
+def downsample(rollup, max_points):
+    """Combines consecutive rollup records so there are no more than max_points.
+
+    Minima and maxima are combined with min and max, means and on fractions
+    are averaged weighted by the number of samples behind each record. NaN
+    values are ignored unless all the values being combined are NaN.
+
+    Args:
+        rollup (numpy.ndarray): structured array of rollup records, oldest first.
+        max_points (int): maximum number of records to return.
+
+    Returns:
+        numpy.ndarray: rollup records, each with the time of the first record it combines.
+    """
+    import numpy as np
+
+    max_points = int(max_points)
+    if max_points < 1:
+        msg = "max_points must be a positive integer, got {}".format(max_points)
+        raise ValueError(msg)
+    if len(rollup) <= max_points:
+        return rollup
+
+    step = -(-len(rollup) // max_points)  # Ceiling division
+    return _combine(rollup, np.arange(0, len(rollup), step))
+
+
+def combine_bins(rollup, start, bin_size):
+    """Combines rollup records into fixed time bins, like downsample().
+
+    Args:
+        rollup (numpy.ndarray): structured array of rollup records, oldest first.
+        start: start of the first bin, as a datetime64.
+        bin_size (int): bin size in seconds.
+
+    Returns:
+        numpy.ndarray: rollup records, one for each bin with any records in it,
+            each with the time of the first record in the bin.
+    """
+    import numpy as np
+
+    if len(rollup) == 0:
+        return rollup
+    bins = (rollup['log_time'].astype('datetime64[s]') - np.datetime64(start, 's')).astype(np.int64) // bin_size
+    return _combine(rollup, np.flatnonzero(np.diff(bins, prepend=bins[0] - 1)))
+
+
+class Rollup():
+    """Rollup of data log samples into bins of one size.
+
+    Args:
+        filename (str): binary log file to write complete bins to.
+        interval (int): bin size, in seconds.
+    """
+    def __init__(self, filename, interval):
+        self._filename = filename
+        self._interval = int(interval)
+        self._bin_start = None
+        self._reset()
+        # Start of the first bin not yet written, so samples that are already rolled up are skipped.
+        self._next_bin = self._last_written_bin()
+        if self._next_bin is not None:
+            self._next_bin += self._interval
+
+    @property
+    def filename(self):
+        return self._filename
+
+    @property
+    def interval(self):
+        return self._interval
+
+    def add(self, record):
+        """Adds a data log record, writing out the current bin if the record is from a later one.
+
+        Records must be added in time order. Records from bins that have already been
+        written are ignored.
+        """
+        import numpy as np
+
+        log_time = int(record['log_time'].astype('datetime64[s]').astype(np.int64))
+        bin_start = log_time - log_time % self._interval
+        if self._next_bin is not None and bin_start < self._next_bin:
+            return
+        if self._bin_start is not None and bin_start != self._bin_start:
+            self.flush()
+        self._bin_start = bin_start
+
+        self._n_samples += 1
+        for name in stat_fields:
+            value = float(record[name])
+            if math.isnan(value):
+                continue
+            self._counts[name] += 1
+            self._sums[name] += value
+            self._mins[name] = min(self._mins[name], value)
+            self._maxs[name] = max(self._maxs[name], value)
+        for name in on_fields:
+            self._on_counts[name] += bool(record[name])
+
+    def flush(self):
+        """Writes out the current bin, if it has any samples."""
+        import numpy as np
+        from pisces.binlog import append_records
+
+        if self._bin_start is None:
+            return
+        rollup = np.zeros((), dtype=get_rollup_dtype())
+        rollup['log_time'] = np.datetime64(self._bin_start, 's')
+        rollup['n_samples'] = self._n_samples
+        for name in stat_fields:
+            if self._counts[name]:
+                rollup[name + '_min'] = self._mins[name]
+                rollup[name + '_mean'] = self._sums[name] / self._counts[name]
+                rollup[name + '_max'] = self._maxs[name]
+            else:
+                rollup[name + '_min'] = rollup[name + '_mean'] = rollup[name + '_max'] = math.nan
+        for name in on_fields:
+            rollup[on_field_name(name)] = self._on_counts[name] / self._n_samples
+        append_records(self._filename, rollup)
+
+        self._next_bin = self._bin_start + self._interval
+        self._bin_start = None
+        self._reset()
+
+    def _reset(self):
+        self._n_samples = 0
+        self._counts = dict.fromkeys(stat_fields, 0)
+        self._sums = dict.fromkeys(stat_fields, 0.0)
+        self._mins = dict.fromkeys(stat_fields, math.inf)
+        self._maxs = dict.fromkeys(stat_fields, -math.inf)
+        self._on_counts = dict.fromkeys(on_fields, 0)
+
+    def _last_written_bin(self):
+        import numpy as np
+        from pisces.binlog import open_memmap
+
+        if not os.path.exists(self._filename):
+            return None
+        rollup = open_memmap(self._filename)
+        if len(rollup) == 0:
+            return None
+        return int(rollup['log_time'][-1].astype(np.int64))
+
+
+class Rollups():
+    """Rollups of data log samples at several resolutions.
+
+    Args:
+        rollup_root (str): path of the rollup files, the resolution name is
+            appended to get the filename for each, e.g. 'data/pisces_rollup.1h'.
+        resolutions (sequence, optional): (name, bin size in seconds) pairs,
+            default default_resolutions.
+    """
+    def __init__(self, rollup_root, resolutions=default_resolutions):
+        rollup_dir = os.path.dirname(rollup_root)
+        if rollup_dir:
+            os.makedirs(rollup_dir, exist_ok=True)
+        self._rollups = [Rollup(rollup_filename(rollup_root, name), interval)
+                         for name, interval in resolutions]
+
+    def add(self, record):
+        """Adds a data log record to all the rollups."""
+        for rollup in self._rollups:
+            rollup.add(record)
+
+    def extend(self, log_data):
+        """Adds data log records, e.g. to catch up with samples logged while not running."""
+        for record in log_data:
+            self.add(record)
+
+
+def read_rollup(filename, start=None, end=None):
+    """Reads the rollup records between start and end (inclusive) from a rollup file."""
+    import numpy as np
+    from pisces.binlog import open_memmap
+
+    rollup = open_memmap(filename)
+    first = 0 if start is None else np.searchsorted(rollup['log_time'], np.datetime64(start, 's'), side='left')
+    last = len(rollup) if end is None else np.searchsorted(rollup['log_time'], np.datetime64(end, 's'),
+                                                           side='right')
+    # Copy, so the file isn't held open.
+    return np.array(rollup[first:last])
+
+
+def read_history(data_file, rollup_root, start, end, n_points, resolutions=default_resolutions,
+                 max_points=None):
+    """Gets the data between start and end at the coarsest resolution that gives at least n_points.
+
+    If none of the rollups are fine enough, or their files don't exist, the
+    raw data log is used instead. Either way the records are returned in the
+    rollup format, raw samples becoming rollup records of one sample each.
+    Bins that are still in progress are not included.
+
+    Reading the raw data log for a long time range would mean holding every
+    sample in it, so with max_points it is read a day or so at a time and
+    the samples are combined into at most max_points fixed time bins as it goes.
+    The data log files are looked up once, not for each chunk.
+
+    Args:
+        data_file (str): path of the data log, text or binary.
+        rollup_root (str): path of the rollup files, or None to always use the data log.
+        start: earliest log time to include, as a datetime, datetime64 or ISO 8601 string.
+        end: latest log time to include.
+        n_points (int): minimum number of points wanted.
+        resolutions (sequence, optional): (name, bin size in seconds) pairs,
+            default default_resolutions.
+        max_points (int, optional): most records to return from the data log,
+            default no limit.
+
+    Returns:
+        tuple: (str, numpy.ndarray) name of the resolution used, 'raw' for the
+            data log, and the structured array of rollup records, oldest first.
+    """
+    import numpy as np
+
+    start = np.datetime64(start, 's')
+    end = np.datetime64(end, 's')
+    span = int((end - start).astype(np.int64))
+    if rollup_root:
+        for name, interval in sorted(resolutions, key=lambda resolution: resolution[1], reverse=True):
+            filename = rollup_filename(rollup_root, name)
+            if span / interval >= n_points and os.path.exists(filename):
+                return name, read_rollup(filename, start, end)
+    if max_points is None:
+        return 'raw', to_rollup(read_log(data_file, start=start, end=end))
+
+    # Bins small enough to give max_points over the whole range, read in chunks of whole bins.
+    bin_size = max(-(-(span + 1) // int(max_points)), 1)
+    chunk_size = bin_size * -(-raw_chunk_size // bin_size)
+    log_files = get_log_files(data_file)
+    chunks = []
+    chunk_start = start
+    while chunk_start <= end:
+        chunk_end = min(chunk_start + np.timedelta64(chunk_size - 1, 's'), end)
+        log_data = read_log(data_file, start=chunk_start, end=chunk_end, log_files=log_files)
+        chunks.append(combine_bins(to_rollup(log_data), start, bin_size))
+        chunk_start = chunk_end + np.timedelta64(1, 's')
+    return 'raw', np.concatenate(chunks)
@@ -0,0 +1,155 @@
+import time
+import heapq
+import logging
+from itertools import count
+from threading import Thread, Condition
+
+from pisces.metrics import histogram, counter
+
+task_duration = histogram('pisces_task_duration_seconds',
+                          "Time taken by each run of a scheduled task.",
+                          labels=('task',))
+task_lateness = histogram('pisces_task_lateness_seconds',
+                          "Time from when a scheduled task was due until it started.",
+                          labels=('task',))
+task_missed = counter('pisces_task_missed_deadlines_total',
+                      "Deadlines of a scheduled task skipped because it was running late.",
+                      labels=('task',))
+task_errors = counter('pisces_task_errors_total',
+                      "Exceptions raised by a scheduled task.",
+                      labels=('task',))
+
+
+class _Task():
+    __slots__ = ('name', 'function', 'interval', 'deadline', 'cancelled')
+
+    def __init__(self, name, function, interval, deadline):
+        self.name = name
+        self.function = function
+        self.interval = interval
+        self.deadline = deadline
+        self.cancelled = False
+
+
+class Scheduler():
+    """Runs functions at regular intervals, all from a single thread.
+
+    Tasks are kept in a heap ordered by their next deadline and the thread
+    sleeps until the earliest one is due, or until the set of tasks changes.
+    Each task is run at a fixed rate, i.e. its next deadline is one interval
+    after the previous deadline rather than after the task finished. If a
+    task falls so far behind that it has missed deadlines they are skipped,
+    not run in a burst.
+    """
+    def __init__(self):
+        self.logger = logging.getLogger('pisces_system')
+        self._heap = []
+        self._tasks = {}
+        self._counter = count()  # Tie breaker for tasks with equal deadlines.
+        self._condition = Condition()
+        self._running = False
+        self._thread = None
+
+    @property
+    def is_running(self):
+        return self._running
+
+    def is_scheduled(self, name):
+        with self._condition:
+            return name in self._tasks
+
+    def add(self, name, function, interval, delay=0):
+        """Adds a task.
+
+        Args:
+            name (str): unique name for the task.
+            function (callable): function to call, with no arguments.
+            interval (float): seconds between calls.
+            delay (float, optional): seconds until the first call, default 0.
+
+        Raises:
+            ValueError: a task with the same name is already scheduled.
+        """
+        with self._condition:
+            if name in self._tasks:
+                msg = "Task '{}' already scheduled.".format(name)
+                raise ValueError(msg)
+            task = _Task(name, function, interval, time.monotonic() + delay)
+            self._tasks[name] = task
+            self._push(task)
+            self._condition.notify()
+
+    def remove(self, name):
+        """Removes a task. If it is currently running it will finish but not run again."""
+        with self._condition:
+            task = self._tasks.pop(name)
+            task.cancelled = True
+            self._condition.notify()
+
+    def start(self):
+        with self._condition:
+            if self._running:
+                self.logger.warning("Scheduler already running.")
+                return
+            self._running = True
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            if not self._running:
+                self.logger.warning("Scheduler not running.")
+                return
+            self._running = False
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _push(self, task):
+        heapq.heappush(self._heap, (task.deadline, next(self._counter), task))
+
+    def _next_due(self):
+        # Called with the condition held. Waits until a task is due, returns None if stopping.
+        while self._running:
+            if not self._heap:
+                self._condition.wait()
+                continue
+            deadline, _, task = self._heap[0]
+            if task.cancelled:
+                heapq.heappop(self._heap)
+                continue
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                self._condition.wait(delay)
+                continue
+            heapq.heappop(self._heap)
+            return task
+        return None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                task = self._next_due()
+            if task is None:
+                break
+
+            start = time.monotonic()
+            task_lateness.observe(max(start - task.deadline, 0), task=task.name)
+            try:
+                task.function()
+            except Exception as err:
+                # Don't let one misbehaving task stop all the others.
+                task_errors.inc(task=task.name)
+                self.logger.error("Error running {}: {}".format(task.name, err))
+            task_duration.observe(time.monotonic() - start, task=task.name)
+
+            with self._condition:
+                if not task.cancelled:
+                    task.deadline += task.interval
+                    now = time.monotonic()
+                    if task.deadline <= now:
+                        # Missed one or more deadlines, skip to the next one in the future.
+                        missed = (now - task.deadline) // task.interval + 1
+                        task.deadline += missed * task.interval
+                        task_missed.inc(int(missed), task=task.name)
+                    self._push(task)
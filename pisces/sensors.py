@@ -1,22 +1,159 @@
 import math
-from collections import OrderedDict
-
-import board
-import busio
-import adafruit_ads1x15.ads1115 as ADS
-from adafruit_ads1x15.analog_in import AnalogIn
+import time
+import statistics
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from threading import Thread, Condition, Lock, RLock
 
 from pisces.base import PiscesBase
+from pisces.metrics import histogram, counter
+from pisces.simulation import is_simulated, SimulatedW1Bus, SimulatedAnalogIn
+from pisces.status import status_fields
+
+sensor_read_duration = histogram('pisces_sensor_read_seconds',
+                                 "Time taken to read a sensor.",
+                                 labels=('sensor',))
+sensor_errors = counter('pisces_sensor_errors_total',
+                        "Failed sensor reads, including failed CRC checks.",
+                        labels=('sensor',))
+
+# Most 1-wire sensors read at once, by all the tanks together.
+max_w1_reads = 8
+
+
+class SensorBus():
+    """Sensor hardware shared by all the tanks in the process.
+
+    There is one I2C bus, ADCs on it are shared by address, 1-wire sensors
+    are read by one pool of threads and the water level sensors are all
+    sampled by one thread, rather than each tank having its own.
+
+    Reading an ADC channel is several I2C transactions, so anything that
+    reads an ADC that might be shared should hold lock while doing it.
+    """
+    def __init__(self):
+        self.lock = RLock()
+        self._i2c = None
+        self._adcs = {}
+        self._executor = None
+        # Sampling functions, mapped to [next sample time, sample interval].
+        self._samplers = {}
+        self._samplers_changed = Condition()
+        self._sampler = None
+
+    @property
+    def i2c(self):
+        """The I2C bus, created when first used."""
+        with self.lock:
+            if self._i2c is None:
+                import board
+                import busio
+                self._i2c = busio.I2C(board.SCL, board.SDA)
+            return self._i2c
+
+    @property
+    def executor(self):
+        """Thread pool for reading 1-wire sensors, which block for about 750 ms each."""
+        with self.lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=max_w1_reads, thread_name_prefix='pisces_w1')
+            return self._executor
+
+    def get_adc(self, address=0x48):
+        """Returns the ADS1115 ADC at an I2C address, in continuous conversion mode."""
+        with self.lock:
+            adc = self._adcs.get(address)
+            if adc is None:
+                import adafruit_ads1x15.ads1115 as ADS
+                from adafruit_ads1x15.ads1x15 import Mode
+                adc = ADS.ADS1115(self.i2c, address=address)
+                # Convert continuously, reads then just fetch the latest conversion.
+                adc.mode = Mode.CONTINUOUS
+                self._adcs[address] = adc
+            return adc
+
+    def add_sampler(self, sample, interval):
+        """Calls sample() every interval seconds from the sampling thread, the first time after one interval."""
+        with self._samplers_changed:
+            self._samplers[sample] = [time.monotonic() + interval, interval]
+            if self._sampler is None:
+                self._sampler = Thread(target=self._sample_loop, name='pisces_sampling', daemon=True)
+                self._sampler.start()
+            self._samplers_changed.notify()
+
+    def remove_sampler(self, sample):
+        """Stops calling sample(). The sampling thread finishes when there's nothing left to sample."""
+        with self._samplers_changed:
+            self._samplers.pop(sample, None)
+            self._samplers_changed.notify()
+
+    def _sample_loop(self):
+        while True:
+            with self._samplers_changed:
+                if not self._samplers:
+                    self._sampler = None
+                    return
+                now = time.monotonic()
+                due = [sample for sample, (next_sample, _) in self._samplers.items() if next_sample <= now]
+                if not due:
+                    self._samplers_changed.wait(min(next_sample for next_sample, _ in self._samplers.values()) -
+                                                now)
+                    continue
+                for sample in due:
+                    timing = self._samplers[sample]
+                    timing[0] += timing[1]
+                    if timing[0] <= now:
+                        # Fallen behind, skip the missed samples.
+                        timing[0] = now + timing[1]
+            # Sample without the condition held, so samplers can be added and removed meanwhile.
+            for sample in due:
+                sample()
+
+
+@lru_cache(maxsize=None)
+def get_sensor_bus():
+    """Returns the SensorBus shared by everything in the process."""
+    return SensorBus()
 
 
 class SensorsBase(PiscesBase):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
+    def _sensor_label(self, name):
+        # Metrics label of a sensor, which includes the tank name if there is one.
+        return name if self.tank is None else '{}.{}'.format(self.tank, name)
+
 
 class TemperatureSensors(SensorsBase):
+    """DS18B20 1-wire temperature sensors, read through sysfs.
+
+    Each read of a sensor's w1_slave file triggers a conversion that takes
+    about 750 ms, so all the sensors are read at the same time from the pool
+    of threads shared by all the tanks, see SensorBus. Readings are cached
+    and reused until they are older than 'max_reading_age' seconds.
+
+    Sensors are named after the status fields they give the value of, e.g.
+    'water_temp'. Any with other names are ignored, with a warning.
+    """
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
+        devices = self.config['temperature_control']['temperature_sensors']
+        float_fields = [name for name, field_type, _ in status_fields if field_type is float]
+        unknown = [name for name in devices if name not in float_fields]
+        if unknown:
+            msg = "Ignoring temperature sensors that aren't status fields: {}".format(', '.join(unknown))
+            self.logger.warning(msg)
+        self._devices = OrderedDict((name, device) for name, device in devices.items() if name in float_fields)
+        if is_simulated(self.config):
+            self._simulator = SimulatedW1Bus(self.config, self._devices.keys())
+            self._devices = self._simulator.devices
+        else:
+            self._simulator = None
+        self._max_age = float(self.config['temperature_control'].get('max_reading_age', 0))  # Seconds
+        self._cache = {}
+        self._executor = get_sensor_bus().executor
         self.logger.debug("Temperature sensors initialised.")
 
     @property
@@ -24,46 +161,120 @@ class TemperatureSensors(SensorsBase):
         return self._get_temperatures()
 
     def _get_temperatures(self):
+        now = time.monotonic()
+        stale = [name for name in self._devices
+                 if name not in self._cache or now - self._cache[name][0] > self._max_age]
+        if stale:
+            if self._simulator:
+                self._simulator.update()
+            futures = OrderedDict((name, self._executor.submit(self._read_sensor, name, self._devices[name]))
+                                  for name in stale)
+            for name, future in futures.items():
+                temperature = future.result()
+                if math.isnan(temperature):
+                    # Don't cache failed reads, try again next time.
+                    self._cache.pop(name, None)
+                else:
+                    self._cache[name] = (now, temperature)
+
         temperatures = OrderedDict()
-        for name, device in self.config['temperature_control']['temperature_sensors'].items():
-            try:
-                with open(device) as sensor_device:
-                    raw_data = sensor_device.read()
-            except OSError as err:
-                msg = "Error opening '{}' sensor {}: {}".format(name, device, err)
-                self.logger.error(msg)
-                temperatures[name] = math.nan
-            except Exception as error:
-                msg = "Error reading '{}' sensor {}: {}".format(name, device, err)
-                self.logger.error(msg)
-                temperatures[name] = math.nan
+        for name in self._devices:
+            if name in self._cache:
+                temperatures[name] = self._cache[name][1]
             else:
-                _, _, string_temp = raw_data.rpartition('=')
-                temperatures[name] = float(string_temp) / 1000
+                temperatures[name] = math.nan
 
         return temperatures
 
+    def _read_sensor(self, name, device):
+        with sensor_read_duration.time(sensor=self._sensor_label(name)):
+            temperature = self._read_device(name, device)
+        if math.isnan(temperature):
+            sensor_errors.inc(sensor=self._sensor_label(name))
+        return temperature
+
+    def _read_device(self, name, device):
+        try:
+            with open(device) as sensor_device:
+                raw_data = sensor_device.read()
+        except OSError as err:
+            msg = "Error opening '{}' sensor {}: {}".format(name, device, err)
+            self.logger.error(msg)
+            return math.nan
+        except Exception as err:
+            msg = "Error reading '{}' sensor {}: {}".format(name, device, err)
+            self.logger.error(msg)
+            return math.nan
+
+        # First line ends with the result of the CRC check, second line with the temperature.
+        lines = raw_data.splitlines()
+        if len(lines) < 2 or not lines[0].strip().endswith('YES'):
+            msg = "CRC check failed for '{}' sensor {}".format(name, device)
+            self.logger.warning(msg)
+            return math.nan
+
+        _, _, string_temp = lines[1].rpartition('t=')
+        try:
+            return float(string_temp) / 1000
+        except ValueError:
+            msg = "Invalid data from '{}' sensor {}: {}".format(name, device, lines[1])
+            self.logger.error(msg)
+            return math.nan
+
 
 class WaterLevelSensor(SensorsBase):
+    """Water level sensor read through an ADS1115 ADC.
+
+    The ADC runs in continuous conversion mode and the sampling thread shared
+    by all the tanks samples it every 'sample_interval' seconds into a
+    fixed length deque of (time, voltage) pairs. Water level readings are the
+    mean of the samples from the last 'window' seconds, after rejecting any
+    more than 'outlier_threshold' robust standard deviations from the median,
+    worked out with the statistics module. Reading them doesn't block on the
+    I2C bus.
+
+    Each ADS1115 has two differential inputs, so tanks can share one by using
+    different 'channels', or use ADCs at different I2C 'address'es.
+    """
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self._gain = int(self.config['water_control']['water_level_sensor']['gain'])
-        
+        sensor_config = self.config['water_control']['water_level_sensor']
+        self._gain = int(sensor_config['gain'])
+        self._sample_interval = float(sensor_config.get('sample_interval', 0.5))  # Seconds
+        self._window = float(sensor_config.get('window', 10))  # Seconds
+        self._outlier_threshold = float(sensor_config.get('outlier_threshold', 3))  # Robust standard deviations
+        if self._sample_interval <= 0 or self._window < self._sample_interval:
+            msg = "Water level sensor 'window' must be >= 'sample_interval' > 0."
+            self.logger.critical(msg)
+            raise ValueError(msg)
+
+        # Only a few tens of samples, not worth importing NumPy for.
+        self._samples = deque(maxlen=2 * math.ceil(self._window / self._sample_interval))
+        self._samples_lock = Lock()
+        self._bus = get_sensor_bus()
+        self._sampling = False
+
         try:
-            # Create the I2C interface.
-            i2c = busio.I2C(board.SCL, board.SDA)
-            # Create the interface to the ADC.
-            self._adc = ADS.ADS1115(i2c)
-            # Create different analogue input channel.
-            self._channel = AnalogIn(self._adc, ADS.P0, ADS.P1)
-            # Set analogue gain
-            self._adc.gain = self._gain
+            if is_simulated(self.config):
+                self._adc = None
+                self._channel = SimulatedAnalogIn(self.config)
+            else:
+                from adafruit_ads1x15.analog_in import AnalogIn
+                # ADC is shared with any other tanks at the same address.
+                self._adc = self._bus.get_adc(int(sensor_config.get('address', 0x48)))
+                # Differential input, by default between P0 and P1.
+                positive, negative = sensor_config.get('channels', (0, 1))
+                self._channel = AnalogIn(self._adc, int(positive), int(negative))
         except Exception as err:
             self._initialised = False
             self.logger.error("Error initialising water level sensor: {}".format(err))
         else:
             self._initialised = True
             self.logger.debug("Water level sensors initialised.")
+            self.start_sampling()
+
+    def __del__(self):
+        self.stop_sampling()
 
     @property
     def value(self):
@@ -75,13 +286,49 @@ class WaterLevelSensor(SensorsBase):
 
     @property
     def water_level(self):
-        # Placeholder to check stability
-        discards = 10
-        readings = 20
-        for i in range(discards):
-            _ = self.voltage
-        voltage = 0
-        for i in range(readings):
-            voltage += self.voltage
-        voltage /= readings
-        return voltage * 100.0
+        """Robust average of the water level over the last 'window' seconds, NaN if no recent samples."""
+        with self._samples_lock:
+            samples = list(self._samples)
+        window_start = time.monotonic() - self._window
+        voltages = [voltage for sample_time, voltage in samples
+                    if sample_time >= window_start and math.isfinite(voltage)]
+        if not voltages:
+            return math.nan
+
+        # Reject outliers using the median absolute deviation, then take the mean of what's left.
+        median = statistics.median(voltages)
+        deviations = [abs(voltage - median) for voltage in voltages]
+        mad = statistics.median(deviations)
+        if mad > 0:
+            limit = self._outlier_threshold * 1.4826 * mad
+            voltages = [voltage for voltage, deviation in zip(voltages, deviations) if deviation <= limit]
+        return statistics.fmean(voltages) * 100.0
+
+    def start_sampling(self):
+        if self._sampling:
+            self.logger.warning("Water level sampling already running.")
+            return
+        # Take the first sample now so there's a reading available straight away.
+        self._sample()
+        self._bus.add_sampler(self._sample, self._sample_interval)
+        self._sampling = True
+
+    def stop_sampling(self):
+        if self._sampling:
+            self._bus.remove_sampler(self._sample)
+            self._sampling = False
+
+    def _sample(self):
+        label = self._sensor_label('water_level')
+        try:
+            with self._bus.lock, sensor_read_duration.time(sensor=label):
+                if self._adc is not None:
+                    # Gain is a setting of the whole ADC, which another tank may be using with a different one.
+                    self._adc.gain = self._gain
+                voltage = self.voltage
+        except Exception as err:
+            sensor_errors.inc(sensor=label)
+            self.logger.error("Error reading water level sensor: {}".format(err))
+        else:
+            with self._samples_lock:
+                self._samples.append((time.monotonic(), voltage))
@@ -0,0 +1,150 @@
+"""Live Pisces status in a shared memory segment.
+
+The Pisces core publishes its status into a fixed layout shared memory
+segment every time it changes, and other processes such as the webapp read
+it from there without touching the disk. Control updates that don't change
+anything still update the time of the status, so its age shows how long
+since the controls last ran. The layout is a single structured record with
+the same fields as the data log, preceded by a sequence counter.
+
+The sequence counter is odd while an update is being written and is
+incremented again once it is complete. Readers retry until they see the
+same, even sequence number before and after taking their copy, so they never
+see a half written status.
+"""
+import time
+from datetime import datetime
+from functools import lru_cache
+from threading import Lock
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+
+from pisces.utils import get_log_dtype, log_names
+
+
+# Names of the segments published by this process.
+_published_names = set()
+
+
+@lru_cache(maxsize=None)
+def get_status_dtype():
+    """Returns the NumPy structured dtype of the shared memory status record."""
+    return np.dtype([('sequence', '<u8')] + get_log_dtype().descr)
+
+
+class StatusPublisher():
+    """Publishes the Pisces status to a named shared memory segment.
+
+    Args:
+        name (str): name of the shared memory segment.
+    """
+    def __init__(self, name):
+        status_dtype = get_status_dtype()
+        try:
+            self._shared_memory = shared_memory.SharedMemory(name=name, create=True,
+                                                             size=status_dtype.itemsize)
+        except FileExistsError:
+            # Left over from a previous run that didn't exit cleanly, replace it.
+            old_memory = shared_memory.SharedMemory(name=name)
+            old_memory.close()
+            old_memory.unlink()
+            self._shared_memory = shared_memory.SharedMemory(name=name, create=True,
+                                                             size=status_dtype.itemsize)
+        self._name = name
+        _published_names.add(name)
+        self._status = np.ndarray((), dtype=status_dtype, buffer=self._shared_memory.buf)
+        self._status['sequence'] = 0
+        self._lock = Lock()
+
+    @property
+    def name(self):
+        return self._name
+
+    def publish(self, status):
+        """Writes a new status.
+
+        Args:
+            status (dict): status values, keyed by data log field name.
+        """
+        with self._lock:
+            sequence = int(self._status['sequence'])
+            self._status['sequence'] = sequence + 1
+            self._status['log_time'] = np.datetime64(datetime.now(), 's')
+            for name in log_names[1:]:
+                self._status[name] = status[name]
+            self._status['sequence'] = sequence + 2
+
+    def touch(self):
+        """Updates the time of the status, without changing its values, to show it's still current."""
+        with self._lock:
+            sequence = int(self._status['sequence'])
+            if sequence == 0:
+                # Nothing published yet.
+                return
+            self._status['sequence'] = sequence + 1
+            self._status['log_time'] = np.datetime64(datetime.now(), 's')
+            self._status['sequence'] = sequence + 2
+
+    def close(self):
+        """Removes the shared memory segment."""
+        with self._lock:
+            if self._shared_memory is None:
+                return
+            # Must release the view into the shared memory before closing it.
+            del self._status
+            self._shared_memory.close()
+            self._shared_memory.unlink()
+            self._shared_memory = None
+            _published_names.discard(self._name)
+
+
+class StatusReader():
+    """Reads the Pisces status from a named shared memory segment.
+
+    Args:
+        name (str): name of the shared memory segment.
+
+    Raises:
+        FileNotFoundError: the shared memory segment does not exist.
+    """
+    def __init__(self, name):
+        self._shared_memory = shared_memory.SharedMemory(name=name)
+        # The publisher owns the segment, don't let the resource tracker remove
+        # it when this process exits. Unless this process is the publisher.
+        if name not in _published_names:
+            resource_tracker.unregister(self._shared_memory._name, 'shared_memory')
+        self._status = np.ndarray((), dtype=get_status_dtype(), buffer=self._shared_memory.buf)
+
+    @property
+    def sequence(self):
+        """Sequence number of the latest status, changes every time it is published."""
+        return int(self._status['sequence'])
+
+    def read(self, max_attempts=100):
+        """Returns a consistent copy of the latest status.
+
+        Returns:
+            numpy.void: status record with the data log fields, or None if no
+                status has been published yet.
+
+        Raises:
+            TimeoutError: could not get a consistent status after
+                max_attempts tries.
+        """
+        for _ in range(max_attempts):
+            sequence = int(self._status['sequence'])
+            if sequence == 0:
+                return None
+            if sequence % 2 == 0:
+                status = self._status.copy()
+                if int(self._status['sequence']) == sequence:
+                    return status[()]
+            # Publisher is part way through an update, give it a chance to finish.
+            time.sleep(0)
+        msg = "Could not get a consistent status from shared memory"
+        raise TimeoutError(msg)
+
+    def close(self):
+        del self._status
+        self._shared_memory.close()
@@ -0,0 +1,244 @@
+"""Simulated hardware, so Pisces can run on any Linux computer.
+
+With `hardware: simulated` in the config none of the Raspberry Pi specific
+hardware is used:
+
+    GPIO pins           gpiozero's mock pin factory.
+    1-wire sensors      w1_slave files written to a directory, in the same
+                        format as the kernel driver, and read by the normal
+                        TemperatureSensors code.
+    ADC                 SimulatedAnalogIn, with the interface of the
+                        adafruit_ads1x15 AnalogIn the water level sensor uses.
+    OLED display        SimulatedSSD1306, a framebuffer with the interface
+                        of adafruit_ssd1306.SSD1306_I2C that follows the
+                        column and page addressing commands.
+
+The simulated temperatures vary over the day around the configured values,
+with a little noise added to them and to the water level.
+"""
+import os
+import math
+import random
+import time
+from threading import Lock
+
+# Defaults for the config 'simulation' section.
+default_simulation = {'w1_dir': '/tmp/pisces_w1',
+                      'water_temp': 25.5,  # deg C
+                      'air_temp': 24.5,  # deg C
+                      'temp_amplitude': 1.0,  # deg C, amplitude of the daily variation
+                      'water_level': 10.0,  # cm
+                      'noise': 0.01}  # Standard deviation of noise on readings, deg C or cm
+
+_pin_factory_lock = Lock()
+
+
+def is_simulated(config):
+    """Returns True if the config asks for simulated hardware."""
+    return config.get('hardware', 'pi') == 'simulated'
+
+
+def get_simulation_config(config):
+    """Returns the config 'simulation' section, with defaults for anything missing."""
+    simulation = dict(default_simulation)
+    simulation.update(config.get('simulation') or {})
+    return simulation
+
+
+def use_mock_pins():
+    """Makes gpiozero use mock pins, unless it already is."""
+    from gpiozero import Device
+    from gpiozero.pins.mock import MockFactory
+
+    with _pin_factory_lock:
+        if not isinstance(Device.pin_factory, MockFactory):
+            Device.pin_factory = MockFactory()
+
+
+def _daily_variation():
+    # Warmest mid afternoon, coolest before dawn.
+    hours = (time.time() - time.timezone) % 86400 / 3600
+    return math.sin(2 * math.pi * (hours - 9) / 24)
+
+
+class SimulatedW1Bus():
+    """Writes fake 1-wire temperature sensor files.
+
+    Args:
+        config (dict): Pisces config.
+        names (sequence of str): names of the temperature sensors, e.g.
+            'water_temp'. Each gets a file called <w1_dir>/<name>/w1_slave.
+    """
+    def __init__(self, config, names):
+        simulation = get_simulation_config(config)
+        self._w1_dir = simulation['w1_dir']
+        self._amplitude = float(simulation['temp_amplitude'])
+        self._noise = float(simulation['noise'])
+        self._temperatures = {name: float(simulation.get(name, simulation['water_temp'])) for name in names}
+        self._devices = {name: os.path.join(self._w1_dir, name, 'w1_slave') for name in names}
+        for device in self._devices.values():
+            os.makedirs(os.path.dirname(device), exist_ok=True)
+        self.update()
+
+    @property
+    def devices(self):
+        """Paths of the fake w1_slave files, keyed by sensor name."""
+        return dict(self._devices)
+
+    def update(self):
+        """Writes new readings to all the sensor files."""
+        variation = self._amplitude * _daily_variation()
+        for name, device in self._devices.items():
+            temperature = self._temperatures[name] + variation + random.gauss(0, self._noise)
+            self.write(device, temperature)
+
+    @staticmethod
+    def write(device, temperature, crc_ok=True):
+        """Writes a temperature reading in the format of the DS18B20 w1_slave file."""
+        millidegrees = int(round(temperature * 1000))
+        raw = (millidegrees * 16 // 1000) & 0xffff
+        data = "{:02x} {:02x} 4b 46 7f ff 0c 10 1c".format(raw & 0xff, raw >> 8)
+        # Write then rename, so readers never see a partly written file.
+        temporary = device + '.tmp'
+        with open(temporary, 'w') as sensor_file:
+            sensor_file.write("{} : crc=1c {}\n{} t={}\n".format(data, 'YES' if crc_ok else 'NO',
+                                                                 data, millidegrees))
+        os.replace(temporary, device)
+
+
+class SimulatedAnalogIn():
+    """Simulated ADS1115 differential input connected to the water level sensor.
+
+    Args:
+        config (dict): Pisces config.
+    """
+    def __init__(self, config):
+        simulation = get_simulation_config(config)
+        self.water_level = float(simulation['water_level'])  # cm, can be changed to simulate a leak.
+        self._noise = float(simulation['noise'])
+        self._gain = int(config['water_control']['water_level_sensor']['gain'])
+
+    @property
+    def voltage(self):
+        # Water level sensor gives 10 mV per cm.
+        return (self.water_level + random.gauss(0, self._noise)) / 100.0
+
+    @property
+    def value(self):
+        # ADS1115 full scale is +/- 4.096 V / gain, as a signed 16 bit value.
+        return int(self.voltage / (4.096 / self._gain) * 32767)
+
+
+class _SimulatedI2CDevice():
+    """Context manager with the write() method of adafruit_bus_device.I2CDevice."""
+    def __init__(self, display):
+        self._display = display
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def write(self, data):
+        self._display._write_data(data)
+
+
+class SimulatedSSD1306():
+    """Simulated SSD1306 OLED display, with the interface of adafruit_ssd1306.SSD1306_I2C.
+
+    Like the real display it keeps its own copy of the pixels, which is only
+    changed by data written to it. The buffer is arranged the same way, as a
+    control byte followed by pages of 8 pixel high columns, and writes go to
+    the column and page window set by the SET_COL_ADDR and SET_PAGE_ADDR
+    commands.
+
+    Args:
+        width (int): display width in pixels.
+        height (int): display height in pixels, a multiple of 8.
+        i2c: ignored.
+    """
+    set_col_addr = 0x21
+    set_page_addr = 0x22
+
+    def __init__(self, width, height, i2c=None):
+        self.width = width
+        self.height = height
+        self.pages = height // 8
+        self.buffer = bytearray(1 + width * self.pages)
+        self.buffer[0] = 0x40  # Control byte, data follows.
+        self.i2c_device = _SimulatedI2CDevice(self)
+        self.n_writes = 0
+        self.n_bytes = 0
+        # Narrow displays use the centre columns of the controller's 128.
+        self._column_offset = 0 if width == 128 else (128 - width) // 2
+        self._ram = bytearray(width * self.pages)
+        self._command = []
+        self._window = (0, width - 1, 0, self.pages - 1)
+
+    def fill(self, colour):
+        self.buffer[1:] = bytes([0xff if colour else 0x00]) * (len(self.buffer) - 1)
+
+    def image(self, image):
+        """Copies a 1 bit PIL image into the buffer, without showing it."""
+        if image.mode != '1' or image.size != (self.width, self.height):
+            msg = "Image must be mode '1' and {}x{}".format(self.width, self.height)
+            raise ValueError(msg)
+        pixels = image.load()
+        for page in range(self.pages):
+            for x in range(self.width):
+                bits = 0
+                for bit in range(8):
+                    if pixels[x, page * 8 + bit]:
+                        bits |= 1 << bit
+                self.buffer[1 + page * self.width + x] = bits
+
+    def show(self):
+        """Sends the whole buffer to the display."""
+        self.write_cmd(self.set_col_addr)
+        self.write_cmd(self._column_offset)
+        self.write_cmd(self._column_offset + self.width - 1)
+        self.write_cmd(self.set_page_addr)
+        self.write_cmd(0)
+        self.write_cmd(self.pages - 1)
+        with self.i2c_device:
+            self.i2c_device.write(self.buffer)
+
+    def write_cmd(self, cmd):
+        self._command.append(cmd)
+        if self._command[0] in (self.set_col_addr, self.set_page_addr):
+            if len(self._command) < 3:
+                return
+            if self._command[0] == self.set_col_addr:
+                self._window = (self._command[1] - self._column_offset,
+                                self._command[2] - self._column_offset) + self._window[2:]
+            else:
+                self._window = self._window[:2] + (self._command[1], self._command[2])
+        self._command = []
+
+    def to_image(self):
+        """Returns what the display is showing, as a 1 bit PIL image."""
+        from PIL import Image
+
+        image = Image.new('1', (self.width, self.height))
+        pixels = image.load()
+        for page in range(self.pages):
+            for x in range(self.width):
+                bits = self._ram[page * self.width + x]
+                for bit in range(8):
+                    pixels[x, page * 8 + bit] = 255 if bits & (1 << bit) else 0
+        return image
+
+    def _write_data(self, data):
+        # First byte is the control byte, the rest fill the window column by column, page by page.
+        self.n_writes += 1
+        self.n_bytes += len(data)
+        first_column, last_column, first_page, last_page = self._window
+        column, page = first_column, first_page
+        for byte in data[1:]:
+            if 0 <= column < self.width and 0 <= page < self.pages:
+                self._ram[page * self.width + column] = byte
+            column += 1
+            if column > last_column:
+                column = first_column
+                page = first_page if page >= last_page else page + 1
@@ -0,0 +1,203 @@
+"""Thread safe, versioned store of the Pisces status.
+
+The controls update the status from the scheduler thread and from gpiozero
+button callback threads, and the display, data logger and status publisher
+all read it. A StatusStore keeps the status as an immutable StatusSnapshot.
+An update that changes any values replaces the snapshot with a new one with
+the next version number, so readers can take the current snapshot without a
+lock and always see a consistent set of values.
+
+Updates that don't change any values do nothing at all. Subscribers are
+called after each update that does change something, with the new snapshot
+and the names of the fields that changed, and only if one of the fields they
+are interested in is among them. They are called with the store's lock
+held, so that they see the versions in order, which means they must not
+block, see StatusStore.subscribe().
+
+Example:
+    store = StatusStore()
+    store.subscribe(lambda snapshot, changed: print(changed), fields=('water_temp',))
+    store.update({'water_temp': 25.2, 'fan_enabled': False})  # Prints {'water_temp'}
+    store.snapshot['water_temp']  # 25.2
+"""
+import math
+from threading import RLock
+
+from pisces.metrics import counter
+
+# Status fields, with their types and initial values, in data log order.
+status_fields = (('water_temp', float, 99.9),
+                 ('water_temp_status', str, 'OK'),
+                 ('air_temp', float, 99.9),
+                 ('water_level', float, 99.9),
+                 ('water_level_status', str, 'OK'),
+                 ('overflow', bool, False),
+                 ('lights_auto', bool, True),
+                 ('lights_enabled', bool, False),
+                 ('fan_auto', bool, True),
+                 ('fan_enabled', bool, False),
+                 ('pump_auto', bool, True),
+                 ('pump_enabled', bool, False))
+status_names = tuple(name for name, _, _ in status_fields)
+_status_types = {name: field_type for name, field_type, _ in status_fields}
+
+status_updates = counter('pisces_status_updates_total',
+                         "Status updates, by whether they changed any values.",
+                         labels=('result',))
+
+
+def _same(old_value, new_value):
+    # NaN readings aren't equal to themselves, but aren't a change either.
+    if isinstance(new_value, float) and math.isnan(new_value):
+        return math.isnan(old_value)
+    return old_value == new_value
+
+
+class StatusSnapshot():
+    """Copy of all the status values at one version. Can't be changed.
+
+    Fields are available as attributes or, like a read only dict, by name.
+    Iterating over a snapshot gives the field names in data log order.
+
+    Args:
+        version (int): version number of the status.
+        values (dict): value for every field, keyed by name.
+    """
+    __slots__ = ('version',) + status_names
+
+    def __init__(self, version, values):
+        object.__setattr__(self, 'version', version)
+        for name in status_names:
+            object.__setattr__(self, name, values[name])
+
+    def __setattr__(self, name, value):
+        raise AttributeError("StatusSnapshot is read only")
+
+    def __getitem__(self, name):
+        if name not in _status_types:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def __iter__(self):
+        return iter(status_names)
+
+    def __len__(self):
+        return len(status_names)
+
+    def __repr__(self):
+        return "StatusSnapshot(version={}, {})".format(self.version, self.as_dict())
+
+    def keys(self):
+        return status_names
+
+    def values(self):
+        return tuple(getattr(self, name) for name in status_names)
+
+    def items(self):
+        return tuple((name, getattr(self, name)) for name in status_names)
+
+    def as_dict(self):
+        """Returns the values as a new dict."""
+        return dict(self.items())
+
+
+class StatusStore():
+    """Versioned status with change notification, safe to use from any thread.
+
+    Args:
+        initial (dict, optional): initial values, replacing the defaults in
+            status_fields.
+    """
+    def __init__(self, initial=None):
+        values = {name: default for name, _, default in status_fields}
+        values.update(self._convert(initial or {}))
+        # Re-entrant so a subscriber can update the status without deadlocking.
+        self._lock = RLock()
+        self._snapshot = StatusSnapshot(0, values)
+        self._subscribers = []
+
+    @property
+    def snapshot(self):
+        """The current status, as a StatusSnapshot."""
+        # Snapshots are replaced, never changed, so no lock is needed.
+        return self._snapshot
+
+    @property
+    def version(self):
+        """Version number of the current status, increases by one with each change."""
+        return self._snapshot.version
+
+    def update(self, update):
+        """Updates status values, notifying subscribers of any that changed.
+
+        Args:
+            update (dict): new values, keyed by field name. Values are
+                converted to the type of the field.
+
+        Returns:
+            set: names of the fields that changed, empty if none did.
+
+        Raises:
+            KeyError: unknown field name.
+            ValueError: value can't be converted to the type of its field.
+        """
+        update = self._convert(update)
+        # Held while notifying too, so subscribers see the versions in order.
+        with self._lock:
+            snapshot = self._snapshot
+            changed = {name for name, value in update.items() if not _same(snapshot[name], value)}
+            if not changed:
+                status_updates.inc(result='unchanged')
+                return changed
+            values = snapshot.as_dict()
+            values.update((name, update[name]) for name in changed)
+            snapshot = self._snapshot = StatusSnapshot(snapshot.version + 1, values)
+            status_updates.inc(result='changed')
+            for callback, fields in self._subscribers:
+                if fields is None:
+                    callback(snapshot, changed)
+                elif changed & fields:
+                    callback(snapshot, changed & fields)
+        return changed
+
+    def subscribe(self, callback, fields=None):
+        """Calls callback(snapshot, changed) after every update that changes one of fields.
+
+        Callbacks are called in the thread making the update with the store's
+        lock held, and every other update waits for them, so they must not
+        block, e.g. on I/O or on another thread that updates the status. Set
+        an Event or queue some work instead. They can update the status
+        themselves, the lock is re-entrant.
+
+        Args:
+            callback (callable): called with the new StatusSnapshot and the set
+                of names of the changed fields it is interested in.
+            fields (sequence of str, optional): field names to watch, default all.
+
+        Raises:
+            KeyError: unknown field name.
+        """
+        if fields is not None:
+            fields = frozenset(fields)
+            unknown = fields.difference(status_names)
+            if unknown:
+                raise KeyError("Unknown status fields: {}".format(', '.join(sorted(unknown))))
+        with self._lock:
+            # Replaced rather than appended to, in case an update is iterating over it.
+            self._subscribers = self._subscribers + [(callback, fields)]
+
+    def unsubscribe(self, callback):
+        """Stops calling callback, if it was subscribed."""
+        with self._lock:
+            self._subscribers = [(subscriber, fields) for subscriber, fields in self._subscribers
+                                 if subscriber != callback]
+
+    @staticmethod
+    def _convert(update):
+        converted = {}
+        # Copy first, the dict may belong to a control that's changing it in another thread.
+        for name, value in dict(update).items():
+            if name not in _status_types:
+                raise KeyError("Unknown status field '{}'".format(name))
+            converted[name] = _status_types[name](value)
+        return converted
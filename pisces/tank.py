@@ -0,0 +1,110 @@
+"""One aquarium tank, with its own controls, data logger and status.
+
+A Pisces core runs a Tank for each tank in the config 'tanks' section, or
+just one if there isn't a 'tanks' section. Each tank has its own config,
+from pisces.utils.get_tank_config, its own status and its own log files,
+but all of them share the core's scheduler and plot worker, and the sensor
+bus, see pisces.sensors.SensorBus.
+"""
+from pisces.base import PiscesBase
+from pisces.lights import LightsControl
+from pisces.temperature import TemperatureControl
+from pisces.water import WaterControl
+from pisces.datalogger import DataLogger
+from pisces.status import StatusStore
+
+
+class Tank(PiscesBase):
+    """Controls, data logger and status of one tank.
+
+    Args:
+        pisces_core (Pisces): the core, which provides the scheduler and plot worker.
+        tank (str): name of the tank, None if the config doesn't have a 'tanks' section.
+    """
+    def __init__(self, pisces_core, **kwargs):
+        super().__init__(**kwargs)  # Load this tank's config.
+        self._core = pisces_core
+
+        # Thread safe, versioned status, updated by the subcomponents.
+        self._status = StatusStore()
+
+        # Optional publisher of the live status to shared memory for the web app.
+        self._status_publisher = None
+
+        self._lights_control = LightsControl(self, **kwargs)
+        self._temperature_control = TemperatureControl(self, **kwargs)
+        self._water_control = WaterControl(self, **kwargs)
+        self._datalogger = DataLogger(self, **kwargs)
+
+    def close(self):
+        if self._status_publisher:
+            self._status_publisher.close()
+            self._status_publisher = None
+
+    @property
+    def name(self):
+        return self.tank
+
+    @property
+    def status(self):
+        """Current status, as a read only StatusSnapshot."""
+        return self._status.snapshot
+
+    @property
+    def status_store(self):
+        """StatusStore of the status, for subscribing to changes."""
+        return self._status
+
+    @property
+    def scheduler(self):
+        return self._core.scheduler
+
+    @property
+    def plot_worker(self):
+        return self._core.plot_worker
+
+    def update_status(self, update):
+        """Updates the status. Subscribers, e.g. the display, are only notified of values that changed."""
+        changed = self._status.update(update)
+        status_publisher = self._status_publisher
+        if not changed and status_publisher is not None:
+            # Subscribers only hear about changes, but readers of the shared status use
+            # its time to tell that the controls are still updating it.
+            status_publisher.touch()
+
+    def lights_auto(self):
+        self._lights_control.auto_on()
+
+    def lights_manual(self):
+        self._lights_control.auto_off()
+
+    def fan_auto(self):
+        self._temperature_control.auto_on()
+
+    def fan_manual(self):
+        self._temperature_control.auto_off()
+
+    def pump_auto(self):
+        self._water_control.auto_on()
+
+    def pump_manual(self):
+        self._water_control.auto_off()
+
+    def start_status_publisher(self):
+        shared_status = self.config['webapp'].get('shared_status')
+        if shared_status and self._status_publisher is None:
+            # Imports NumPy, so done after the controls are running rather than at import time.
+            from pisces.sharedstatus import StatusPublisher
+            self._status_publisher = StatusPublisher(shared_status)
+            self._status_publisher.publish(self.status)
+            self._status.subscribe(self._publish_status)
+            self.logger.info("Publishing status to shared memory '{}'.".format(shared_status))
+
+    def _publish_status(self, snapshot, changed):
+        self._status_publisher.publish(snapshot)
+
+    def start_logging(self):
+        self._datalogger.start_monitoring()
+
+    def stop_logging(self):
+        self._datalogger.stop_monitoring()
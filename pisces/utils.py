@@ -1,39 +1,269 @@
 import os
 import os.path
+import copy
 from glob import glob
 import subprocess
 import signal
 from warnings import warn
 from datetime import datetime
+from itertools import chain
+from functools import lru_cache
+from threading import Lock
 
 import yaml
-import numpy as np
-from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
-from matplotlib.figure import Figure
 
+# NumPy and matplotlib are slow to import, especially on a Pi Zero, so they are
+# imported by the functions that need them. This keeps them off the start up
+# path for everything that only needs the config.
 
-def load_config(config_path, path_root=None):
+
+# Fields of the data log, in the order they are written by the DataLogger.
+log_names = ('log_time',
+             'water_temp',
+             'water_temp_status',
+             'air_temp',
+             'water_level',
+             'water_level_status',
+             'overflow',
+             'lights_auto',
+             'lights_enabled',
+             'fan_auto',
+             'fan_enabled',
+             'pump_auto',
+             'pump_enabled')
+# Log times are local times, to the nearest second.
+log_dtypes = ('datetime64[s]',
+              float,
+              'U4',
+              float,
+              float,
+              'U4',
+              bool,
+              bool,
+              bool,
+              bool,
+              bool,
+              bool,
+              bool)
+
+
+@lru_cache(maxsize=None)
+def get_log_dtype():
+    """Returns the NumPy structured dtype of data log records."""
+    import numpy as np
+    return np.dtype(list(zip(log_names, log_dtypes)))
+
+
+# Parsed configs, keyed by resolved path. Values are (modification time, config).
+_config_cache = {}
+_config_lock = Lock()
+
+
+def resolve_config_path(config_path, path_root=None):
+    """Returns the absolute, symlink free path of a config file."""
     if not os.path.isabs(config_path) and path_root:
         config_path = os.path.join(path_root, config_path)
+    return os.path.realpath(config_path)
+
+
+def load_config(config_path, path_root=None):
+    """Load a YAML config file.
+
+    Parsed configs are cached by resolved path and modification time, so
+    the file is only parsed again if it has changed. Callers share the
+    cached config and should not modify it.
+    """
+    config_path = resolve_config_path(config_path, path_root)
 
     try:
-        with open(config_path) as config_file:
-            config = yaml.load(config_file)
+        modified = os.stat(config_path).st_mtime_ns
     except OSError as err:
         msg = "Error opening config {}: {}".format(config_path, err)
         raise OSError(msg)
-    except yaml.YAMLError as err:
-        msg = "Error loading config {}: {}".format(config_path, err)
-        raise yaml.YAMLError(msg)
+
+    with _config_lock:
+        cached = _config_cache.get(config_path)
+        if cached is not None and cached[0] == modified:
+            return cached[1]
+
+        try:
+            with open(config_path) as config_file:
+                config = yaml.safe_load(config_file)
+        except OSError as err:
+            msg = "Error opening config {}: {}".format(config_path, err)
+            raise OSError(msg)
+        except yaml.YAMLError as err:
+            msg = "Error loading config {}: {}".format(config_path, err)
+            raise yaml.YAMLError(msg)
+
+        _config_cache[config_path] = (modified, config)
 
     return config
 
 
+def changed_keys(old_config, new_config, prefix=''):
+    """Compares two configs and returns the set of keys that differ.
+
+    Nested keys are given as dotted paths, e.g. 'lights_control.time_on'.
+    """
+    changed = set()
+    for key in set(old_config) | set(new_config):
+        old_value = old_config.get(key)
+        new_value = new_config.get(key)
+        if isinstance(old_value, dict) and isinstance(new_value, dict):
+            changed |= changed_keys(old_value, new_value, prefix="{}{}.".format(prefix, key))
+        elif old_value != new_value:
+            changed.add("{}{}".format(prefix, key))
+    return changed
+
+
+def get_data_filename(config):
+    """Returns the data log that readers should use.
+
+    This is the binary data log if one is configured, otherwise the text one.
+    """
+    binary_log = config['data_logger'].get('binary_log')
+    if binary_log:
+        return binary_log
+    return config['logging']['handlers']['data']['filename']
+
+
+def uses_server_plots(config):
+    """Returns True if the data logger renders a plot every loop, False if the browser draws charts.
+
+    With 'plots: client' in the config 'data_logger' section the web app draws
+    charts from /api/history instead, and only renders plots on demand.
+    """
+    return config['data_logger'].get('plots', 'server') != 'client'
+
+
+# Files each tank needs its own copy of, as (section, ..., key) paths in the config.
+tank_file_keys = (('data_logger', 'binary_log'),
+                  ('data_logger', 'rollup_log'),
+                  ('data_logger', 'event_log'),
+                  ('data_logger', 'plotting', 'filename_root'),
+                  ('logging', 'handlers', 'data', 'filename'),
+                  ('webapp', 'shared_status'),
+                  ('simulation', 'w1_dir'))
+
+# Tank configs of the most recently used config, as (config, {tank name: tank config}).
+_tank_configs = (None, {})
+_tank_configs_lock = Lock()
+
+
+def get_tank_names(config):
+    """Returns the names of the tanks in a config, in config order.
+
+    A config without a 'tanks' section is for a single tank, which has the name None.
+    """
+    tanks = config.get('tanks')
+    if not tanks:
+        return [None]
+    return [str(name) for name in tanks]
+
+
+def tank_filename(filename, tank):
+    """Adds a tank name to a filename, before any extension, e.g. 'data/pisces_reef.dat'."""
+    if tank is None:
+        return filename
+    root, extension = os.path.splitext(filename)
+    return "{}_{}{}".format(root, tank, extension)
+
+
+def _merge(config, overrides):
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(config.get(key), dict):
+            _merge(config[key], value)
+        else:
+            config[key] = copy.deepcopy(value)
+
+
+def get_tank_config(config, tank):
+    """Returns the config for one tank.
+
+    This is the config with the tank's section of 'tanks' merged into it, and
+    without the 'tanks' section itself. For tank None it's just the config.
+    The data logs, plots, shared status and simulated sensor files get the
+    tank name added to their filenames, and each tank's web app is on the
+    next port up from the one before, unless the tank's section sets them.
+    The tank configs of the most recently used config are cached, so callers
+    share them and should not modify them.
+
+    Args:
+        config (dict): Pisces config, as returned by load_config.
+        tank (str): name of the tank, or None for a config without tanks.
+
+    Raises:
+        KeyError: config has no tank with that name.
+    """
+    global _tank_configs
+    if tank is None:
+        return config
+
+    with _tank_configs_lock:
+        cached_config, tank_configs = _tank_configs
+        if cached_config is not config:
+            tank_configs = {}
+            _tank_configs = (config, tank_configs)
+        if tank in tank_configs:
+            return tank_configs[tank]
+
+        tanks = config.get('tanks') or {}
+        if tank not in get_tank_names(config):
+            raise KeyError("No tank called '{}' in the config".format(tank))
+        tank_config = copy.deepcopy({key: value for key, value in config.items() if key != 'tanks'})
+        overrides = {str(name): section for name, section in tanks.items()}.get(tank) or {}
+        _merge(tank_config, overrides)
+        for key_path in tank_file_keys:
+            section, override = tank_config, overrides
+            for key in key_path[:-1]:
+                section = section.get(key) or {}
+                override = override.get(key) or {}
+            filename = section.get(key_path[-1])
+            if filename and key_path[-1] not in override:
+                section[key_path[-1]] = tank_filename(filename, tank)
+        webapp_config = tank_config.get('webapp')
+        if webapp_config and 'port' not in (overrides.get('webapp') or {}):
+            webapp_config['port'] = int(webapp_config.get('port', 5000)) + get_tank_names(config).index(tank)
+        tank_configs[tank] = tank_config
+    return tank_config
+
+
+def get_logging_config(config):
+    """Returns the logging section of a config, with a data log handler and logger for each tank.
+
+    Tank data is logged by the 'pisces_data.<tank>' logger to the tank's own
+    data log, through a copy of the 'data' handler, which replaces it.
+    """
+    logging_config = config.get('logging')
+    if logging_config is None or not config.get('tanks'):
+        return logging_config
+    logging_config = copy.deepcopy(logging_config)
+    handlers = logging_config.get('handlers', {})
+    loggers = logging_config.setdefault('loggers', {})
+    data_handler = handlers.pop('data', None)
+    for logger_config in loggers.values():
+        if 'data' in logger_config.get('handlers', ()):
+            logger_config['handlers'] = [handler for handler in logger_config['handlers'] if handler != 'data']
+    for tank in get_tank_names(config):
+        tank_handlers = []
+        if data_handler is not None:
+            tank_handler = get_tank_config(config, tank)['logging']['handlers']['data']
+            handlers['data_{}'.format(tank)] = copy.deepcopy(tank_handler)
+            tank_handlers.append('data_{}'.format(tank))
+        data_logger = copy.deepcopy(loggers.get('pisces_data', {}))
+        data_logger['handlers'] = tank_handlers
+        data_logger['propagate'] = False
+        loggers['pisces_data.{}'.format(tank)] = data_logger
+    return logging_config
+
+
 def get_last_n_lines(filename, n_lines=1, max_line_size=120):
     """Get the last n lines of a text file without reading it all.
 
     Args:
-        filename (str): path to the text file
+        filename (str): path to the text file. If it ends with '.gz' it is
+            treated as a block compressed log, see pisces.compressedlog.
         n_lines (int, optional): number of lines from the end of the file to
             return, default 1.
         max_line_size (int, optional): maximum number of bytes per
@@ -64,6 +294,9 @@ def get_last_n_lines(filename, n_lines=1, max_line_size=120):
 
     n_lines = int(n_lines)
     max_line_size = int(max_line_size)
+    if filename.endswith('.gz'):
+        from pisces.compressedlog import get_last_compressed_lines
+        return get_last_compressed_lines(filename, n_lines)
     buffer_size = n_lines * max_line_size
     file_size = os.path.getsize(filename)
 
@@ -81,40 +314,65 @@ def get_last_n_lines(filename, n_lines=1, max_line_size=120):
     return lines[-n_lines:]
 
 
-def read_log(filename, n_lines=1, max_line_size=120):
-    log_names = ('log_time',
-                 'water_temp',
-                 'water_temp_status',
-                 'air_temp',
-                 'water_level',
-                 'water_level_status',
-                 'overflow',
-                 'lights_auto',
-                 'lights_enabled',
-                 'fan_auto',
-                 'fan_enabled',
-                 'pump_auto',
-                 'pump_enabled')
-    log_dtypes = (datetime,
-                  np.float,
-                  'U4',
-                  np.float,
-                  np.float,
-                  'U4',
-                  np.bool,
-                  np.bool,
-                  np.bool,
-                  np.bool,
-                  np.bool,
-                  np.bool,
-                  np.bool)
-    time_converter = lambda t: datetime.strptime(t.decode(), "%Y-%m-%dT%H:%M:%S%z")
-    bool_converter = lambda b: bool(int(b))
-
-    log_lines = get_last_n_lines(filename, n_lines, max_line_size)
-    if len(log_lines) < n_lines:
+def get_log_files(filename):
+    """Returns the files of a data log, oldest first, for read_log().
+
+    These are the daily files of a binary or event log, or the rotated logs
+    of a text data log, whose current log is always read if it exists.
+    """
+    if filename.endswith(('.bin', '.evt')):
+        from pisces.binlog import get_binary_log_files
+        return get_binary_log_files(filename)
+    from pisces.logindex import get_rotated_logs
+    return get_rotated_logs(filename)
+
+
+def read_log(filename, n_lines=1, max_line_size=120, start=None, end=None, interval=None, log_files=None):
+    """Read data from a data log, including rotated logs.
+
+    Either the last n lines or, if start and/or end are given, all the data
+    between start and end (inclusive).
+
+    Args:
+        filename (str): path to the data log. If it ends with '.bin' it is
+            treated as a binary data log, if it ends with '.evt' as an event log.
+        n_lines (int, optional): number of lines to read, default 1. Ignored
+            if start or end are given.
+        max_line_size (int, optional): maximum number of bytes per line of
+            a text data log. Default 120.
+        start (optional): earliest log time to include, as a datetime,
+            datetime64 or ISO 8601 string. Default no limit.
+        end (optional): latest log time to include. Default no limit.
+        interval (float, optional): event logs only, seconds between samples
+            to resample the status at. Default one line per status change.
+        log_files (list, optional): files of the data log, from get_log_files(),
+            to save looking for them again when reading a log several times.
+            Default look for them.
+
+    Returns:
+        numpy.ndarray: structured array of log data, oldest first.
+    """
+    from pisces.binlog import read_binary_log
+    from pisces.logindex import get_rotated_logs, read_lines_between
+
+    if filename.endswith('.bin'):
+        # Binary data log, records can be read directly with no parsing.
+        return read_binary_log(filename, n_records=n_lines, start=start, end=end, log_files=log_files)
+
+    if filename.endswith('.evt'):
+        # Event log, the status is rebuilt from the changes.
+        from pisces.eventlog import read_event_log
+        return read_event_log(filename, n_records=n_lines, start=start, end=end, interval=interval,
+                              log_files=log_files)
+
+    if start is not None or end is not None:
+        # Use the rotated log indices to go straight to the requested times.
+        log_lines = read_lines_between(filename, start, end, rotated_logs=log_files)
+    else:
+        log_lines = get_last_n_lines(filename, n_lines, max_line_size)
+    if len(log_lines) < n_lines and start is None and end is None:
         # Not enough lines in the current temperature log file. Look for next oldest one and get more lines from that.
-        old_log_files = glob("{}.20*".format(filename))
+        old_log_files = list(log_files) if log_files is not None else get_rotated_logs(filename)
         if old_log_files:
             # Found some older logs. Sort newest first.
             old_log_files.sort(reverse=True)
@@ -125,25 +383,49 @@ def read_log(filename, n_lines=1, max_line_size=120):
                 if len(log_lines) >= n_lines:
                     break
 
-    log_data = np.genfromtxt(log_lines,
-                             names=log_names,
-                             dtype=log_dtypes,
-                             converters={'log_time': time_converter,
-                                         'overflow': bool_converter,
-                                         'lights_auto': bool_converter,
-                                         'lights_enabled': bool_converter,
-                                         'fan_auto': bool_converter,
-                                         'fan_enabled': bool_converter,
-                                         'pump_auto': bool_converter,
-                                         'pump_enabled': bool_converter},
-                             filling_values=np.nan)
-
-    if n_lines == 1:
-        # Structured 1D arrays with 1 element lose their shape,
-        # preventing access to values via sa[field_name][0].
-        # Need to give it its shape back to allow access in the
-        # same way as multi-element structured arrays.
-        log_data = log_data.reshape((1,))
+    return parse_log_lines(log_lines)
+
+
+def parse_log_lines(log_lines):
+    """Convert data log lines to a structured array.
+
+    Each column is converted in a single vectorised operation rather than
+    calling a Python converter for every field of every line.
+
+    Args:
+        log_lines (list): data log lines, as strings.
+
+    Returns:
+        numpy.ndarray: structured array of log data with fields log_names.
+    """
+    import numpy as np
+
+    n_fields = len(log_names)
+    tokens = ' '.join(log_lines).split()
+    if len(tokens) != n_fields * len(log_lines):
+        # Some blank or incomplete lines, e.g. from an interrupted write. Skip them.
+        log_lines = [line for line in log_lines if len(line.split()) == n_fields]
+        tokens = ' '.join(log_lines).split()
+
+    log_data = np.empty(len(tokens) // n_fields, dtype=get_log_dtype())
+    # Times are fixed layout ISO 8601. Truncating to 19 characters drops the
+    # UTC offset, log times are kept as local times.
+    log_data['log_time'] = np.array(tokens[0::n_fields], dtype='S19').astype('datetime64[s]')
+    for i in (1, 3, 4):
+        log_data[log_names[i]] = np.array(tokens[i::n_fields], dtype=float)
+    for i in (2, 5):
+        log_data[log_names[i]] = tokens[i::n_fields]
+    # The 0/1 flags, all in one block of single character fields.
+    flag_tokens = list(chain.from_iterable(tokens[i::n_fields] for i in range(6, n_fields)))
+    flag_string = ''.join(flag_tokens)
+    if len(flag_string) == len(flag_tokens):
+        flags = np.frombuffer(flag_string.encode(), dtype=np.uint8) - ord('0')
+    else:
+        flags = np.array(flag_tokens, dtype=np.uint8)
+    flags = flags.reshape(n_fields - 6, -1).astype(bool)
+    for i, name in enumerate(log_names[6:]):
+        log_data[name] = flags[i]
+
     return log_data
 
 
@@ -152,35 +434,23 @@ def plot_log(log_filename='data/pisces.dat',
              filename_root='pisces/static/temperature',
              temp_limits = [23, 28],
              target_limits = [25, 26],
-             duration=24):
+             duration=24,
+             log_data=None):
+    """Saves a plot of the most recent data log records to filename_root_<last log time>.png.
+
+    Any previous plots with the same filename_root are removed. The figure is kept and
+    reused by later calls with the same limits and duration.
+    """
+    from pisces.plotting import get_log_plot
+
     for old_plot in glob("{}_*.png".format(filename_root)):
         os.unlink(old_plot)
-    log_data = read_log(log_filename, n_lines=(duration * 3600 / log_interval))
-    fig = Figure()
-    FigureCanvas(fig)
-    fig.set_size_inches(12, 8)
-    ax = fig.add_subplot(1, 1, 1)
-    ax.fill_between(log_data['log_time'], target_limits[0], target_limits[1], color='g', alpha=0.1)
-    ax.plot(log_data['log_time'], log_data['water_temp'], 'b-', label='Water temperature')
-    ax.plot(log_data['log_time'], log_data['air_temp'], 'c-', label='Air temperature')
-    fan_on_times = log_data['log_time'][log_data['fan_enabled'] == True]
-    ax.plot(fan_on_times, temp_limits[1] * np.ones(fan_on_times.shape),
-               'yo', label='Cooling fan on')
-    lights_on_times = log_data['log_time'][log_data['lights_enabled'] == True]
-    ax.plot(lights_on_times, temp_limits[0] * np.ones(lights_on_times.shape),
-            'go', label='Lights on')
-    ax.legend(loc=0)
-    ax.set_xlim(log_data['log_time'].min(), log_data['log_time'].max())
-    ax.set_xlabel("Local datetime")
-    ax.set_ylabel(r'Temperature / $\degree$C')
-    ax.set_ylim(*temp_limits)
-    ax.set_title("Temperatures over {} hours up to {}".format(duration, log_data[-1]['log_time']))
-    fig.tight_layout()
-    fig.savefig("{}_{}.png".format(filename_root,
-                                   log_data[-1]['log_time'].strftime('%Y-%m-%dT%H:%M:%S%z')),
-                transparent=False)
-    fig.clf()
-    del fig
+    if log_data is None:
+        log_data = read_log(log_filename, n_lines=(duration * 3600 / log_interval))
+    log_plot = get_log_plot(tuple(temp_limits), tuple(target_limits), duration)
+    log_plot.render(log_data,
+                    "{}_{}.png".format(filename_root,
+                                       log_data[-1]['log_time'].astype(datetime).strftime('%Y-%m-%dT%H:%M:%S%z')))
 
 
 def end_process(proc):
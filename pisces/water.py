@@ -1,7 +1,10 @@
+import math
+
 from gpiozero import DigitalInputDevice
 
 from pisces.control import ClosedLoopBase
 from pisces.sensors import WaterLevelSensor
+from pisces.simulation import is_simulated
 
 class WaterControl(ClosedLoopBase):
     def __init__(self, pisces_core, **kwargs):
@@ -12,34 +15,46 @@ class WaterControl(ClosedLoopBase):
 
         overflow_pin = self.config[self._name]['overflow']
         self._overflow = DigitalInputDevice(int(overflow_pin), bounce_time=1)
+        if is_simulated(self.config):
+            # Overflow sensor is high when there's no overflow.
+            self._overflow.pin.drive_high()
         self._overflow.when_deactivated = self._overflow_detected  # Overflow sensor goes low when overflow detected.
         self._overflow.when_activated = self._overflow_ended  # Overflow sensor goes high when there's no overflow.
-        self._status['overflow'] = self._overflow.is_active
+        self._status['overflow'] = not self._overflow.is_active  # Active, i.e. high, when there's no overflow.
 
         self.logger.debug("Water control initialised.")
         self.start_monitoring()
 
     def __del__(self):
         self.stop_monitoring()
+        self._sensors.stop_sampling()
 
     def _update(self):
         self._status['water_level'] = self._sensors.water_level
-        if self._status['water_level'] > self._target_max:
-            self._status['water_level_status'] = 'HIGH'
-        elif self._status['water_level'] < self._target_min:
-            self._status['water_level_status'] = 'LOW'
-        else:
-            self._status['water_level_status'] = 'OK'
-
-        if self.is_auto:
-            if self.is_on and self._status['water_level'] > (self._target_min + self._hysteresis):
+        if math.isnan(self._status['water_level']):
+            self.logger.warning("Could not read water level. Disabling pump.")
+            self._status['water_level_status'] = 'ERROR'
+            if self.is_on:
                 self.off()
-            elif not self.is_on and self._status['water_level'] < self._target_min:
-                self.on()
             else:
                 self._update_status()
         else:
-            self._update_status()
+            if self._status['water_level'] > self._target_max:
+                self._status['water_level_status'] = 'HIGH'
+            elif self._status['water_level'] < self._target_min:
+                self._status['water_level_status'] = 'LOW'
+            else:
+                self._status['water_level_status'] = 'OK'
+
+            if self.is_auto:
+                if self.is_on and self._status['water_level'] > (self._target_min + self._hysteresis):
+                    self.off()
+                elif not self.is_on and self._status['water_level'] < self._target_min:
+                    self.on()
+                else:
+                    self._update_status()
+            else:
+                self._update_status()
 
     def _overflow_detected(self):
         self.logger.warning("Overflow detected! Water pump inhibited.")
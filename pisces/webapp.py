@@ -1,25 +1,103 @@
 import datetime
+import hashlib
+import math
 import platform
 import os
+import sys
+import json
+import time
+from collections import OrderedDict
+from glob import glob
+from threading import Thread, Condition, Lock
 
 from gpiozero import DigitalOutputDevice
-from flask import Flask, render_template, current_app
+from flask import Flask, Response, render_template, current_app, request
+from werkzeug.http import is_resource_modified
 
 from pisces.base import PiscesBase
-from pisces.utils import load_config, read_log
+from pisces.rollup import get_rollup_dtype, read_history, downsample, stat_fields, on_fields, on_field_name
+from pisces.utils import load_config, read_log, get_data_filename, uses_server_plots, get_tank_names, get_tank_config
 
 
 app = Flask(__name__)
 
+# Default and maximum number of points returned by /api/history.
+default_history_points = 1000
+default_history_max_points = 100000
+# Values per chunk when streaming history data.
+history_chunk_size = 4096
+# Longest plot /plot.png will render, in hours.
+max_plot_duration = 24 * 31
+# Default number of production server worker threads.
+default_threads = 8
 
-@app.route('/')
-def index():
-    version = current_app.config['version']
-    hostname = platform.node()
-    data_file = current_app.config['pisces_config']['logging']['handlers']['data']['filename']
-    last_reading = read_log(data_file)[0]
-    last_reading_datetime = last_reading['log_time']
-    now = datetime.datetime.now(tz=last_reading_datetime.tzinfo)
+
+def get_status_reader():
+    """Returns a reader for the live status in shared memory, or None if it isn't available."""
+    reader = current_app.config.get('status_reader')
+    if reader is None:
+        shared_status = current_app.config['pisces_config']['webapp'].get('shared_status')
+        if shared_status:
+            from pisces.sharedstatus import StatusReader
+            try:
+                reader = StatusReader(shared_status)
+            except FileNotFoundError:
+                # Pisces core not publishing (yet).
+                return None
+            current_app.config['status_reader'] = reader
+    return reader
+
+
+def get_last_reading():
+    """Returns the latest status, live from shared memory if possible, otherwise from the data log."""
+    reader = get_status_reader()
+    if reader is not None:
+        last_reading = reader.read()
+        if last_reading is not None:
+            return last_reading
+    data_file = get_data_filename(current_app.config['pisces_config'])
+    return read_log(data_file)[0]
+
+
+def get_plot_filename():
+    """Returns the filename of the most recent temperature plot in the static folder.
+
+    Returns None if plots aren't being rendered by the data logger.
+    """
+    if not uses_server_plots(current_app.config['pisces_config']):
+        return None
+    filename_root = current_app.config['pisces_config']['data_logger']['plotting']['filename_root']
+    plots = sorted(glob("{}_*.png".format(filename_root)))
+    if plots:
+        return os.path.basename(plots[-1])
+    return None
+
+
+def get_chart_settings():
+    """Returns the temperature limits, target limits and duration, in hours, of plots and charts."""
+    pisces_config = current_app.config['pisces_config']
+    plotting = pisces_config['data_logger']['plotting']
+    target_limits = plotting.get('target_limits', (pisces_config['temperature_control']['target_min'],
+                                                   pisces_config['temperature_control']['target_max']))
+    return {'temp_limits': [float(limit) for limit in plotting.get('temp_limits', (23, 28))],
+            'target_limits': [float(limit) for limit in target_limits],
+            'duration': float(plotting.get('duration', 24))}
+
+
+def get_status_data(last_reading, now=None, plot_filename=None):
+    """Returns the values and colours used to display a status reading.
+
+    Args:
+        last_reading (numpy.void): status record with the data log fields.
+        now (datetime.datetime, optional): current local time, default now.
+        plot_filename (str, optional): filename of the temperature plot,
+            default the most recent one in the static folder.
+    """
+    last_reading_datetime = last_reading['log_time'].astype(datetime.datetime)
+    if now is None:
+        now = datetime.datetime.now()
+    if plot_filename is None:
+        plot_filename = get_plot_filename()
     time_string = now.strftime("%Y-%m-%d %H:%M")
     last_reading_age = (now - last_reading_datetime).total_seconds()
     if last_reading_age > current_app.config['pisces_config']['data_logger']['loop_interval']:
@@ -61,28 +139,462 @@ def index():
         lights_status = 'Off'
         lights_colour = 'w3-black'
 
-    refresh_interval = current_app.config['pisces_config']['webapp']['refresh_interval']
-    template_data = {'version': version,
-                     'hostname': hostname,
-                     'time': time_string,
-                     'last_time': last_reading['log_time'],
-                     'last_colour': last_colour,
-                     'last_mins': last_mins,
-                     'water_temp': last_reading['water_temp'],
-                     'water_colour': water_colour,
-                     'air_temp': last_reading['air_temp'],
-                     'air_colour': air_colour,
-                     'cooling_status': cooling_status,
-                     'cooling_colour': cooling_colour,
-                     'lights_status': lights_status,
-                     'lights_colour': lights_colour,
-                     'refresh_interval': refresh_interval}
-    return render_template('index.html', **template_data)
+    return {'time': time_string,
+            'last_time': last_reading_datetime,
+            'last_colour': last_colour,
+            'last_mins': last_mins,
+            'water_temp': float(last_reading['water_temp']),
+            'water_colour': water_colour,
+            'air_temp': float(last_reading['air_temp']),
+            'air_colour': air_colour,
+            'cooling_status': cooling_status,
+            'cooling_colour': cooling_colour,
+            'lights_status': lights_status,
+            'lights_colour': lights_colour,
+            'plot_filename': plot_filename}
+
+
+class ResponseCache():
+    """Rendered response bodies, keyed by the data they were rendered from.
+
+    Args:
+        max_entries (int, optional): number of bodies to keep, least
+            recently used are dropped first. Default 32.
+    """
+    def __init__(self, max_entries=32):
+        self._max_entries = max_entries
+        self._bodies = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, render):
+        """Returns the cached body for key, calling render() to create it if necessary."""
+        with self._lock:
+            body = self._bodies.get(key)
+            if body is not None:
+                self._bodies.move_to_end(key)
+                return body
+        # Render outside the lock, two threads rendering the same page at once is harmless.
+        body = render()
+        with self._lock:
+            self._bodies[key] = body
+            while len(self._bodies) > self._max_entries:
+                self._bodies.popitem(last=False)
+        return body
+
+
+response_cache = ResponseCache()
+
+
+def cached_response(name, key, last_modified, render, mimetype='text/html'):
+    """Returns a response with a body from the cache, or 304 Not Modified if the client is up to date.
+
+    Args:
+        name (str): name of the page or data, e.g. the route name.
+        key: hashable, repr-able value that changes whenever the body would,
+            e.g. the time of the latest data.
+        last_modified (datetime.datetime): time the data last changed, local
+            if naive.
+        render (callable): returns the body, only called on a cache miss.
+        mimetype (str, optional): default 'text/html'.
+    """
+    etag = hashlib.sha1(repr((name, key)).encode()).hexdigest()
+    last_modified = last_modified.astimezone(datetime.timezone.utc).replace(microsecond=0)
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = Response(status=304)
+    else:
+        response = Response(response_cache.get((name, key), render), mimetype=mimetype)
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    # Clients can keep a copy but must check it's still current before using it.
+    response.cache_control.no_cache = True
+    return response
+
+
+def status_cache_key():
+    """Returns (last reading, now, cache key, last modified time) for pages showing the status.
+
+    These pages show the current time and the age of the last reading, to the
+    minute, so they change every minute as well as whenever there's new data.
+    """
+    last_reading = get_last_reading()
+    now = datetime.datetime.now()
+    minute = now.replace(second=0, microsecond=0)
+    plot_filename = get_plot_filename()
+    last_modified = max(last_reading['log_time'].astype(datetime.datetime), minute)
+    return last_reading, now, (str(last_reading['log_time']), minute.isoformat(), plot_filename), last_modified
+
+
+def format_status(status_data, static_url_path):
+    """Converts status data from get_status_data() to a form that can be sent as JSON."""
+    status_data = dict(status_data)
+    status_data['last_time'] = status_data['last_time'].strftime('%H:%M')
+    for name in ('water_temp', 'air_temp'):
+        if math.isnan(status_data[name]):
+            # NaN isn't valid JSON.
+            status_data[name] = None
+    if status_data['plot_filename']:
+        status_data['plot_url'] = "{}/{}".format(static_url_path, status_data['plot_filename'])
+    return status_data
+
+
+class StatusBroadcaster():
+    """Pushes status changes to any number of connected clients.
+
+    A single background thread watches for new status readings and formats
+    each one once, then every connected client's stream is woken up to send
+    it. The cost of reading the status doesn't depend on the number of clients.
+
+    Each connected client holds one of the web server's worker threads, so
+    the number of clients is limited, see add_listener().
+
+    Args:
+        flask_app (flask.Flask): the web app, needed for its config.
+        poll_interval (float, optional): seconds between checks of the live
+            status sequence number, default 0.5.
+        keepalive_interval (float, optional): seconds between keepalive
+            comments sent to idle clients, default 15.
+    """
+    def __init__(self, flask_app, poll_interval=0.5, keepalive_interval=15):
+        self._app = flask_app
+        self._poll_interval = poll_interval
+        self._keepalive_interval = keepalive_interval
+        self._condition = Condition()
+        self._message = None
+        self._message_number = 0
+        self._n_listeners = 0
+        self._thread = None
+
+    def _start(self):
+        with self._condition:
+            if self._thread is None:
+                self._thread = Thread(target=self._watch, daemon=True)
+                self._thread.start()
+
+    def _watch(self):
+        with self._app.app_context():
+            refresh_interval = current_app.config['pisces_config']['webapp']['refresh_interval']
+            last_key = None
+            while True:
+                reader = get_status_reader()
+                if reader is not None:
+                    key = reader.sequence
+                else:
+                    # No live status, fall back to reading the data log once per refresh interval.
+                    key = int(time.monotonic() // refresh_interval)
+                if key != last_key:
+                    try:
+                        self._publish(get_status_data(get_last_reading()))
+                    except Exception as err:
+                        current_app.logger.error("Error reading status for stream: {}".format(err))
+                    else:
+                        last_key = key
+                time.sleep(self._poll_interval)
+
+    def _publish(self, status_data):
+        status_data = format_status(status_data, self._app.static_url_path)
+        message = "data: {}\n\n".format(json.dumps(status_data))
+        with self._condition:
+            self._message = message
+            self._message_number += 1
+            self._condition.notify_all()
+
+    def add_listener(self, max_listeners):
+        """Reserves a place for a client, returns False if there are already max_listeners."""
+        with self._condition:
+            if self._n_listeners >= max_listeners:
+                return False
+            self._n_listeners += 1
+            return True
+
+    def remove_listener(self):
+        """Frees the place of a client that has disconnected."""
+        with self._condition:
+            self._n_listeners -= 1
+
+    def listen(self):
+        """Generator of server-sent events for one client, call add_listener() first."""
+        self._start()
+        last_number = 0
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._message_number != last_number,
+                                         timeout=self._keepalive_interval)
+                message = self._message
+                message_number = self._message_number
+            if message_number != last_number:
+                last_number = message_number
+                yield message
+            else:
+                yield ": keepalive\n\n"
+
+
+status_broadcaster = StatusBroadcaster(app)
+
+
+@app.route('/')
+def index():
+    last_reading, now, key, last_modified = status_cache_key()
+
+    def render():
+        version = current_app.config['version']
+        hostname = platform.node()
+        refresh_interval = current_app.config['pisces_config']['webapp']['refresh_interval']
+        template_data = {'version': version,
+                         'hostname': hostname,
+                         'refresh_interval': refresh_interval,
+                         'tank': current_app.config.get('tank'),
+                         'client_charts': not uses_server_plots(current_app.config['pisces_config']),
+                         'chart': get_chart_settings()}
+        template_data.update(get_status_data(last_reading, now=now, plot_filename=key[2]))
+        return render_template('index.html', **template_data)
+
+    return cached_response('index', key, last_modified, render)
+
+
+@app.route('/api/status')
+def api_status():
+    """Latest status as JSON, in the same form as the /stream events."""
+    last_reading, now, key, last_modified = status_cache_key()
+
+    def render():
+        status_data = get_status_data(last_reading, now=now, plot_filename=key[2])
+        return json.dumps(format_status(status_data, current_app.static_url_path))
+
+    return cached_response('api_status', key, last_modified, render, mimetype='application/json')
+
+
+def get_max_streams():
+    """Returns the most /stream clients at once, always fewer than the server's worker threads."""
+    webapp_config = current_app.config['pisces_config']['webapp']
+    threads = int(webapp_config.get('threads', default_threads))
+    return max(min(int(webapp_config.get('max_streams', threads // 2)), threads - 1), 0)
+
+
+@app.route('/stream')
+def stream():
+    """Server-sent events stream of status updates.
+
+    Each stream holds a worker thread for as long as the client is
+    connected, so once there are webapp.max_streams of them new clients get
+    a 503 and should poll /api/status instead.
+    """
+    if not status_broadcaster.add_listener(get_max_streams()):
+        refresh_interval = current_app.config['pisces_config']['webapp']['refresh_interval']
+        return Response("Too many status streams, poll /api/status instead\n", status=503,
+                        mimetype='text/plain', headers={'Retry-After': str(refresh_interval)})
+    response = Response(status_broadcaster.listen(),
+                        mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache'})
+    response.call_on_close(status_broadcaster.remove_listener)
+    return response
+
+
+@app.route('/metrics')
+def metrics():
+    """Pisces core timing metrics, in Prometheus text format."""
+    filename = current_app.config['pisces_config'].get('metrics', {}).get('filename')
+    if not filename:
+        return Response("Metrics not enabled\n", status=404, mimetype='text/plain')
+    try:
+        modified_ns = os.stat(filename).st_mtime_ns
+    except OSError:
+        # Pisces core not running, or hasn't written any metrics yet.
+        return Response("Metrics not available\n", status=503, mimetype='text/plain')
+
+    def render():
+        with open(filename) as metrics_file:
+            return metrics_file.read()
+
+    return cached_response('metrics', (filename, modified_ns),
+                           datetime.datetime.fromtimestamp(modified_ns / 1e9),
+                           render, mimetype='text/plain; version=0.0.4')
+
+
+def parse_history_fields(fields):
+    """Converts a comma separated list of field names to a list of rollup field names.
+
+    Data log names are accepted too, e.g. 'water_temp' gives its min, mean and
+    max and 'fan_enabled' gives 'fan_on'. No fields means all of them.
+
+    Raises:
+        ValueError: unknown field name.
+    """
+    rollup_names = get_rollup_dtype().names[1:]
+    if not fields:
+        return list(rollup_names)
+    names = []
+    for field in fields.split(','):
+        field = field.strip()
+        if field in rollup_names:
+            names.append(field)
+        elif field in stat_fields:
+            names.extend(field + statistic for statistic in ('_min', '_mean', '_max'))
+        elif field in on_fields:
+            names.append(on_field_name(field))
+        elif field != 'log_time':
+            msg = "Unknown field '{}'".format(field)
+            raise ValueError(msg)
+    return list(dict.fromkeys(names))
+
+
+def history_column(history, name):
+    """Returns a column of history data as a little endian array, log times as int64 seconds."""
+    if name == 'log_time':
+        return history['log_time'].astype('datetime64[s]').astype('<i8')
+    column = history[name]
+    return column.astype(column.dtype.newbyteorder('<'))
+
+
+def stream_history_json(resolution, history, names):
+    """Generates history data as a JSON object of columns, a chunk at a time."""
+    yield '{{"resolution": {}, "count": {}'.format(json.dumps(resolution), len(history))
+    for name in ['log_time'] + names:
+        column = history_column(history, name)
+        yield ', {}: ['.format(json.dumps(name))
+        for first in range(0, len(column), history_chunk_size):
+            values = column[first:first + history_chunk_size].tolist()
+            if column.dtype.kind == 'f':
+                values = [None if math.isnan(value) else round(value, 3) for value in values]
+            yield (', ' if first else '') + json.dumps(values)[1:-1]
+        yield ']'
+    yield '}\n'
+
+
+def stream_history_binary(history, names):
+    """Generates history data as consecutive little endian arrays, one per field, a chunk at a time."""
+    for name in ['log_time'] + names:
+        column = history_column(history, name)
+        for first in range(0, len(column), history_chunk_size):
+            yield column[first:first + history_chunk_size].tobytes()
+
+
+def history_error(message, status=400):
+    return Response(json.dumps({'error': message}), status=status, mimetype='application/json')
+
+
+@app.route('/api/history')
+def api_history():
+    """Data log history, from the rollups at a suitable resolution or from the data log itself.
+
+    Query parameters:
+        start: ISO 8601 local time, default 24 hours before end.
+        end: ISO 8601 local time, default now.
+        fields: comma separated field names, default all of them.
+        max_points: maximum number of points, default 1000. Consecutive
+            points are combined to keep within this.
+        format: 'json' for a JSON object of columns, or 'binary' for the
+            columns as raw little endian arrays, one after another. The
+            fields, in order with their dtypes, and the number of points
+            are given by the X-Pisces-Fields and X-Pisces-Count headers.
+
+    Log times are seconds since 1970-01-01T00:00:00 in local time, i.e. the
+    data log time stamps as integers.
+    """
+    import numpy as np
+
+    pisces_config = current_app.config['pisces_config']
+    args = request.args
+    try:
+        end = np.datetime64(args['end'], 's') if 'end' in args else np.datetime64(datetime.datetime.now(), 's')
+        start = np.datetime64(args['start'], 's') if 'start' in args else end - np.timedelta64(24, 'h')
+        max_points = int(args.get('max_points', default_history_points))
+        names = parse_history_fields(args.get('fields'))
+    except ValueError as err:
+        return history_error(str(err))
+    limit = int(pisces_config['webapp'].get('history_max_points', default_history_max_points))
+    if not 0 < max_points <= limit:
+        return history_error("max_points must be between 1 and {}".format(limit))
+    if start > end:
+        return history_error("start must not be after end")
+    output_format = args.get('format', 'json')
+    if output_format not in ('json', 'binary'):
+        return history_error("format must be 'json' or 'binary'")
+
+    try:
+        resolution, history = read_history(get_data_filename(pisces_config),
+                                           pisces_config['data_logger'].get('rollup_log'),
+                                           start, end, max_points, max_points=max_points)
+    except OSError as err:
+        return history_error("Could not read history: {}".format(err), status=503)
+    history = downsample(history, max_points)
+
+    # Only the output is streamed, the records themselves are compact NumPy arrays.
+    if output_format == 'json':
+        return Response(stream_history_json(resolution, history, names), mimetype='application/json')
+    fields = ','.join('{}:{}'.format(name, history_column(history[:0], name).dtype.str)
+                      for name in ['log_time'] + names)
+    return Response(stream_history_binary(history, names),
+                    mimetype='application/octet-stream',
+                    headers={'X-Pisces-Resolution': resolution,
+                             'X-Pisces-Count': str(len(history)),
+                             'X-Pisces-Fields': fields})
+
+
+@app.route('/plot.png')
+def plot_png():
+    """Temperature plot of recent data, rendered on demand, e.g. for exports.
+
+    Query parameters:
+        duration: hours of data to plot, default the configured plot duration.
+    """
+    from io import BytesIO
+    from pisces.plotting import get_log_plot
+
+    pisces_config = current_app.config['pisces_config']
+    settings = get_chart_settings()
+    try:
+        duration = float(request.args.get('duration', settings['duration']))
+    except ValueError:
+        duration = math.nan
+    if not 0 < duration <= max_plot_duration:
+        return Response("duration must be between 0 and {} hours\n".format(max_plot_duration),
+                        status=400, mimetype='text/plain')
+
+    def render():
+        n_lines = int(duration * 3600 / pisces_config['data_logger']['loop_interval'])
+        log_data = read_log(get_data_filename(pisces_config), n_lines=n_lines)
+        png = BytesIO()
+        log_plot = get_log_plot(tuple(settings['temp_limits']), tuple(settings['target_limits']), duration)
+        log_plot.render(log_data, png)
+        return png.getvalue()
+
+    try:
+        last_reading = get_last_reading()
+        key = (str(last_reading['log_time']), duration, tuple(settings['temp_limits']),
+               tuple(settings['target_limits']))
+        return cached_response('plot', key, last_reading['log_time'].astype(datetime.datetime), render,
+                               mimetype='image/png')
+    except OSError as err:
+        return Response("Could not read data log: {}\n".format(err), status=503, mimetype='text/plain')
+
+
+def serve(flask_app, host, port, threads=default_threads):
+    """Serves the web app with a multi-threaded production WSGI server.
+
+    Uses waitress, see requirements.txt. If it isn't installed falls back to
+    werkzeug's threaded server with the debugger and reloader off, with a warning.
+    """
+    try:
+        import waitress
+    except ImportError:
+        from werkzeug.serving import run_simple
+        flask_app.logger.warning("waitress not installed, using werkzeug's development server instead.")
+        run_simple(host, port, flask_app, threaded=True, use_reloader=False, use_debugger=False)
+    else:
+        waitress.serve(flask_app, host=host, port=port, threads=threads)
 
 
 if __name__ == '__main__':
     pb = PiscesBase()
-    host = pb.config['webapp']['host']
-    app.config['pisces_config'] = pb.config
+    # Serves one tank, the one named on the command line or the first. The core runs one web app per tank.
+    tank = sys.argv[1] if len(sys.argv) > 1 else get_tank_names(pb.config)[0]
+    app.config['pisces_config'] = get_tank_config(pb.config, tank)
+    app.config['tank'] = tank
     app.config['version'] = pb.__version__
-    app.run(host=host, debug=True)
+    webapp_config = app.config['pisces_config']['webapp']
+    host = webapp_config['host']
+    port = int(webapp_config.get('port', 5000))
+    if webapp_config.get('mode', 'production') == 'development':
+        app.run(host=host, port=port, debug=True)
+    else:
+        serve(app, host, port, threads=int(webapp_config.get('threads', default_threads)))
@@ -0,0 +1,177 @@
+"""Round trip tests for the event log codec."""
+import math
+
+import numpy as np
+
+from pisces.eventlog import EventLogWriter, decode_event_file, read_event_log
+from pisces.status import status_fields
+
+
+def make_status(**values):
+    status = {name: default for name, _, default in status_fields}
+    status.update(values)
+    return status
+
+
+def write_events(log_root, events, **kwargs):
+    """Writes (log time, status) pairs, returns the record lengths."""
+    writer = EventLogWriter(str(log_root), **kwargs)
+    lengths = [writer.append(np.datetime64(log_time), status) for log_time, status in events]
+    writer.close()
+    return lengths
+
+
+def test_round_trip(tmp_path):
+    log_root = tmp_path / 'pisces.evt'
+    events = [('2019-05-01T10:00:00', make_status(water_temp=25.125, air_temp=24.5, water_level=10.0)),
+              ('2019-05-01T10:00:10', make_status(water_temp=25.25, air_temp=24.5, water_level=10.0)),
+              ('2019-05-01T10:00:20', make_status(water_temp=25.25, air_temp=24.5, water_level=10.0,
+                                                  fan_enabled=True, water_temp_status='HIGH')),
+              ('2019-05-01T10:00:30', make_status(water_temp=24.875, air_temp=24.4, water_level=9.99))]
+    lengths = write_events(log_root, events)
+
+    decoded = decode_event_file(str(log_root) + '.2019-05-01')
+    assert len(decoded) == len(events)
+    for record, (log_time, status) in zip(decoded, events):
+        assert record['log_time'] == np.datetime64(log_time)
+        for name, _, _ in status_fields:
+            assert record[name] == status[name]
+    # Change records only have what changed.
+    assert lengths[1] < lengths[0]
+
+
+def test_keyframes(tmp_path):
+    log_root = tmp_path / 'pisces.evt'
+    events = [('2019-05-01T10:00:{:02d}'.format(second), make_status(water_temp=25 + second / 1000))
+              for second in range(0, 60, 5)]
+    lengths = write_events(log_root, events, keyframe_interval=20)
+
+    # Keyframes are the longest records, one every keyframe_interval.
+    keyframe_length = lengths[0]
+    assert [i for i, length in enumerate(lengths) if length == keyframe_length] == [0, 4, 8]
+    decoded = decode_event_file(str(log_root) + '.2019-05-01')
+    assert np.allclose(decoded['water_temp'], [status['water_temp'] for _, status in events])
+
+
+def test_nan(tmp_path):
+    log_root = tmp_path / 'pisces.evt'
+    events = [('2019-05-01T10:00:00', make_status(water_temp=math.nan)),
+              ('2019-05-01T10:00:10', make_status(water_temp=25.5)),
+              ('2019-05-01T10:00:20', make_status(water_temp=math.nan)),
+              ('2019-05-01T10:00:30', make_status(water_temp=25.5))]
+    write_events(log_root, events)
+
+    decoded = decode_event_file(str(log_root) + '.2019-05-01')
+    assert np.isnan(decoded['water_temp'][0])
+    assert decoded['water_temp'][1] == 25.5
+    assert np.isnan(decoded['water_temp'][2])
+    assert decoded['water_temp'][3] == 25.5
+
+
+def test_deadband(tmp_path):
+    log_root = tmp_path / 'pisces.evt'
+    events = [('2019-05-01T10:00:00', make_status(water_temp=25.0)),
+              ('2019-05-01T10:00:10', make_status(water_temp=25.02)),
+              ('2019-05-01T10:00:20', make_status(water_temp=25.04)),
+              ('2019-05-01T10:00:30', make_status(water_temp=25.06))]
+    lengths = write_events(log_root, events, deadband={'water_temp': 0.05})
+
+    # Changes smaller than the deadband aren't logged until they add up to it.
+    assert [length > 0 for length in lengths] == [True, False, False, True]
+    decoded = decode_event_file(str(log_root) + '.2019-05-01')
+    assert decoded['log_time'].tolist() == [np.datetime64('2019-05-01T10:00:00').item(),
+                                            np.datetime64('2019-05-01T10:00:30').item()]
+    assert np.allclose(decoded['water_temp'], [25.0, 25.06])
+
+
+def test_day_rollover(tmp_path):
+    log_root = tmp_path / 'pisces.evt'
+    events = [('2019-05-01T23:59:50', make_status(water_temp=25.0)),
+              ('2019-05-02T00:00:00', make_status(water_temp=25.0)),
+              ('2019-05-02T00:00:10', make_status(water_temp=25.1))]
+    lengths = write_events(log_root, events)
+
+    # Each day's file starts with a keyframe, even if nothing changed.
+    assert lengths[1] == lengths[0]
+    assert len(decode_event_file(str(log_root) + '.2019-05-01')) == 1
+    assert len(decode_event_file(str(log_root) + '.2019-05-02')) == 2
+    events_read = read_event_log(str(log_root), start='2019-05-01T23:00:00', end='2019-05-02T01:00:00')
+    assert np.allclose(events_read['water_temp'], [25.0, 25.0, 25.1])
+    # Resampling across midnight carries the status over.
+    samples = read_event_log(str(log_root), start='2019-05-01T23:59:55', end='2019-05-02T00:00:15', interval=5)
+    assert np.allclose(samples['water_temp'], [25.0, 25.0, 25.0, 25.1, 25.1])
+
+
+def test_records_before_first_keyframe_skipped(tmp_path):
+    log_root = tmp_path / 'pisces.evt'
+    events = [('2019-05-01T10:00:{:02d}'.format(second), make_status(water_temp=25 + second / 100,
+                                                                      fan_enabled=second % 20 == 0))
+              for second in range(0, 60, 10)]
+    lengths = write_events(log_root, events, keyframe_interval=30)
+    filename = str(log_root) + '.2019-05-01'
+    with open(filename, 'rb') as event_file:
+        data = event_file.read()
+
+    # Remove the first keyframe, as if the start of the file was lost.
+    header_length = len(data) - sum(lengths)
+    with open(filename, 'wb') as event_file:
+        event_file.write(data[:header_length] + data[header_length + lengths[0]:])
+
+    decoded = decode_event_file(filename)
+    # Decoding picks up again at the next keyframe, 30 s in.
+    assert decoded['log_time'][0] == np.datetime64('2019-05-01T10:00:30')
+    assert np.allclose(decoded['water_temp'], [25.3, 25.4, 25.5])
+    assert decoded['fan_enabled'].tolist() == [False, True, False]
+
+
+def test_incomplete_record_ignored(tmp_path):
+    log_root = tmp_path / 'pisces.evt'
+    events = [('2019-05-01T10:00:00', make_status(water_temp_status='OK')),
+              ('2019-05-01T10:00:10', make_status(water_temp_status='HIGH'))]
+    write_events(log_root, events)
+    filename = str(log_root) + '.2019-05-01'
+    with open(filename, 'rb') as event_file:
+        data = event_file.read()
+    with open(filename, 'wb') as event_file:
+        event_file.write(data[:-2])
+
+    assert len(decode_event_file(filename)) == 1
+
+
+def test_append_after_truncated_record(tmp_path):
+    log_root = tmp_path / 'pisces.evt'
+    filename = str(log_root) + '.2019-05-01'
+    first = [('2019-05-01T10:00:{:02d}'.format(second), make_status(water_temp=25 + second / 100,
+                                                                     water_temp_status='OK'))
+             for second in range(20)]
+    write_events(log_root, first)
+    with open(filename, 'rb') as event_file:
+        data = event_file.read()
+    # Cut the last record short, as if the writer was interrupted.
+    with open(filename, 'wb') as event_file:
+        event_file.write(data[:-1])
+
+    # A restarted writer appends after the last complete record.
+    second = [('2019-05-01T10:01:{:02d}'.format(second), make_status(water_temp=26 + second / 100,
+                                                                      water_temp_status='HIGH'))
+              for second in range(20)]
+    write_events(log_root, second)
+
+    decoded = decode_event_file(filename)
+    expected = first[:-1] + second
+    assert len(decoded) == len(expected)
+    assert np.allclose(decoded['water_temp'], [status['water_temp'] for _, status in expected])
+    assert decoded['water_temp_status'].tolist() == [status['water_temp_status'] for _, status in expected]
+
+
+def test_garbage_record_ignored(tmp_path):
+    log_root = tmp_path / 'pisces.evt'
+    events = [('2019-05-01T10:00:00', make_status(water_temp_status='OK')),
+              ('2019-05-01T10:00:10', make_status(water_temp_status='HIGH'))]
+    write_events(log_root, events)
+    filename = str(log_root) + '.2019-05-01'
+    with open(filename, 'ab') as event_file:
+        # A change record with a string that isn't valid UTF-8.
+        event_file.write(bytes([0x04, 0x0a, 0x02, 0xff, 0xfe]))
+
+    assert len(decode_event_file(filename)) == 2
@@ -0,0 +1,156 @@
+"""Tests for the data log rollups."""
+import math
+
+import numpy as np
+
+import pisces.rollup
+from pisces.binlog import append_records
+from pisces.rollup import Rollup, read_rollup, to_rollup, downsample, combine_bins, read_history
+from pisces.utils import get_log_dtype
+
+
+def make_log_data(times, **columns):
+    """Data log records at the given times, with any other fields given as sequences."""
+    log_data = np.zeros(len(times), dtype=get_log_dtype())
+    log_data['log_time'] = [np.datetime64(log_time, 's') for log_time in times]
+    for name, values in columns.items():
+        log_data[name] = values
+    return log_data
+
+
+def test_bin_boundaries(tmp_path):
+    filename = str(tmp_path / 'rollup.5min')
+    rollup = Rollup(filename, 300)
+    log_data = make_log_data(['2019-05-01T10:00:00', '2019-05-01T10:04:59', '2019-05-01T10:05:00',
+                              '2019-05-01T10:10:00'],
+                             water_temp=[25.0, 26.0, 27.0, 28.0], fan_enabled=[True, False, True, True])
+    for record in log_data:
+        rollup.add(record)
+
+    # A sample on a boundary starts the next bin, and the bin in progress isn't written.
+    written = read_rollup(filename)
+    assert written['log_time'].tolist() == [np.datetime64('2019-05-01T10:00:00').item(),
+                                            np.datetime64('2019-05-01T10:05:00').item()]
+    assert written['n_samples'].tolist() == [2, 1]
+    assert written['water_temp_min'].tolist() == [25.0, 27.0]
+    assert written['water_temp_mean'].tolist() == [25.5, 27.0]
+    assert written['water_temp_max'].tolist() == [26.0, 27.0]
+    assert written['fan_on'].tolist() == [0.5, 1.0]
+
+    rollup.flush()
+    assert len(read_rollup(filename)) == 3
+
+
+def test_nan_samples(tmp_path):
+    filename = str(tmp_path / 'rollup.5min')
+    rollup = Rollup(filename, 300)
+    log_data = make_log_data(['2019-05-01T10:00:00', '2019-05-01T10:01:00', '2019-05-01T10:05:00'],
+                             water_temp=[math.nan, 25.0, math.nan], air_temp=[24.0, 23.0, 22.0])
+    for record in log_data:
+        rollup.add(record)
+    rollup.flush()
+
+    written = read_rollup(filename)
+    # NaN readings are left out of the statistics, but still count as samples.
+    assert written['n_samples'].tolist() == [2, 1]
+    assert written['water_temp_min'][0] == written['water_temp_max'][0] == written['water_temp_mean'][0] == 25.0
+    assert written['air_temp_mean'][0] == 23.5
+    # A bin with no valid readings has NaN statistics.
+    assert np.isnan(written['water_temp_min'][1])
+    assert np.isnan(written['water_temp_mean'][1])
+    assert np.isnan(written['water_temp_max'][1])
+
+
+def test_restart_skips_written_bins(tmp_path):
+    filename = str(tmp_path / 'rollup.5min')
+    log_data = make_log_data(['2019-05-01T10:00:00', '2019-05-01T10:01:00', '2019-05-01T10:05:00',
+                              '2019-05-01T10:06:00'],
+                             water_temp=[25.0, 26.0, 27.0, 28.0])
+    rollup = Rollup(filename, 300)
+    for record in log_data[:3]:
+        rollup.add(record)
+
+    # Catching up after a restart, samples from bins already written are skipped and
+    # the partial bin that wasn't written is rolled up again.
+    rollup = Rollup(filename, 300)
+    for record in log_data:
+        rollup.add(record)
+    rollup.flush()
+
+    written = read_rollup(filename)
+    assert written['n_samples'].tolist() == [2, 2]
+    assert written['water_temp_mean'].tolist() == [25.5, 27.5]
+
+
+def test_downsample_merges_partial_bins():
+    log_data = make_log_data(['2019-05-01T10:00:{:02d}'.format(second) for second in range(5)],
+                             water_temp=[25.0, 26.0, 27.0, 28.0, 29.0], pump_enabled=[True, True, False, False, True])
+    rollup = to_rollup(log_data)
+    rollup['n_samples'][1] = 3
+
+    combined = downsample(rollup, 2)
+    # Groups of three, the last group is the two records left over.
+    assert combined['log_time'].tolist() == [np.datetime64('2019-05-01T10:00:00').item(),
+                                             np.datetime64('2019-05-01T10:00:03').item()]
+    assert combined['n_samples'].tolist() == [5, 2]
+    assert combined['water_temp_min'].tolist() == [25.0, 28.0]
+    assert combined['water_temp_max'].tolist() == [27.0, 29.0]
+    # Means and on fractions are weighted by the number of samples in each record.
+    assert combined['water_temp_mean'][0] == (25.0 + 3 * 26.0 + 27.0) / 5
+    assert combined['pump_on'].tolist() == [4 / 5, 1 / 2]
+    # Already few enough, returned as is.
+    assert downsample(rollup, 5) is rollup
+
+
+def test_downsample_nan():
+    log_data = make_log_data(['2019-05-01T10:00:{:02d}'.format(second) for second in range(4)],
+                             water_temp=[math.nan, 25.0, math.nan, math.nan])
+    combined = downsample(to_rollup(log_data), 2)
+    # NaN records are left out of the statistics, and a bin of only NaN records is NaN.
+    assert combined['water_temp_min'][0] == combined['water_temp_mean'][0] == combined['water_temp_max'][0] == 25.0
+    assert np.isnan(combined['water_temp_min'][1])
+    assert np.isnan(combined['water_temp_mean'][1])
+    assert np.isnan(combined['water_temp_max'][1])
+    assert combined['n_samples'].tolist() == [2, 2]
+
+
+def test_combine_bins_boundaries():
+    log_data = make_log_data(['2019-05-01T10:00:00', '2019-05-01T10:00:09', '2019-05-01T10:00:10',
+                              '2019-05-01T10:00:35'],
+                             water_temp=[25.0, 26.0, 27.0, 28.0])
+    combined = combine_bins(to_rollup(log_data), np.datetime64('2019-05-01T10:00:00'), 10)
+    # A record on a boundary starts the next bin, bins with no records are left out.
+    assert combined['log_time'].tolist() == [np.datetime64('2019-05-01T10:00:00').item(),
+                                             np.datetime64('2019-05-01T10:00:10').item(),
+                                             np.datetime64('2019-05-01T10:00:35').item()]
+    assert combined['n_samples'].tolist() == [2, 1, 1]
+    assert combined['water_temp_mean'].tolist() == [25.5, 27.0, 28.0]
+    assert len(combine_bins(to_rollup(log_data[:0]), np.datetime64('2019-05-01T10:00:00'), 10)) == 0
+
+
+def test_read_history_raw_chunks(tmp_path, monkeypatch):
+    data_file = str(tmp_path / 'pisces.bin')
+    start = np.datetime64('2019-05-01T22:00:00')
+    # A sample a minute for four hours, across midnight.
+    log_data = make_log_data(start + np.arange(240) * np.timedelta64(60, 's'),
+                             water_temp=np.arange(240) / 10, fan_enabled=np.arange(240) % 3 == 0)
+    for day in np.unique(log_data['log_time'].astype('datetime64[D]')):
+        day_data = log_data[log_data['log_time'].astype('datetime64[D]') == day]
+        append_records("{}.{}".format(data_file, day), day_data)
+    end = start + np.timedelta64(4, 'h') - np.timedelta64(1, 's')
+
+    expected = combine_bins(to_rollup(log_data), start, 600)
+    # Chunks that aren't a whole number of bins are rounded up to whole bins.
+    monkeypatch.setattr(pisces.rollup, 'raw_chunk_size', 1000)
+    resolution, history = read_history(data_file, None, start, end, 1000, max_points=24)
+
+    assert resolution == 'raw'
+    assert len(history) == 24
+    assert history['log_time'].tolist() == expected['log_time'].tolist()
+    assert history['n_samples'].tolist() == [10] * 24
+    assert np.allclose(history['water_temp_mean'], expected['water_temp_mean'])
+    assert np.allclose(history['fan_on'], expected['fan_on'])
+
+    # Without max_points every sample is returned.
+    resolution, history = read_history(data_file, None, start, end, 1000)
+    assert len(history) == 240